@@ -1,16 +1,61 @@
-from flask import Flask, request, jsonify, render_template
+import importlib
+
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from flask_cors import CORS
-import json
-import difflib
-import csv
-import io
-import yaml
-from xml_compare import parse_xml_from_string, flatten_elements, compare_xml
-from highlight_util import highlight_xml_strings
+from comparators import (comparator_for, comparator_spec, comparator_specs, load_plugins, Comparison,
+                         ComparisonInputError)
+import comparators
+from diff_encoding import diff_encoding_option, response_differences
+from compression import init_compression
+import json_codec
+from limits import init_limits, difference_limit, collect_limit, cap_differences, body_limit, BudgetExceeded
+from metrics import init_metrics, stage, count
+from profiling import init_profiling
+from serving import init_serving
+from value_store import value_store
+from baseline_store import baseline_store, BaselineError, BaselineNotFound
+
+# Format backends load on first use (see comparators.py); so do these, the modules behind the other routes
+FEATURE_MODULES = ('merge3', 'batch_compare', 'incremental', 'tree_compare', 'stream_compare', 'patch_output',
+                   'binary_compare')
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
+# Accept gzip/deflate/br/zstd request bodies and negotiate compressed responses.
+# Keep this ahead of other after_request hooks so it sees the final body.
+init_compression(app)
+
+# orjson/ujson-backed jsonify() and request.get_json() when installed
+json_codec.init_json_codec(app)
+
+# Body size, difference count and stage time limits
+init_limits(app)
+
+# Bytes of NDJSON gathered before each write of a streamed comparison
+STREAM_FLUSH_SIZE = 64 * 1024
+
+# Opt-in per-stage timings (METRICS=1 or "timings": true) and /metrics
+init_metrics(app)
+
+# X-Profile: cprofile|sample on /compare* requests when PROFILING=1
+init_profiling(app)
+
+# SERVING_MODE=threaded: run big comparisons in a process pool, 503 when saturated.
+# Keep this last so the offloaded requests pass through everything above.
+init_serving(app)
+
+
+def warm_up():
+    """
+    Load every comparator and feature module and run each comparator's
+    sample, so the first requests do not pay for imports. gunicorn.conf.py
+    calls it in the master before forking.
+    """
+    comparators.warm_up()
+    for name in FEATURE_MODULES:
+        importlib.import_module(name)
+
 
 # Landing page
 @app.route('/')
@@ -18,853 +63,622 @@ def landing():
     return render_template('landing.html')
 
 
-# Main compare page
+def run_comparison(fmt):
+    """
+    Serve a two-document comparison request with the format's comparator:
+    parse, compare, highlight and summarize, or produce a patch.
+    """
+    from patch_output import output_options
+    comparator = comparator_for(fmt)
+    field1, field2 = comparator_spec(fmt).fields
+    try:
+        data = request.get_json()
+        try:
+            baseline = load_baseline(data, fmt)
+        except BaselineError as e:
+            return baseline_error(e)
+        comparison = Comparison(baseline.content if baseline else data.get(field1), data.get(field2),
+                                baseline=baseline)
+
+        try:
+            comparator.parse_documents(comparison)
+        except ComparisonInputError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            comparison.options = comparator.options(data)
+            comparison.limit = limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+            encoding = diff_encoding_option(data)
+            comparison.output = output_options(data, request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if comparison.output['output'] == 'patch':
+            # Change set only: no highlighting, no panes
+            patch = comparator.patch(comparison)
+            if patch is None:
+                return jsonify({'error': f"output 'patch' is not available for {comparator.label}"}), 400
+            pieces, mimetype, operations, truncated = patch
+            count('differences', operations)
+            return patch_response(pieces, mimetype, operations, truncated)
+
+        diffs, truncated = cap_differences(comparator.compare(comparison, collect_limit(limit)), limit)
+        count('differences', len(diffs))
+
+        left, right = comparator.highlight(comparison.text1, comparison.text2, diffs, comparison)
+
+        result = {
+            'left': left,
+            'right': right,
+            'differences': response_differences(diffs, encoding),
+            'statistics': comparator.statistics(diffs)
+        }
+
+        if truncated:
+            result['truncated'] = True
+
+        # Keep the parsed inputs so truncated values can be fetched in full
+        if any(d.get('Truncated') for d in diffs):
+            documents = comparator.value_documents(comparison)
+            if documents is not None:
+                result['result_id'] = store_values(*documents)
+
+        return jsonify(result)
+
+    except BudgetExceeded as e:
+        return jsonify({'error': str(e), 'stage': e.stage}), 422
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Main compare page (XML)
 @app.route('/compare', methods=['GET', 'POST'])
 def compare_page():
     if request.method == 'POST':
-        try:
-            data = request.get_json()
-            xml1 = data.get('xml1')
-            xml2 = data.get('xml2')
+        return run_comparison('xml')
+    return render_template('index.html')
+
+
+# Formats registered by COMPARATOR_PLUGINS join the built-in ones
+load_plugins()
 
-            root1, error1 = parse_xml_from_string(xml1)
-            root2, error2 = parse_xml_from_string(xml2)
+# /compare_json, /compare_yaml, /compare_csv, /compare_text and any plugin formats
+# (/compare, which also serves the page, is above)
+for _spec in comparator_specs():
+    if _spec.path != '/compare':
+        app.add_url_rule(_spec.path, f'compare_{_spec.format}', lambda fmt=_spec.format: run_comparison(fmt),
+                         methods=['POST'])
 
-            if error1 or error2:
-                return jsonify({'error': error1 or error2}), 400
 
-            flat1 = flatten_elements(root1)
-            flat2 = flatten_elements(root2)
-            diffs = compare_xml(flat1, flat2)
+# Full value of a truncated JSON/YAML difference
+@app.route('/compare_value', methods=['POST'])
+def compare_value():
+    from json_compare import resolve_key_path
+    try:
+        data = request.get_json()
+        side = data.get('side', 'left')
+        path = data.get('path', '')
+        document = data.get('document')
 
-            left, right = highlight_xml_strings(xml1, xml2, diffs)
+        if side not in ('left', 'right'):
+            return jsonify({'error': "side must be 'left' or 'right'"}), 400
 
-            # Calculate statistics
-            stats = {
-                'total_differences': len(diffs),
-                'missing_tags': len([d for d in diffs if d['Difference Type'] == 'Tag missing']),
-                'extra_tags': len([d for d in diffs if d['Difference Type'] == 'Extra tag']),
-                'attribute_mismatches': len([d for d in diffs if 'Attribute' in d['Difference Type']]),
-                'text_mismatches': len([d for d in diffs if d['Difference Type'] == 'Text mismatch'])
-            }
+        entry = value_store.get(data.get('result_id'))
+        if entry is None:
+            # Result expired or served by another worker: rebuild from the inputs
+            try:
+                entry = value_entry_from_payload(data)
+            except BaselineError as e:
+                return baseline_error(e)
+            except ComparisonInputError as e:
+                return jsonify({'error': f'Invalid input: {str(e)}'}), 400
+            if entry is None:
+                return jsonify({'error': 'Comparison result not found; resend json1/json2 or yaml1/yaml2 '
+                                         '(baseline_id in place of json1/yaml1)'}), 404
+
+        index = entry['documents'].get(document, (None, None))[0 if side == 'left' else 1]
+        if index is None:
+            return jsonify({'error': f'Document not found on the {side} side'}), 404
 
-            return jsonify({
-                'left': left, 
-                'right': right, 
-                'differences': diffs,
-                'statistics': stats
-            })
+        try:
+            value = resolve_key_path(entry[side][index], path)
+        except KeyError:
+            return jsonify({'error': f'Path not found on the {side} side: {path}'}), 404
 
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        return jsonify({'side': side, 'path': path, 'document': document, 'value': value})
 
-    return render_template('index.html')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
-# JSON comparison endpoint
-@app.route('/compare_json', methods=['POST'])
-def compare_json():
+# Three-way merge endpoint: base/ours/theirs in one request
+@app.route('/merge3', methods=['POST'])
+def merge3():
+    from merge3 import merge_xml, merge_json, merge_yaml, merge_text
+    from yaml_compare import dump_yaml_documents
     try:
         data = request.get_json()
-        json1_str = data.get('json1')
-        json2_str = data.get('json2')
+        fmt = data.get('format', 'json')
+        base_str = data.get('base')
+        ours_str = data.get('ours')
+        theirs_str = data.get('theirs')
 
-        # Parse JSON
+        if base_str is None or ours_str is None or theirs_str is None:
+            return jsonify({'error': 'base, ours and theirs are required'}), 400
         try:
-            json1 = json.loads(json1_str)
-            json2 = json.loads(json2_str)
-        except json.JSONDecodeError as e:
-            return jsonify({'error': f'Invalid JSON: {str(e)}'}), 400
-
-        # Compare JSON objects
-        diffs = compare_json_objects(json1, json2)
-        
-        # Highlight differences in JSON strings
-        left, right = highlight_json_strings(json1_str, json2_str, diffs)
-
-        # Calculate statistics
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if fmt == 'xml':
+            comparator = comparator_for('xml')
+            roots = []
+            for name, xml_str in (('base', base_str), ('ours', ours_str), ('theirs', theirs_str)):
+                try:
+                    roots.append(comparator.parse(xml_str))
+                except ComparisonInputError as e:
+                    return jsonify({'error': f'{name}: {str(e)}'}), 400
+            merged, conflicts, ours_changes, theirs_changes = merge_xml(*roots)
+
+        elif fmt in ('json', 'yaml'):
+            comparator = comparator_for(fmt)
+            try:
+                options = comparator.options(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+            try:
+                docs = [comparator.parse(s) for s in (base_str, ours_str, theirs_str)]
+            except ComparisonInputError as e:
+                return jsonify({'error': str(e)}), 400
+            if fmt == 'json':
+                merged_obj, conflicts, ours_changes, theirs_changes = merge_json(*docs, **options)
+                merged = json_codec.dumps_pretty(merged_obj)
+            else:
+                # Every document of each stream
+                streams = [stream[0] for stream in docs]
+                merged_docs, conflicts, ours_changes, theirs_changes = merge_yaml(*streams, **options)
+                merged = dump_yaml_documents(merged_docs)
+
+        elif fmt == 'text':
+            merged, conflicts, ours_changes, theirs_changes = merge_text(base_str, ours_str, theirs_str)
+
+        else:
+            return jsonify({'error': f'Unsupported merge format: {fmt}'}), 400
+
+        # The merge needs every change; the counts cover them all, the lists are capped
         stats = {
-            'total_differences': len(diffs),
-            'missing_items': len([d for d in diffs if d['Difference Type'] == 'Missing']),
-            'extra_items': len([d for d in diffs if d['Difference Type'] == 'Extra']),
-            'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Value mismatch'])
+            'ours_changes': len(ours_changes),
+            'theirs_changes': len(theirs_changes),
+            'conflicts': len(conflicts)
         }
-
-        return jsonify({
-            'left': left,
-            'right': right,
-            'differences': diffs,
+        conflicts_shown, conflicts_truncated = cap_differences(conflicts, limit)
+        ours_shown, ours_truncated = cap_differences(ours_changes, limit)
+        theirs_shown, theirs_truncated = cap_differences(theirs_changes, limit)
+        count('differences', len(ours_shown) + len(theirs_shown))
+
+        result = {
+            'merged': merged,
+            'clean': not conflicts,
+            'conflicts': conflicts_shown,
+            'changes': {'ours': ours_shown, 'theirs': theirs_shown},
             'statistics': stats
-        })
+        }
+        if conflicts_truncated or ours_truncated or theirs_truncated:
+            result['truncated'] = True
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-# Text comparison endpoint
-@app.route('/compare_text', methods=['POST'])
-def compare_text():
+# Batch endpoint: one baseline against many candidates
+@app.route('/compare_batch', methods=['POST'])
+def compare_batch_endpoint():
+    from batch_compare import compare_batch, BatchInputError, BATCH_FORMATS
     try:
         data = request.get_json()
-        text1 = data.get('text1')
-        text2 = data.get('text2')
+        fmt = data.get('format', 'xml')
+        baseline = data.get('baseline')
+        candidates = data.get('candidates') or []
+        include_differences = bool(data.get('include_differences', False))
+
+        if fmt not in BATCH_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(BATCH_FORMATS)}"}), 400
+        try:
+            stored = load_baseline(data, fmt)
+        except BaselineError as e:
+            return baseline_error(e)
+        if stored:
+            baseline = stored.content
+        if baseline is None or not candidates:
+            return jsonify({'error': 'baseline and at least one candidate are required'}), 400
+        if not isinstance(baseline, str) or not isinstance(candidates, list):
+            return jsonify({'error': 'baseline must be a string and candidates a list'}), 400
+
+        # Candidates are plain strings or {"name": ..., "content": ...}
+        named = []
+        for i, candidate in enumerate(candidates):
+            if isinstance(candidate, dict):
+                name, content = str(candidate.get('name', i + 1)), candidate.get('content') or ''
+            else:
+                name, content = str(i + 1), candidate or ''
+            if not isinstance(content, str):
+                return jsonify({'error': f'candidate {name}: content must be a string'}), 400
+            named.append((name, content))
 
-        # Compare text line by line
-        diffs = compare_text_lines(text1, text2)
-        
-        # Highlight differences in text
-        left, right = highlight_text_strings(text1, text2, diffs)
+        try:
+            options = comparator_for(fmt).options(data)
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+            encoding = diff_encoding_option(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            results = compare_batch(fmt, baseline, named, options, include_differences,
+                                    batch_baseline_index(stored, options) if stored else None, limit)
+        except BatchInputError as e:
+            return jsonify({'error': str(e)}), 400
+
+        for result in results:
+            if 'differences' in result:
+                result['differences'] = response_differences(result['differences'], encoding)
 
-        # Calculate statistics
+        compared = [r for r in results if 'error' not in r]
         stats = {
-            'total_differences': len(diffs),
-            'missing_items': len([d for d in diffs if d['Difference Type'] == 'Removed Line']),
-            'extra_items': len([d for d in diffs if d['Difference Type'] == 'Added Line']),
-            'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Modified Line'])
+            'candidates': len(results),
+            'identical': len([r for r in compared if r['statistics']['total_differences'] == 0]),
+            'different': len([r for r in compared if r['statistics']['total_differences'] > 0]),
+            'failed': len(results) - len(compared),
+            'total_differences': sum(r['statistics']['total_differences'] for r in compared)
         }
+        count('differences', stats['total_differences'])
 
-        return jsonify({
-            'left': left,
-            'right': right,
-            'differences': diffs,
-            'statistics': stats
-        })
+        result = {'results': results, 'statistics': stats}
+        if any(r.get('truncated') for r in results):
+            result['truncated'] = True
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-# CSV comparison endpoint
-@app.route('/compare_csv', methods=['POST'])
-def compare_csv():
+def load_baseline(data, fmt):
+    """
+    The stored baseline a request names with baseline_id, or None when it
+    sends its first document itself. Raises BaselineNotFound for an unknown
+    id and BaselineError for a baseline of another format.
+    """
+    ident = data.get('baseline_id')
+    if ident is None:
+        return None
+    with stage('load'):
+        baseline = baseline_store.get(ident)
+    if baseline is None:
+        raise BaselineNotFound(f'Unknown baseline: {ident}')
+    if baseline.format != fmt:
+        raise BaselineError(f'Baseline {ident} is {baseline.format}, not {fmt}')
+    return baseline
+
+
+def baseline_error(e):
+    return jsonify({'error': str(e)}), 404 if isinstance(e, BaselineNotFound) else 400
+
+
+def batch_baseline_index(baseline, options):
+    """A stored baseline in the form batch_compare.index_document() gives"""
+    if baseline.format == 'xml':
+        return baseline_store.xml_flat(baseline, options['normalize'])
+    if baseline.format == 'json':
+        return baseline.index['document']
+    if baseline.format == 'yaml':
+        return baseline.index['documents']
+    from text_compare import index_text
+    return index_text(baseline.content)
+
+
+def patch_response(pieces, mimetype, operations, truncated):
+    """Stream a patch document in STREAM_FLUSH_SIZE blocks, with its operation count in a header"""
+    def generate():
+        block = []
+        size = 0
+        for piece in pieces:
+            block.append(piece)
+            size += len(piece)
+            if size >= STREAM_FLUSH_SIZE:
+                yield ''.join(block)
+                block.clear()
+                size = 0
+        yield ''.join(block)
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['X-Patch-Operations'] = str(operations)
+    if truncated:
+        response.headers['X-Truncated'] = 'true'
+    return response
+
+
+def value_entry(docs1, docs2):
+    from yaml_compare import document_index_map
+    return {'left': docs1, 'right': docs2, 'documents': document_index_map(docs1, docs2)}
+
+
+def store_values(docs1, docs2):
+    """Remember parsed inputs for /compare_value and return their result id"""
+    return value_store.put(value_entry(docs1, docs2))
+
+
+def value_entry_from_payload(data):
+    """
+    Rebuild a /compare_value entry from the comparison's own fields, with
+    the first side read from a stored baseline as run_comparison() reads
+    it; None when the payload has neither. Raises BaselineError and
+    ComparisonInputError.
+    """
+    for fmt in ('json', 'yaml'):
+        field1, field2 = comparator_spec(fmt).fields
+        if data.get(field2) is None or (data.get(field1) is None and data.get('baseline_id') is None):
+            continue
+        comparator = comparator_for(fmt)
+        baseline = load_baseline(data, fmt)
+        comparison = Comparison(baseline.content if baseline else data[field1], data[field2], baseline=baseline)
+        comparator.parse_documents(comparison)
+        return value_entry(*comparator.value_documents(comparison))
+    return None
+
+
+def highlight_session(session, diffs):
+    """Highlighted panes for a session's current texts"""
+    return comparator_for(session.format).highlight(session.text(0), session.text(1), diffs)
+
+
+def session_result(session_id, session, highlight, encoding, limit):
+    diffs, truncated = cap_differences(session.differences(), limit)
+    count('differences', len(diffs))
+    result = {
+        'session_id': session_id,
+        'differences': response_differences(diffs, encoding),
+        'statistics': session.statistics(diffs)
+    }
+    if truncated:
+        result['truncated'] = True
+    # Re-rendering the panes is linear in the document size, so it is opt-in
+    if highlight:
+        result['left'], result['right'] = highlight_session(session, diffs)
+    return result
+
+
+# Incremental comparison: open a session holding both parsed sides
+@app.route('/session', methods=['POST'])
+def create_session_endpoint():
+    from incremental import create_session, sessions, SessionError, SESSION_FORMATS
     try:
         data = request.get_json()
-        csv1_str = data.get('csv1')
-        csv2_str = data.get('csv2')
+        fmt = data.get('format', 'xml')
+        left = data.get('left')
+        right = data.get('right')
+
+        if fmt not in SESSION_FORMATS:
+            return jsonify({'error': f"format must be one of: {', '.join(SESSION_FORMATS)}"}), 400
+        if left is None or right is None:
+            return jsonify({'error': 'left and right are required'}), 400
 
-        # Parse CSV
         try:
-            csv1_data = parse_csv_string(csv1_str)
-            csv2_data = parse_csv_string(csv2_str)
-        except Exception as e:
-            return jsonify({'error': f'Invalid CSV: {str(e)}'}), 400
-
-        # Compare CSV data
-        diffs = compare_csv_data(csv1_data, csv2_data)
-        
-        # Highlight differences in CSV strings
-        left, right = highlight_csv_strings(csv1_str, csv2_str, diffs)
-
-        # Calculate statistics
-        stats = {
-            'total_differences': len(diffs),
-            'missing_items': len([d for d in diffs if d['Difference Type'] == 'Missing Row']),
-            'extra_items': len([d for d in diffs if d['Difference Type'] == 'Extra Row']),
-            'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Cell Value Mismatch'])
-        }
+            # Sessions pair CSV rows by key only
+            options = comparator_for(fmt).options(data) if fmt != 'csv' else {}
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+            encoding = diff_encoding_option(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        return jsonify({
-            'left': left,
-            'right': right,
-            'differences': diffs,
-            'statistics': stats
-        })
+        try:
+            session = create_session(fmt, left, right, options)
+        except SessionError as e:
+            return jsonify({'error': str(e)}), 400
+
+        session_id = sessions.put(session)
+        return jsonify(session_result(session_id, session, bool(data.get('highlight', False)), encoding, limit))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-# YAML comparison endpoint
-@app.route('/compare_yaml', methods=['POST'])
-def compare_yaml():
+# Incremental comparison: apply line edits to one side and re-diff what they touch
+@app.route('/session/<session_id>/patch', methods=['POST'])
+def patch_session_endpoint(session_id):
+    from incremental import sessions, SessionError
     try:
         data = request.get_json()
-        yaml1_str = data.get('yaml1')
-        yaml2_str = data.get('yaml2')
+        session = sessions.get(session_id)
+        if session is None:
+            return jsonify({'error': 'Unknown or expired session'}), 404
+
+        side = {'left': 0, 'right': 1}.get(data.get('side'))
+        if side is None:
+            return jsonify({'error': "side must be 'left' or 'right'"}), 400
 
-        # Parse YAML
         try:
-            yaml1_data = yaml.safe_load(yaml1_str)
-            yaml2_data = yaml.safe_load(yaml2_str)
-        except yaml.YAMLError as e:
-            return jsonify({'error': f'Invalid YAML: {str(e)}'}), 400
-
-        # Compare YAML data (reuse JSON comparison logic)
-        diffs = compare_json_objects(yaml1_data, yaml2_data)
-        
-        # Highlight differences in YAML strings
-        left, right = highlight_yaml_strings(yaml1_str, yaml2_str, diffs)
-
-        # Calculate statistics
-        stats = {
-            'total_differences': len(diffs),
-            'missing_items': len([d for d in diffs if d['Difference Type'] == 'Missing']),
-            'extra_items': len([d for d in diffs if d['Difference Type'] == 'Extra']),
-            'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Value mismatch'])
-        }
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+            encoding = diff_encoding_option(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        return jsonify({
-            'left': left,
-            'right': right,
-            'differences': diffs,
-            'statistics': stats
-        })
+        with session.lock:
+            try:
+                recomputed = session.patch(side, data.get('edits'))
+                result = session_result(session_id, session, bool(data.get('highlight', False)), encoding, limit)
+            except SessionError as e:
+                # The edits are kept; the session recovers once the side parses again
+                return jsonify({'error': str(e), 'session_id': session_id}), 400
+
+        result['recomputed'] = recomputed
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-def compare_json_objects(obj1, obj2, path=""):
-    """Compare two JSON objects and return list of differences"""
-    differences = []
-    
-    def compare_values(val1, val2, current_path):
-        if type(val1) != type(val2):
-            differences.append({
-                'Difference Type': 'Type mismatch',
-                'Key Path': current_path,
-                'Property': f'{type(val1).__name__} vs {type(val2).__name__}'
-            })
-            return
-            
-        if isinstance(val1, dict) and isinstance(val2, dict):
-            all_keys = set(val1.keys()) | set(val2.keys())
-            for key in all_keys:
-                key_path = f"{current_path}.{key}" if current_path else key
-                if key not in val1:
-                    differences.append({
-                        'Difference Type': 'Extra',
-                        'Key Path': key_path,
-                        'Property': str(val2[key])
-                    })
-                elif key not in val2:
-                    differences.append({
-                        'Difference Type': 'Missing',
-                        'Key Path': key_path,
-                        'Property': str(val1[key])
-                    })
-                else:
-                    compare_values(val1[key], val2[key], key_path)
-                    
-        elif isinstance(val1, list) and isinstance(val2, list):
-            max_len = max(len(val1), len(val2))
-            for i in range(max_len):
-                item_path = f"{current_path}[{i}]"
-                if i >= len(val1):
-                    differences.append({
-                        'Difference Type': 'Extra',
-                        'Key Path': item_path,
-                        'Property': str(val2[i])
-                    })
-                elif i >= len(val2):
-                    differences.append({
-                        'Difference Type': 'Missing',
-                        'Key Path': item_path,
-                        'Property': str(val1[i])
-                    })
-                else:
-                    compare_values(val1[i], val2[i], item_path)
-        else:
-            if val1 != val2:
-                differences.append({
-                    'Difference Type': 'Value mismatch',
-                    'Key Path': current_path,
-                    'Property': f'{val1} -> {val2}'
-                })
-    
-    compare_values(obj1, obj2, path)
-    return differences
-
-
-def compare_text_lines(text1, text2):
-    """Compare two text strings line by line and return differences"""
-    lines1 = text1.splitlines()
-    lines2 = text2.splitlines()
-    
-    differences = []
-    
-    # Use difflib.SequenceMatcher for precise line-by-line comparison
-    matcher = difflib.SequenceMatcher(None, lines1, lines2)
-    
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == 'equal':
-            # Lines are identical, skip
-            continue
-        elif tag == 'delete':
-            # Lines removed from file 1 (not present in file 2)
-            for i in range(i1, i2):
-                differences.append({
-                    'Difference Type': 'Removed Line',
-                    'Line Number': f'Line {i + 1}',
-                    'Content': lines1[i].strip()
-                })
-        elif tag == 'insert':
-            # Lines added to file 2 (not present in file 1)
-            for j in range(j1, j2):
-                differences.append({
-                    'Difference Type': 'Added Line',
-                    'Line Number': f'Line {j + 1}',
-                    'Content': lines2[j].strip()
-                })
-        elif tag == 'replace':
-            # Lines are different - analyze more carefully
-            num_lines1 = i2 - i1
-            num_lines2 = j2 - j1
-            
-            if num_lines1 == 1 and num_lines2 == 1:
-                # Single line modification
-                differences.append({
-                    'Difference Type': 'Modified Line',
-                    'Line Number': f'Line {i1 + 1}',
-                    'Content': f'"{lines1[i1].strip()}" → "{lines2[j1].strip()}"'
-                })
-            else:
-                # Multiple lines changed - treat as separate deletions and additions
-                for i in range(i1, i2):
-                    differences.append({
-                        'Difference Type': 'Removed Line',
-                        'Line Number': f'Line {i + 1}',
-                        'Content': lines1[i].strip()
-                    })
-                for j in range(j1, j2):
-                    differences.append({
-                        'Difference Type': 'Added Line',
-                        'Line Number': f'Line {j + 1}',
-                        'Content': lines2[j].strip()
-                    })
-            
-    return differences
-
-
-def highlight_json_strings(json1_str, json2_str, diffs):
-    """Add highlighting to JSON strings based on differences - exact line mapping"""
+# Baseline store: upload a document once, then compare against it by baseline_id
+@app.route('/baselines', methods=['GET', 'POST'])
+def baselines_endpoint():
     try:
-        # Parse and format JSON
-        json1_obj = json.loads(json1_str)
-        json2_obj = json.loads(json2_str)
-        formatted1 = json.dumps(json1_obj, indent=2)
-        formatted2 = json.dumps(json2_obj, indent=2)
-        
-        lines1 = formatted1.split('\n')
-        lines2 = formatted2.split('\n')
-        
-        # Build a map of JSON paths to actual objects for precise value lookup
-        def build_path_to_value_map(obj, path=""):
-            """Build a map from JSON paths to their values"""
-            path_map = {}
-            
-            if isinstance(obj, dict):
-                for key, value in obj.items():
-                    current_path = f"{path}.{key}" if path else key
-                    path_map[current_path] = value
-                    if isinstance(value, (dict, list)):
-                        path_map.update(build_path_to_value_map(value, current_path))
-            elif isinstance(obj, list):
-                for i, item in enumerate(obj):
-                    current_path = f"{path}[{i}]"
-                    path_map[current_path] = item
-                    if isinstance(item, (dict, list)):
-                        path_map.update(build_path_to_value_map(item, current_path))
-            
-            return path_map
-        
-        # Get value maps for both JSON objects
-        path_map1 = build_path_to_value_map(json1_obj)
-        path_map2 = build_path_to_value_map(json2_obj)
-        
-        # Create sets of lines to highlight
-        highlight_lines1 = set()
-        highlight_lines2 = set()
-        
-        for diff in diffs:
-            diff_type = diff['Difference Type']
-            key_path = diff['Key Path']
-            
-            if diff_type == 'Missing':
-                # Find the line in JSON1 that contains this missing value
-                if key_path in path_map1:
-                    value = path_map1[key_path]
-                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
-                    
-                    # Look for the exact line that contains this key-value pair
-                    target_pattern = f'"{key_name}": {json.dumps(value)}'
-                    for i, line in enumerate(lines1):
-                        if target_pattern in line.strip():
-                            highlight_lines1.add(i)
-                            break
-            
-            elif diff_type == 'Value mismatch':
-                # Find lines in both JSON files
-                if key_path in path_map1:
-                    value1 = path_map1[key_path]
-                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
-                    
-                    # Find in JSON1
-                    target_pattern1 = f'"{key_name}": {json.dumps(value1)}'
-                    for i, line in enumerate(lines1):
-                        if target_pattern1 in line.strip():
-                            highlight_lines1.add(i)
-                            break
-                
-                if key_path in path_map2:
-                    value2 = path_map2[key_path]
-                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
-                    
-                    # Find in JSON2
-                    target_pattern2 = f'"{key_name}": {json.dumps(value2)}'
-                    for i, line in enumerate(lines2):
-                        if target_pattern2 in line.strip():
-                            highlight_lines2.add(i)
-                            break
-            
-            elif diff_type == 'Extra':
-                # Find the line in JSON2 that contains this extra value
-                if key_path in path_map2:
-                    value = path_map2[key_path]
-                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
-                    
-                    target_pattern = f'"{key_name}": {json.dumps(value)}'
-                    for i, line in enumerate(lines2):
-                        if target_pattern in line.strip():
-                            highlight_lines2.add(i)
-                            break
-        
-        # Apply highlights
-        highlighted1 = []
-        for i, line in enumerate(lines1):
-            if i in highlight_lines1:
-                highlighted1.append(f'<span class="diff-removed">{line}</span>')
-            else:
-                highlighted1.append(line)
-        
-        highlighted2 = []
-        for i, line in enumerate(lines2):
-            if i in highlight_lines2:
-                highlighted2.append(f'<span class="diff-modified">{line}</span>')
-            else:
-                highlighted2.append(line)
-        
-        return '\n'.join(highlighted1), '\n'.join(highlighted2)
-        
+        if request.method == 'GET':
+            return jsonify({'baselines': baseline_store.list()})
+
+        data = request.get_json()
+        try:
+            with stage('parse'):
+                baseline = baseline_store.put(data.get('format'), data.get('content'), data.get('name'))
+        except BaselineError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(baseline.metadata()), 201
+
     except Exception as e:
-        print(f"Error in JSON highlighting: {e}")
-        import traceback
-        traceback.print_exc()
-        return json1_str, json2_str
-
-
-def highlight_text_strings(text1, text2, diffs):
-    """Add highlighting to text strings based on differences - clean format without line numbers"""
-    import html
-    
-    lines1 = text1.splitlines()
-    lines2 = text2.splitlines()
-    
-    # Use difflib for proper alignment
-    from difflib import SequenceMatcher
-    matcher = SequenceMatcher(None, lines1, lines2)
-    
-    highlighted1 = []
-    highlighted2 = []
-    
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == 'equal':
-            # Lines are identical
-            for i in range(i1, i2):
-                highlighted1.append(html.escape(lines1[i]))
-                highlighted2.append(html.escape(lines2[j1 + (i - i1)]))
-                
-        elif tag == 'delete':
-            # Lines only in first file (removed)
-            for i in range(i1, i2):
-                highlighted1.append(f'<span class="diff-removed">{html.escape(lines1[i])}</span>')
-            # Add empty lines to second file for alignment
-            for _ in range(i1, i2):
-                highlighted2.append('')
-                
-        elif tag == 'insert':
-            # Lines only in second file (added)
-            for j in range(j1, j2):
-                highlighted2.append(f'<span class="diff-added">{html.escape(lines2[j])}</span>')
-            # Add empty lines to first file for alignment
-            for _ in range(j1, j2):
-                highlighted1.append('')
-                
-        elif tag == 'replace':
-            # Lines are different
-            # Handle case where number of lines differ
-            max_lines = max(i2 - i1, j2 - j1)
-            
-            for k in range(max_lines):
-                if k < (i2 - i1):
-                    if k < (j2 - j1):
-                        # Both files have lines - show as modified
-                        highlighted1.append(f'<span class="diff-modified">{html.escape(lines1[i1 + k])}</span>')
-                        highlighted2.append(f'<span class="diff-modified">{html.escape(lines2[j1 + k])}</span>')
-                    else:
-                        # Extra line in file 1 - show as removed
-                        highlighted1.append(f'<span class="diff-removed">{html.escape(lines1[i1 + k])}</span>')
-                        highlighted2.append('')
-                else:
-                    # Extra line in file 2 - show as added
-                    highlighted1.append('')
-                    highlighted2.append(f'<span class="diff-added">{html.escape(lines2[j1 + k])}</span>')
-    
-    return '\n'.join(highlighted1), '\n'.join(highlighted2)
-
-
-def parse_csv_string(csv_str):
-    """Parse CSV string and return list of dictionaries"""
-    csv_file = io.StringIO(csv_str.strip())
-    
-    # Try to detect delimiter
-    sample = csv_str[:1024]
-    delimiter = ','
-    if '\t' in sample and sample.count('\t') > sample.count(','):
-        delimiter = '\t'
-    elif ';' in sample and sample.count(';') > sample.count(','):
-        delimiter = ';'
-    
-    reader = csv.DictReader(csv_file, delimiter=delimiter)
-    data = []
-    for row_num, row in enumerate(reader, start=1):
-        row['__row_number__'] = row_num
-        data.append(row)
-    
-    return data
-
-
-def compare_csv_data(data1, data2):
-    """Compare two CSV datasets and return differences"""
-    differences = []
-    
-    # Get headers
-    headers1 = set(data1[0].keys()) - {'__row_number__'} if data1 else set()
-    headers2 = set(data2[0].keys()) - {'__row_number__'} if data2 else set()
-    
-    # Check for missing/extra columns
-    missing_cols = headers1 - headers2
-    extra_cols = headers2 - headers1
-    
-    for col in missing_cols:
-        differences.append({
-            'Difference Type': 'Missing Column',
-            'Column': col,
-            'Details': f'Column "{col}" exists in CSV 1 but not in CSV 2'
-        })
-    
-    for col in extra_cols:
-        differences.append({
-            'Difference Type': 'Extra Column',
-            'Column': col,
-            'Details': f'Column "{col}" exists in CSV 2 but not in CSV 1'
-        })
-    
-    # Try content-based comparison using first column as identifier
-    common_headers = headers1 & headers2
-    if not common_headers:
-        return differences
-        
-    # Use first column as primary key for matching (usually ID, Name, etc.)
-    header_list = list(common_headers)
-    # Try to find ID column first, otherwise use first available column
-    first_col = None
-    for potential_id in ['ID', 'Id', 'id', 'KEY', 'Key', 'key']:
-        if potential_id in header_list:
-            first_col = potential_id
-            break
-    
-    if not first_col:
-        first_col = sorted(header_list)[0]  # Use first alphabetically if no ID column
-    
-    # Create dictionaries for easier lookup
-    data1_dict = {row[first_col]: row for row in data1}
-    data2_dict = {row[first_col]: row for row in data2}
-    
-    all_keys = set(data1_dict.keys()) | set(data2_dict.keys())
-    
-    for key in all_keys:
-        if key not in data1_dict:
-            # Row exists only in CSV 2
-            row_data = data2_dict[key]
-            differences.append({
-                'Difference Type': 'Extra Row',
-                'Row': str(row_data['__row_number__']),
-                'Key': key,
-                'Details': f'Row with {first_col}="{key}" exists only in CSV 2'
-            })
-        elif key not in data2_dict:
-            # Row exists only in CSV 1
-            row_data = data1_dict[key]
-            differences.append({
-                'Difference Type': 'Missing Row',
-                'Row': str(row_data['__row_number__']),
-                'Key': key,
-                'Details': f'Row with {first_col}="{key}" exists only in CSV 1'
-            })
-        else:
-            # Row exists in both, compare cell values
-            row1 = data1_dict[key]
-            row2 = data2_dict[key]
-            
-            for header in common_headers:
-                val1 = (row1.get(header) or '').strip()
-                val2 = (row2.get(header) or '').strip()
-                if val1 != val2:
-                    differences.append({
-                        'Difference Type': 'Cell Value Mismatch',
-                        'Row1': str(row1['__row_number__']),
-                        'Row2': str(row2['__row_number__']),
-                        'Column': header,
-                        'Key': key,
-                        'Details': f'"{val1}" → "{val2}"'
-                    })
-    
-    return differences
-
-
-def highlight_csv_strings(csv1_str, csv2_str, diffs):
-    """Add highlighting to CSV strings based on differences - highlight only specific cells"""
-    lines1 = csv1_str.strip().splitlines()
-    lines2 = csv2_str.strip().splitlines()
-    
-    # Create mapping of row IDs to differences
-    missing_rows = set()  # Rows completely missing from CSV2
-    added_rows = set()    # Rows completely missing from CSV1 
-    modified_cells = {}   # {row_id: {column: True}}
-    missing_cells = {}    # {row_id: {column: True}} - cells missing in CSV2
-    
-    for diff in diffs:
-        diff_type = diff.get('Difference Type', '')
-        
-        if diff_type == 'Missing Row':
-            key = diff.get('Key', '')
-            missing_rows.add(key)
-        elif diff_type == 'Extra Row':
-            key = diff.get('Key', '')
-            added_rows.add(key)
-        elif diff_type == 'Cell Value Mismatch':
-            key = diff.get('Key', '')
-            column = diff.get('Column', '')
-            
-            if key not in modified_cells:
-                modified_cells[key] = {}
-            modified_cells[key][column] = True
-    
-    # Parse CSV data to identify missing cells (data present in CSV1 but not CSV2)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/baselines/<baseline_id>', methods=['GET', 'DELETE'])
+def baseline_endpoint(baseline_id):
     try:
-        import csv
-        from io import StringIO
-        
-        csv1_data = {}
-        csv2_data = {}
-        
-        # Parse CSV1
-        reader1 = csv.DictReader(StringIO(csv1_str))
-        for row in reader1:
-            row_id = list(row.values())[0] if row else ""
-            csv1_data[row_id] = row
-        
-        # Parse CSV2
-        reader2 = csv.DictReader(StringIO(csv2_str))
-        for row in reader2:
-            row_id = list(row.values())[0] if row else ""
-            csv2_data[row_id] = row
-        
-        # Identify missing cells (present in CSV1 but missing/empty in CSV2)
-        for row_id, row1 in csv1_data.items():
-            if row_id in csv2_data:
-                row2 = csv2_data[row_id]
-                for column, value1 in row1.items():
-                    value2 = row2.get(column, "").strip()
-                    value1 = value1.strip()
-                    
-                    # If CSV1 has data but CSV2 is empty/missing
-                    if value1 and not value2:
-                        if row_id not in missing_cells:
-                            missing_cells[row_id] = {}
-                        missing_cells[row_id][column] = True
-        
+        if request.method == 'DELETE':
+            if not baseline_store.delete(baseline_id):
+                return jsonify({'error': f'Unknown baseline: {baseline_id}'}), 404
+            return jsonify({'deleted': baseline_id})
+
+        baseline = baseline_store.get(baseline_id)
+        if baseline is None:
+            return jsonify({'error': f'Unknown baseline: {baseline_id}'}), 404
+        result = baseline.metadata()
+        if request.args.get('content') in ('1', 'true'):
+            result['content'] = baseline.content
+        return jsonify(result)
+
     except Exception as e:
-        print(f"Error parsing CSV for missing cells: {e}")
-    
-    # Get headers
-    headers1 = [h.strip() for h in lines1[0].split(',')] if lines1 else []
-    headers2 = [h.strip() for h in lines2[0].split(',')] if lines2 else []
-    
-    # Process CSV1 lines
-    highlighted1 = []
-    for i, line in enumerate(lines1):
-        if i == 0:
-            # Header line - no highlighting
-            highlighted1.append(line)
-        else:
-            # Get first column value as row ID
-            import csv
-            from io import StringIO
-            try:
-                reader = csv.reader(StringIO(line))
-                cells = next(reader)
-                row_id = cells[0].strip() if cells else ""
-            except:
-                row_id = line.split(',')[0].strip().strip('"')
-            
-            if row_id in missing_rows:
-                # Entire row missing - highlight red
-                highlighted1.append(f'<span class="diff-removed">{line}</span>')
-            elif row_id in modified_cells or row_id in missing_cells:
-                # Some cells modified or missing - highlight specific cells
-                try:
-                    reader = csv.reader(StringIO(line))
-                    cells = next(reader)
-                    highlighted_parts = []
-                    
-                    for j, cell in enumerate(cells):
-                        if j < len(headers1):
-                            header = headers1[j]
-                            
-                            # Check if this specific cell is missing in CSV2
-                            if row_id in missing_cells and header in missing_cells[row_id]:
-                                highlighted_parts.append(f'<span class="diff-removed">{cell}</span>')
-                            # Check if this specific cell is modified
-                            elif row_id in modified_cells and header in modified_cells[row_id]:
-                                highlighted_parts.append(f'<span class="diff-modified">{cell}</span>')
-                            else:
-                                highlighted_parts.append(cell)
-                        else:
-                            highlighted_parts.append(cell)
-                    
-                    # Join back with commas, preserving CSV format
-                    highlighted_line = ','.join(highlighted_parts)
-                    highlighted1.append(highlighted_line)
-                except:
-                    # Fallback to simple highlighting
-                    highlighted1.append(line)
-            else:
-                highlighted1.append(line)
-    
-    # Process CSV2 lines
-    highlighted2 = []
-    for i, line in enumerate(lines2):
-        if i == 0:
-            # Header line - no highlighting
-            highlighted2.append(line)
-        else:
-            # Get first column value as row ID
-            import csv
-            from io import StringIO
+        return jsonify({'error': str(e)}), 500
+
+
+# Directory/archive tree comparison endpoint
+@app.route('/compare_tree', methods=['POST'])
+def compare_tree_endpoint():
+    from tree_compare import compare_trees, TreeInputError
+    try:
+        archive1 = request.files.get('tree1')
+        archive2 = request.files.get('tree2')
+        if archive1 is None or archive2 is None:
+            return jsonify({'error': 'tree1 and tree2 archives (zip or tar) are required'}), 400
+
+        # Comparison options arrive as a JSON object in the "options" form field
+        try:
+            data = json_codec.loads(request.form.get('options') or '{}')
+            if not isinstance(data, dict):
+                raise ValueError('options must be a JSON object')
+            json_options = comparator_for('json').options(data)
+            options = {'json': json_options, 'yaml': json_options, 'xml': comparator_for('xml').options(data)}
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        include_differences = bool(data.get('include_differences', False))
+
+        try:
+            # Expanded archive contents are held to the same cap as request bodies
+            files, tree, stats = compare_trees(archive1.stream, archive2.stream, options, include_differences,
+                                               limit, max_size=app.config['MAX_CONTENT_LENGTH'])
+        except TreeInputError as e:
+            return jsonify({'error': str(e)}), 400
+        count('differences', stats['total_differences'])
+
+        result = {'files': files, 'tree': tree, 'statistics': stats}
+        if any(f.get('truncated') for f in files):
+            result['truncated'] = True
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Streaming comparison of huge JSON arrays / NDJSON files, answered as NDJSON
+@app.route('/compare_json_stream', methods=['POST'])
+@body_limit('MAX_STREAM_CONTENT_LENGTH')
+def compare_json_stream():
+    from stream_compare import compare_streams, stream_compare_options, StreamInputError
+    try:
+        file1 = request.files.get('file1')
+        file2 = request.files.get('file2')
+        if file1 is None or file2 is None:
+            return jsonify({'error': 'file1 and file2 uploads (JSON array or NDJSON) are required'}), 400
+
+        # Options arrive as a JSON object in the "options" form field
+        try:
+            data = json_codec.loads(request.form.get('options') or '{}')
+            if not isinstance(data, dict):
+                raise ValueError('options must be a JSON object')
+            options = stream_compare_options(data)
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        def generate():
+            statistics = {}
+            lines = []
+            size = 0
             try:
-                reader = csv.reader(StringIO(line))
-                cells = next(reader)
-                row_id = cells[0].strip() if cells else ""
-            except:
-                row_id = line.split(',')[0].strip().strip('"')
-            
-            if row_id in added_rows:
-                # Entire row added - highlight green
-                highlighted2.append(f'<span class="diff-added">{line}</span>')
-            elif row_id in modified_cells:
-                # Some cells modified - highlight specific cells
-                try:
-                    reader = csv.reader(StringIO(line))
-                    cells = next(reader)
-                    highlighted_parts = []
-                    
-                    for j, cell in enumerate(cells):
-                        if j < len(headers2) and headers2[j] in modified_cells[row_id]:
-                            highlighted_parts.append(f'<span class="diff-modified">{cell}</span>')
-                        else:
-                            highlighted_parts.append(cell)
-                    
-                    # Join back with commas, preserving CSV format
-                    highlighted_line = ','.join(highlighted_parts)
-                    highlighted2.append(highlighted_line)
-                except:
-                    # Fallback to simple highlighting
-                    highlighted2.append(line)
+                for diff in compare_streams(file1.stream, file2.stream, options, statistics, limit):
+                    line = json_codec.dumps(diff) + '\n'
+                    lines.append(line)
+                    size += len(line)
+                    # Send differences in blocks rather than one write per line
+                    if size >= STREAM_FLUSH_SIZE:
+                        yield ''.join(lines)
+                        lines.clear()
+                        size = 0
+            except StreamInputError as e:
+                lines.append(json_codec.dumps({'error': str(e), 'statistics': statistics}) + '\n')
             else:
-                highlighted2.append(line)
-    
-    return '\n'.join(highlighted1), '\n'.join(highlighted2)
-
-
-def highlight_yaml_strings(yaml1_str, yaml2_str, diffs):
-    """Add highlighting to YAML strings based on differences"""
-    lines1 = yaml1_str.strip().splitlines()
-    lines2 = yaml2_str.strip().splitlines()
-    
-    highlighted1 = []
-    highlighted2 = []
-    
-    # Collect all differences with their types and paths
-    diff_info = {}
-    for diff in diffs:
-        if 'Key Path' in diff:
-            path = diff['Key Path']
-            diff_type = diff['Difference Type']
-            diff_info[path] = diff_type
-    
-    # Create sets for different types of changes
-    missing_keys = set()
-    extra_keys = set()  
-    modified_keys = set()
-    
-    for path, diff_type in diff_info.items():
-        final_key = path.split('.')[-1]
-        if diff_type == 'Missing':
-            missing_keys.add(final_key)
-        elif diff_type == 'Extra':
-            extra_keys.add(final_key)
-        elif diff_type == 'Value mismatch':
-            modified_keys.add(final_key)
-    
-    # Process file 1 - highlight missing (red) and modified (yellow)
-    for line in lines1:
-        highlighted = False
-        stripped_line = line.strip()
-        
-        # Check for missing keys (should be red in file 1)
-        for key in missing_keys:
-            if f'{key}:' in stripped_line:
-                highlighted1.append(f'<span class="diff-removed">{line}</span>')
-                highlighted = True
-                break
-        
-        if not highlighted:
-            # Check for modified keys (should be yellow in file 1)
-            for key in modified_keys:
-                if f'{key}:' in stripped_line:
-                    highlighted1.append(f'<span class="diff-modified">{line}</span>')
-                    highlighted = True
-                    break
-        
-        if not highlighted:
-            highlighted1.append(line)
-    
-    # Process file 2 - highlight extra (green) and modified (yellow)
-    for line in lines2:
-        highlighted = False
-        stripped_line = line.strip()
-        
-        # Check for extra keys (should be green in file 2)
-        for key in extra_keys:
-            if f'{key}:' in stripped_line:
-                highlighted2.append(f'<span class="diff-added">{line}</span>')
-                highlighted = True
-                break
-        
-        if not highlighted:
-            # Check for modified keys (should be yellow in file 2)
-            for key in modified_keys:
-                if f'{key}:' in stripped_line:
-                    highlighted2.append(f'<span class="diff-modified">{line}</span>')
-                    highlighted = True
-                    break
-        
-        if not highlighted:
-            highlighted2.append(line)
-    
-    return '\n'.join(highlighted1), '\n'.join(highlighted2)
+                lines.append(json_codec.dumps({'statistics': statistics}) + '\n')
+            yield ''.join(lines)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Comparison of two binary uploads by content-defined chunks
+@app.route('/compare_binary', methods=['POST'])
+@body_limit('MAX_STREAM_CONTENT_LENGTH')
+def compare_binary_endpoint():
+    from binary_compare import compare_binary_streams, binary_compare_options
+    try:
+        file1 = request.files.get('file1')
+        file2 = request.files.get('file2')
+        if file1 is None or file2 is None:
+            return jsonify({'error': 'file1 and file2 uploads are required'}), 400
+
+        # Options arrive as a JSON object in the "options" form field
+        try:
+            data = json_codec.loads(request.form.get('options') or '{}')
+            if not isinstance(data, dict):
+                raise ValueError('options must be a JSON object')
+            options = binary_compare_options(data)
+            limit = difference_limit(data, app.config['MAX_DIFFERENCES'])
+            encoding = diff_encoding_option(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        with stage('compare'):
+            diffs, statistics = compare_binary_streams(file1.stream, file2.stream, **options)
+        diffs, truncated = cap_differences(diffs, limit)
+        count('differences', len(diffs))
+
+        result = {'differences': response_differences(diffs, encoding), 'statistics': statistics}
+        if truncated:
+            result['truncated'] = True
+        return jsonify(result)
+
+    except BudgetExceeded as e:
+        return jsonify({'error': str(e), 'stage': e.stage}), 422
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
 if __name__ == '__main__':
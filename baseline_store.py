@@ -0,0 +1,244 @@
+"""
+Persistent store of baseline documents, kept parsed and indexed.
+
+A baseline is uploaded once (POST /baselines) and compare requests then
+name it with "baseline_id" in place of their first document, so that side
+is neither sent nor parsed again. Baselines live in an SQLite database
+(BASELINE_DB, default baselines.db) shared by all workers; each row holds
+the document text and a pickled index of what the comparators and
+highlighters consume:
+
+    xml   flatten_elements() output, per set of normalize rules
+    json  the parsed value and its json_path_map()
+    yaml  the parsed documents and each document's build_line_index()
+    csv   the parse_csv_string() rows
+    text  nothing beyond the text
+
+Baseline ids are derived from the format and content, so uploading the
+same document twice returns the same id. Loaded baselines are kept in a
+per-worker LRU of BASELINE_CACHE_SIZE entries (default 64); comparisons
+only read them.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from comparators import comparator_for, ComparisonInputError
+
+BASELINE_FORMATS = ('xml', 'json', 'yaml', 'csv', 'text')
+
+DEFAULT_BASELINE_DB = 'baselines.db'
+DEFAULT_BASELINE_CACHE_SIZE = 64
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS baselines (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    content TEXT NOT NULL,
+    document_index BLOB NOT NULL
+)
+'''
+
+
+class BaselineError(ValueError):
+    """A baseline could not be stored or used: unknown format, unparsable content, wrong format"""
+
+
+class BaselineNotFound(BaselineError):
+    """No baseline has the requested id"""
+
+
+def baseline_id(fmt, content):
+    """Content-derived id of a baseline"""
+    digest = hashlib.sha256(fmt.encode() + b'\0' + content.encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()[:32]
+
+
+def _normalize_key(normalize):
+    return ','.join(sorted(normalize))
+
+
+def _parse(fmt, content):
+    try:
+        return comparator_for(fmt).parse(content)
+    except ComparisonInputError as e:
+        raise BaselineError(str(e))
+
+
+def index_baseline(fmt, content):
+    """The pre-parsed index of a baseline document; raises BaselineError if it does not parse"""
+    # The format backends are only loaded once a baseline of theirs is stored or compared
+    if fmt == 'xml':
+        from xml_compare import flatten_elements
+        return {'flat': {_normalize_key(()): flatten_elements(_parse(fmt, content))}}
+    if fmt == 'json':
+        from json_compare import json_path_map
+        document = _parse(fmt, content)
+        return {'document': document, 'path_map': json_path_map(document)}
+    if fmt == 'yaml':
+        from yaml_compare import build_line_index
+        docs, nodes = _parse(fmt, content)
+        lines = content.splitlines()
+        # The line indexes are all highlighting needs from the composed nodes
+        return {'documents': docs,
+                'line_indexes': {i: build_line_index(node, lines) for i, node in enumerate(nodes)}}
+    if fmt == 'csv':
+        return {'rows': _parse(fmt, content)}
+    return {}
+
+
+class Baseline:
+    """A stored baseline: its text, metadata and index"""
+
+    __slots__ = ('id', 'name', 'format', 'size', 'created', 'content', 'index')
+
+    def __init__(self, baseline_id, name, fmt, size, created, content, index):
+        self.id = baseline_id
+        self.name = name
+        self.format = fmt
+        self.size = size
+        self.created = created
+        self.content = content
+        self.index = index
+
+    def metadata(self):
+        return {'id': self.id, 'name': self.name, 'format': self.format, 'size': self.size,
+                'created': self.created}
+
+    def flat(self, normalize=frozenset()):
+        """XML: the flattened elements under the given normalize rules, and whether they were just built"""
+        key = _normalize_key(normalize)
+        flat = self.index['flat'].get(key)
+        if flat is not None:
+            return flat, False
+        from xml_compare import flatten_elements
+        flat = flatten_elements(_parse(self.format, self.content), normalize=normalize)
+        self.index['flat'][key] = flat
+        return flat, True
+
+    def yaml_stream(self):
+        """YAML: a parse_yaml_stream() result without the composed nodes"""
+        documents = self.index['documents']
+        return documents, [None] * len(documents)
+
+
+class BaselineStore:
+    """
+    SQLite-backed baselines with a per-worker LRU of loaded entries.
+    Connections are opened lazily, one per thread.
+    """
+
+    def __init__(self, path, cache_size=DEFAULT_BASELINE_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        # A forked process (worker pools) must not share its parent's connection
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(_SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def _remember(self, baseline):
+        with self.lock:
+            self.cache[baseline.id] = baseline
+            self.cache.move_to_end(baseline.id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def put(self, fmt, content, name=None):
+        """Store a baseline, parsing and indexing it; returns the Baseline"""
+        if fmt not in BASELINE_FORMATS:
+            raise BaselineError(f"format must be one of: {', '.join(BASELINE_FORMATS)}")
+        if not isinstance(content, str):
+            raise BaselineError('content must be a string')
+        ident = baseline_id(fmt, content)
+        existing = self.get(ident)
+        if existing is not None:
+            if name is not None and name != existing.name:
+                with self.connection() as connection:
+                    connection.execute('UPDATE baselines SET name = ? WHERE id = ?', (name, ident))
+                existing.name = name
+            return existing
+
+        baseline = Baseline(ident, name, fmt, len(content), time.time(), content, index_baseline(fmt, content))
+        with self.connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO baselines (id, name, format, size, created, content, document_index) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (baseline.id, name, fmt, baseline.size, baseline.created, content,
+                 pickle.dumps(baseline.index, pickle.HIGHEST_PROTOCOL)))
+        self._remember(baseline)
+        return baseline
+
+    def get(self, ident):
+        """The Baseline with this id, or None"""
+        if not ident or not isinstance(ident, str):
+            return None
+        connection = self.connection()
+        with self.lock:
+            baseline = self.cache.get(ident)
+        if baseline is not None:
+            # Another worker may have deleted it
+            if connection.execute('SELECT 1 FROM baselines WHERE id = ?', (ident,)).fetchone():
+                with self.lock:
+                    if ident in self.cache:
+                        self.cache.move_to_end(ident)
+                return baseline
+            with self.lock:
+                self.cache.pop(ident, None)
+            return None
+
+        row = connection.execute(
+            'SELECT id, name, format, size, created, content, document_index FROM baselines WHERE id = ?',
+            (ident,)).fetchone()
+        if row is None:
+            return None
+        baseline = Baseline(*row[:6], pickle.loads(row[6]))
+        self._remember(baseline)
+        return baseline
+
+    def xml_flat(self, baseline, normalize=frozenset()):
+        """Baseline.flat(), saving a newly built rule set's elements for the other workers"""
+        flat, built = baseline.flat(normalize)
+        if built:
+            self.save_index(baseline)
+        return flat
+
+    def save_index(self, baseline):
+        """Persist an index that grew after loading (e.g. another normalize rule set)"""
+        with self.connection() as connection:
+            connection.execute('UPDATE baselines SET document_index = ? WHERE id = ?',
+                               (pickle.dumps(baseline.index, pickle.HIGHEST_PROTOCOL), baseline.id))
+
+    def list(self):
+        """Metadata of every stored baseline, newest first"""
+        rows = self.connection().execute(
+            'SELECT id, name, format, size, created FROM baselines ORDER BY created DESC').fetchall()
+        return [{'id': row[0], 'name': row[1], 'format': row[2], 'size': row[3], 'created': row[4]}
+                for row in rows]
+
+    def delete(self, ident):
+        """Remove a baseline; False if there was none"""
+        with self.lock:
+            self.cache.pop(ident, None)
+        with self.connection() as connection:
+            return connection.execute('DELETE FROM baselines WHERE id = ?', (ident,)).rowcount > 0
+
+
+baseline_store = BaselineStore(os.environ.get('BASELINE_DB') or DEFAULT_BASELINE_DB,
+                               int(os.environ.get('BASELINE_CACHE_SIZE') or DEFAULT_BASELINE_CACHE_SIZE))
@@ -0,0 +1,114 @@
+import yaml
+
+import json_codec
+from limits import cap_differences, collect_limit
+from json_compare import compare_json_objects, json_statistics
+from text_compare import index_text, compare_indexed_text, text_statistics
+from worker_pool import max_workers, parallel_map
+from xml_compare import parse_xml_from_string, flatten_elements, compare_xml, xml_statistics
+from yaml_compare import parse_yaml_stream, compare_yaml_documents
+
+BATCH_FORMATS = ('xml', 'json', 'yaml', 'text')
+
+# Below this combined candidate size, the batch runs in-process
+PARALLEL_MIN_BYTES = 256 * 1024
+
+
+class BatchInputError(ValueError):
+    """The baseline itself could not be parsed"""
+
+
+def index_document(fmt, content, options=None):
+    """
+    Parse a document into the form its comparator consumes: the flattened
+    element dict for XML, the parsed object for JSON, the document list for
+    YAML and the index_text() lines for text. Raises ValueError on invalid
+    input.
+    """
+    if fmt == 'xml':
+        root, error = parse_xml_from_string(content)
+        if error:
+            raise ValueError(error)
+        return flatten_elements(root, normalize=(options or {}).get('normalize', frozenset()))
+    if fmt == 'json':
+        try:
+            return json_codec.loads(content)
+        except json_codec.JSONDecodeError as e:
+            raise ValueError(f'Invalid JSON: {str(e)}')
+    if fmt == 'yaml':
+        try:
+            return parse_yaml_stream(content)[0]
+        except yaml.YAMLError as e:
+            raise ValueError(f'Invalid YAML: {str(e)}')
+    return index_text(content)
+
+
+def compare_indexed(fmt, baseline_index, candidate_index, options, max_differences=None):
+    """
+    Run the format's comparator on two indexed documents, keeping at most
+    max_differences; returns (diffs, stats, truncated)
+    """
+    limit = collect_limit(max_differences)
+    if fmt == 'xml':
+        # XML options were applied while indexing
+        diffs = compare_xml(baseline_index, candidate_index, limit)
+        statistics = xml_statistics
+    elif fmt == 'json':
+        diffs = compare_json_objects(baseline_index, candidate_index, max_differences=limit, **options)
+        statistics = json_statistics
+    elif fmt == 'yaml':
+        diffs = compare_yaml_documents(baseline_index, candidate_index, max_differences=limit, **options)
+        statistics = json_statistics
+    else:
+        diffs = compare_indexed_text(baseline_index, candidate_index, limit)
+        statistics = text_statistics
+    diffs, truncated = cap_differences(diffs, max_differences)
+    return diffs, statistics(diffs), truncated
+
+
+def compare_candidate_chunk(task):
+    """Compare a chunk of candidates against the baseline; runs in a pool worker"""
+    fmt, baseline_index, candidates, options, include_differences, max_differences = task
+    results = []
+    for name, content in candidates:
+        try:
+            candidate_index = index_document(fmt, content, options)
+        except ValueError as e:
+            results.append({'name': name, 'error': str(e)})
+            continue
+        diffs, stats, truncated = compare_indexed(fmt, baseline_index, candidate_index, options, max_differences)
+        result = {'name': name, 'statistics': stats}
+        if include_differences:
+            result['differences'] = diffs
+        if truncated:
+            result['truncated'] = True
+        results.append(result)
+    return results
+
+
+def compare_batch(fmt, baseline, candidates, options=None, include_differences=False, baseline_index=None,
+                  max_differences=None):
+    """
+    Compare one baseline against many (name, content) candidates.
+    The baseline is parsed and indexed once, unless its index_document()
+    form is passed as baseline_index; candidates are split into chunks
+    that are compared in the process pool for large batches. Each
+    candidate keeps at most max_differences differences.
+    Raises BatchInputError if the baseline is invalid.
+    """
+    options = options or {}
+    if baseline_index is None:
+        try:
+            baseline_index = index_document(fmt, baseline, options)
+        except ValueError as e:
+            raise BatchInputError(f'baseline: {e}')
+
+    # A couple of chunks per worker balances load while pickling the baseline few times
+    chunk_count = max(1, min(len(candidates), max_workers() * 2))
+    chunk_size = -(-len(candidates) // chunk_count)
+    tasks = [(fmt, baseline_index, candidates[i:i + chunk_size], options, include_differences, max_differences)
+             for i in range(0, len(candidates), chunk_size)]
+
+    total_size = sum(len(content) for _, content in candidates)
+    results = parallel_map(compare_candidate_chunk, tasks, parallel=total_size >= PARALLEL_MIN_BYTES)
+    return [result for chunk in results for result in chunk]
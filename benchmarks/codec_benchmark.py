@@ -0,0 +1,76 @@
+"""
+Throughput of the JSON codec backends on multi-MB payloads.
+
+    python benchmarks/codec_benchmark.py [--size-mb 8] [--repeat 5]
+
+Measures parsing the inputs, pretty-printing for the panes and encoding a
+/compare_json-sized response for every installed backend.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_codec  # noqa: E402
+
+
+def make_document(size_mb, seed=1):
+    rng = random.Random(seed)
+    records = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        record = {
+            'id': len(records),
+            'name': f'item-{rng.randrange(10 ** 6)}',
+            'price': round(rng.uniform(0, 1000), 2),
+            'tags': [f'tag{rng.randrange(50)}' for _ in range(rng.randrange(1, 6))],
+            'attributes': {f'attr{k}': rng.randrange(1000) for k in range(rng.randrange(1, 8))},
+            'active': rng.random() < 0.5,
+        }
+        records.append(record)
+        size += len(json.dumps(record))
+    return {'records': records}
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    document = make_document(args.size_mb)
+    text = json.dumps(document)
+    diffs = [{'Difference Type': 'Value mismatch', 'Key Path': f'records[{i}].price', 'Property': '1.0 -> 2.0'}
+             for i in range(len(document['records']))]
+    response = {'left': text, 'right': text, 'differences': diffs}
+    mb = len(text) / (1024 * 1024)
+
+    print(f'payload: {mb:.1f} MB, {len(diffs)} differences')
+    print(f'{"backend":<8} {"loads MB/s":>12} {"pretty MB/s":>12} {"response MB/s":>14}')
+
+    for backend in ('json', 'ujson', 'orjson'):
+        if backend != 'json' and getattr(json_codec, backend) is None:
+            continue
+        json_codec.BACKEND = backend
+        loads = best_of(lambda: json_codec.loads(text), args.repeat)
+        pretty = best_of(lambda: json_codec.dumps_pretty(document), args.repeat)
+        encoded = best_of(lambda: json_codec.dumps(response), args.repeat)
+        response_mb = len(json_codec.dumps(response)) / (1024 * 1024)
+        print(f'{backend:<8} {mb / loads:>12.1f} {mb / pretty:>12.1f} {response_mb / encoded:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
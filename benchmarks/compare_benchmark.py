@@ -0,0 +1,206 @@
+"""
+Per-stage latency, throughput and peak memory of every comparator.
+
+    python benchmarks/compare_benchmark.py [--formats xml,json] [--size-kb 512]
+        [--depth 3] [--density 0.05] [--repeat 5] [--save results.json]
+        [--baseline results.json] [--threshold 10]
+
+Each format runs the same pipeline as its endpoint (parse, flatten,
+compare, highlight, serialize) on a generated pair from corpus.py. Stages
+are timed --repeat times; peak memory comes from one extra run under
+tracemalloc. With --baseline, p50 latencies are compared against saved
+results and the exit status is 1 if any stage regressed by more than
+--threshold percent.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_codec  # noqa: E402
+from json_compare import compare_json_objects, highlight_json_strings, json_statistics  # noqa: E402
+from corpus import FORMATS, generate_pair  # noqa: E402
+from csv_compare import parse_csv_string, compare_csv_data, highlight_csv_strings, csv_statistics  # noqa: E402
+from highlight_util import highlight_xml_strings  # noqa: E402
+from text_compare import compare_text_lines, highlight_text_strings, text_statistics  # noqa: E402
+from xml_compare import parse_xml_from_string, flatten_elements, compare_xml, xml_statistics  # noqa: E402
+from yaml_compare import parse_yaml_stream, compare_yaml_documents, highlight_yaml_strings  # noqa: E402
+
+
+def xml_parse(s):
+    root1, error1 = parse_xml_from_string(s['left'])
+    root2, error2 = parse_xml_from_string(s['right'])
+    if error1 or error2:
+        raise ValueError(error1 or error2)
+    return {'root1': root1, 'root2': root2}
+
+
+def response(statistics):
+    """The serialize stage: encode the body the endpoint would return"""
+    def stage(s):
+        body = {'left': s['highlighted'][0], 'right': s['highlighted'][1],
+                'differences': s['diffs'], 'statistics': statistics(s['diffs'])}
+        return {'body': json_codec.dumps(body)}
+    return stage
+
+
+# Stages per format; each takes the state so far and returns what it adds
+PIPELINES = {
+    'xml': [
+        ('parse', xml_parse),
+        ('flatten', lambda s: {'flat1': flatten_elements(s['root1']), 'flat2': flatten_elements(s['root2'])}),
+        ('compare', lambda s: {'diffs': compare_xml(s['flat1'], s['flat2'])}),
+        ('highlight', lambda s: {'highlighted': highlight_xml_strings(s['left'], s['right'], s['diffs'])}),
+        ('serialize', response(xml_statistics)),
+    ],
+    'json': [
+        ('parse', lambda s: {'obj1': json_codec.loads(s['left']), 'obj2': json_codec.loads(s['right'])}),
+        ('compare', lambda s: {'diffs': compare_json_objects(s['obj1'], s['obj2'])}),
+        ('highlight', lambda s: {'highlighted': highlight_json_strings(
+            s['left'], s['right'], s['diffs'], s['obj1'], s['obj2'])}),
+        ('serialize', response(json_statistics)),
+    ],
+    'yaml': [
+        ('parse', lambda s: {'stream1': parse_yaml_stream(s['left']), 'stream2': parse_yaml_stream(s['right'])}),
+        ('compare', lambda s: {'diffs': compare_yaml_documents(
+            s['stream1'][0], s['stream2'][0], input_size=len(s['left']) + len(s['right']))}),
+        ('highlight', lambda s: {'highlighted': highlight_yaml_strings(
+            s['left'], s['right'], s['diffs'], s['stream1'], s['stream2'])}),
+        ('serialize', response(json_statistics)),
+    ],
+    'csv': [
+        ('parse', lambda s: {'rows1': parse_csv_string(s['left']), 'rows2': parse_csv_string(s['right'])}),
+        ('compare', lambda s: {'diffs': compare_csv_data(s['rows1'], s['rows2'])}),
+        ('highlight', lambda s: {'highlighted': highlight_csv_strings(s['left'], s['right'], s['diffs'])}),
+        ('serialize', response(csv_statistics)),
+    ],
+    'text': [
+        ('compare', lambda s: {'diffs': compare_text_lines(s['left'], s['right'])}),
+        ('highlight', lambda s: {'highlighted': highlight_text_strings(s['left'], s['right'], s['diffs'])}),
+        ('serialize', response(text_statistics)),
+    ],
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * pct // 100) - 1))]
+
+
+def peak_memory(fn, state):
+    tracemalloc.start()
+    try:
+        fn(state)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_pipeline(fmt, left, right, repeat, memory=True):
+    """Time every stage of one format; returns {stage: metrics}"""
+    state = {'left': left, 'right': right}
+    input_mb = (len(left.encode()) + len(right.encode())) / (1024 * 1024)
+    results = {}
+    for stage, fn in PIPELINES[fmt]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = fn(state)
+            timings.append(time.perf_counter() - start)
+        p50 = percentile(timings, 50)
+        results[stage] = {
+            'p50_ms': round(p50 * 1000, 3),
+            'p99_ms': round(percentile(timings, 99) * 1000, 3),
+            'mb_per_s': round(input_mb / p50, 2) if p50 else None,
+        }
+        if memory:
+            results[stage]['peak_mb'] = round(peak_memory(fn, state) / (1024 * 1024), 2)
+        state.update(output)
+    results['total'] = {
+        'p50_ms': round(sum(r['p50_ms'] for r in results.values()), 3),
+        'differences': len(state['diffs']),
+        'input_mb': round(input_mb, 3),
+    }
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """Print the p50 change of every stage; returns the regressed stages"""
+    regressions = []
+    print(f'\n{"format":<6} {"stage":<10} {"baseline ms":>12} {"now ms":>10} {"change":>8}')
+    for fmt, stages in results.items():
+        for stage, metrics in stages.items():
+            before = baseline.get(fmt, {}).get(stage)
+            if stage == 'total' or not before or not before.get('p50_ms'):
+                continue
+            change = (metrics['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append((fmt, stage))
+            print(f'{fmt:<6} {stage:<10} {before["p50_ms"]:>12.2f} {metrics["p50_ms"]:>10.2f} {change:>+7.1f}%{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--formats', default=','.join(FORMATS), help='comma-separated')
+    parser.add_argument('--size-kb', type=float, default=256, help='size of each side')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--density', type=float, default=0.05, help='fraction of leaves changed')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--baseline', help='saved results to compare against')
+    parser.add_argument('--threshold', type=float, default=10, help='regression threshold in percent')
+    args = parser.parse_args()
+
+    formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(sorted(unknown))}")
+
+    config = {'size_kb': args.size_kb, 'depth': args.depth, 'density': args.density,
+              'seed': args.seed, 'repeat': args.repeat}
+    print(f'size {args.size_kb:g} KB/side, depth {args.depth}, density {args.density:g}, '
+          f'repeat {args.repeat}, codec {json_codec.BACKEND}, python {platform.python_version()}')
+    print(f'{"format":<6} {"stage":<10} {"p50 ms":>10} {"p99 ms":>10} {"MB/s":>9} {"peak MB":>9}')
+
+    results = {}
+    for fmt in formats:
+        left, right = generate_pair(fmt, args.size_kb, args.depth, args.density, args.seed)
+        results[fmt] = run_pipeline(fmt, left, right, args.repeat, memory=not args.no_memory)
+        for stage, m in results[fmt].items():
+            if stage == 'total':
+                print(f'{fmt:<6} {"total":<10} {m["p50_ms"]:>10.2f} {"":>10} {"":>9} {"":>9}'
+                      f'  ({m["differences"]} differences)')
+                continue
+            peak = f'{m["peak_mb"]:.1f}' if 'peak_mb' in m else '-'
+            print(f'{fmt:<6} {stage:<10} {m["p50_ms"]:>10.2f} {m["p99_ms"]:>10.2f} '
+                  f'{m["mb_per_s"] or 0:>9.1f} {peak:>9}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'config': config, 'codec': json_codec.BACKEND,
+                       'python': platform.python_version(), 'results': results}, f, indent=2)
+        print(f'\nsaved {args.save}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved.get('config') != config:
+            print(f'\nwarning: baseline was recorded with {saved.get("config")}')
+        if compare_to_baseline(results, saved.get('results', {}), args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Deterministic synthetic document pairs for every comparator.
+
+    python benchmarks/corpus.py --format xml --size-kb 512 --out /tmp/corpus
+
+Both sides are rendered from the same generated records; the right side
+has a fraction (the diff density) of leaf values changed and of records
+removed or inserted. The same seed always gives the same pair.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+import yaml
+
+FORMATS = ('xml', 'json', 'yaml', 'csv', 'text')
+
+EXTENSIONS = {'xml': '.xml', 'json': '.json', 'yaml': '.yaml', 'csv': '.csv', 'text': '.txt'}
+
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel',
+         'india', 'juliet', 'kilo', 'lima', 'mike', 'november', 'oscar', 'papa')
+
+# Leaves per nesting level of a record
+FIELDS_PER_LEVEL = 4
+
+
+def make_leaf(rng):
+    kind = rng.randrange(4)
+    if kind == 0:
+        return rng.randrange(10 ** 6)
+    if kind == 1:
+        return round(rng.uniform(0, 1000), 2)
+    if kind == 2:
+        return rng.random() < 0.5
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(1, 5)))
+
+
+def make_record(rng, index, depth):
+    record = {'id': index}
+    node = record
+    for level in range(depth):
+        for field in range(FIELDS_PER_LEVEL):
+            node[f'field{level}_{field}'] = make_leaf(rng)
+        if level < depth - 1:
+            node['detail'] = {}
+            node = node['detail']
+    return record
+
+
+def mutate(value, rng, density):
+    """A copy of a record with each leaf changed with probability density"""
+    if isinstance(value, dict):
+        return {key: child if key == 'id' else mutate(child, rng, density) for key, child in value.items()}
+    if rng.random() >= density:
+        return value
+    if isinstance(value, bool):
+        return not value
+    if isinstance(value, (int, float)):
+        return value + 1
+    return value + ' ' + rng.choice(WORDS)
+
+
+def flatten_record(record, prefix=''):
+    row = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            row.update(flatten_record(value, f'{prefix}{key}_'))
+        else:
+            row[prefix + key] = value
+    return row
+
+
+def render_xml(records):
+    def element(tag, value, indent):
+        pad = '  ' * indent
+        if isinstance(value, dict):
+            inner = ''.join(element(k, v, indent + 1) for k, v in value.items())
+            return f'{pad}<{tag}>\n{inner}{pad}</{tag}>\n'
+        return f'{pad}<{tag}>{escape(str(value))}</{tag}>\n'
+
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<catalog>\n']
+    for record in records:
+        fields = {k: v for k, v in record.items() if k != 'id'}
+        # The first level is written as attributes, the rest as nested elements
+        attrs = ''.join(f' {k}={quoteattr(str(v))}' for k, v in fields.items() if not isinstance(v, dict))
+        inner = ''.join(element(k, v, 2) for k, v in fields.items() if isinstance(v, dict))
+        parts.append(f'  <item id="{record["id"]}"{attrs}>\n{inner}  </item>\n')
+    parts.append('</catalog>\n')
+    return ''.join(parts)
+
+
+def render_csv(records):
+    rows = [flatten_record(record) for record in records]
+    headers = list(dict.fromkeys(key for row in rows for key in row))
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=headers, lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def render_text(records):
+    lines = []
+    for record in records:
+        row = flatten_record(record)
+        lines.append(f'record {row.pop("id")}')
+        lines.extend(f'    {key}: {value}' for key, value in row.items())
+    return '\n'.join(lines) + '\n'
+
+
+def render(fmt, records):
+    if fmt == 'xml':
+        return render_xml(records)
+    if fmt == 'json':
+        return json.dumps({'records': records}, indent=2)
+    if fmt == 'yaml':
+        return yaml.safe_dump({'records': records}, sort_keys=False, default_flow_style=False)
+    if fmt == 'csv':
+        return render_csv(records)
+    return render_text(records)
+
+
+def generate_pair(fmt, size_kb=256, depth=3, density=0.05, seed=1):
+    """
+    Return (left, right) documents of roughly size_kb each, with records
+    nested depth levels deep and about density of their leaves changed.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    rng = random.Random(seed)
+    # Size a record (without the document wrapper) and generate enough to reach the target
+    sample = [make_record(random.Random(seed), i, depth) for i in range(2)]
+    record_size = len(render(fmt, sample)) - len(render(fmt, sample[:1]))
+    count = max(1, int(size_kb * 1024 / max(1, record_size)))
+    left = [make_record(rng, i, depth) for i in range(count)]
+
+    right = []
+    next_id = count
+    for record in left:
+        roll = rng.random()
+        if roll < density / 4:
+            continue
+        right.append(mutate(record, rng, density))
+        if roll > 1 - density / 4:
+            right.append(make_record(rng, next_id, depth))
+            next_id += 1
+    return render(fmt, left), render(fmt, right)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--format', choices=FORMATS, default='json')
+    parser.add_argument('--size-kb', type=float, default=256)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--density', type=float, default=0.05, help='fraction of leaves changed')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='.', help='directory for left/right files')
+    args = parser.parse_args()
+
+    left, right = generate_pair(args.format, args.size_kb, args.depth, args.density, args.seed)
+    os.makedirs(args.out, exist_ok=True)
+    for side, content in (('left', left), ('right', right)):
+        path = os.path.join(args.out, side + EXTENSIONS[args.format])
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        print(f'{path}: {len(content) / 1024:.0f} KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""
+Throughput, tail latency, errors and worker memory under concurrent mixed traffic.
+
+    python benchmarks/load_test.py [--mix json:90:1-16,xml:5:512-2048,csv:5:512-2048]
+        [--concurrency 16] [--duration 30 | --requests 1000] [--workers 2]
+        [--serving-mode sync|threaded] [--url http://host:port] [--save results.json]
+
+Unless --url names a running server, the app is started the way it is
+deployed, app:app under gunicorn with gunicorn.conf.py, on a free local
+port. --concurrency client threads then send requests back to back, each
+picking a format by weight from --mix and one of that format's payloads.
+A mix entry is format:weight:min-max, the sizes of each side in KB;
+--payloads pairs per format are generated with corpus.py before the run,
+their sizes drawn log-uniformly from the range.
+
+Reported per format and overall: requests per second, latency percentiles,
+error rate (any response other than 2xx, or no response) and status codes.
+For a server it started, the resident memory of each gunicorn worker (and
+offload pool process) is sampled while the run lasts: after warm-up, at
+its peak and at the end. The clients share the host with the server, so
+leave CPUs free for them when measuring capacity.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import json_codec  # noqa: E402
+from comparators import comparator_spec  # noqa: E402
+from corpus import FORMATS, generate_pair  # noqa: E402
+
+DEFAULT_MIX = 'json:90:1-16,xml:5:512-2048,csv:5:512-2048'
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Seconds to wait for a started server to answer
+STARTUP_TIMEOUT = 120
+
+
+def parse_mix(spec):
+    """[(format, weight, min_kb, max_kb)] from "format:weight:min-max,..."; raises ValueError"""
+    mix = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        try:
+            fmt, weight, sizes = entry.strip().split(':')
+            low, _, high = sizes.partition('-')
+            weight, low, high = float(weight), float(low), float(high or low)
+        except ValueError:
+            raise ValueError(f'mix entry {entry.strip()!r} is not format:weight:min-max') from None
+        if fmt not in FORMATS:
+            raise ValueError(f"mix format must be one of: {', '.join(FORMATS)}")
+        if weight <= 0 or not 0 < low <= high:
+            raise ValueError(f'mix entry {entry.strip()!r} needs a positive weight and 0 < min <= max')
+        mix.append((fmt, weight, low, high))
+    if not mix:
+        raise ValueError('mix is empty')
+    return mix
+
+
+def make_payloads(mix, count, depth, density, seed):
+    """{format: [(size_kb, request body)]}, the bodies JSON-encoded once up front"""
+    rng = random.Random(seed)
+    payloads = {}
+    for fmt, _, low, high in mix:
+        field1, field2 = comparator_spec(fmt).fields
+        bodies = []
+        for i in range(count):
+            size_kb = math.exp(rng.uniform(math.log(low), math.log(high)))
+            left, right = generate_pair(fmt, size_kb, depth, density, seed + i)
+            bodies.append((size_kb, json_codec.dumps({field1: left, field2: right}).encode()))
+        payloads[fmt] = bodies
+    return payloads
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * pct / 100) - 1))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, workers, serving_mode, threads, worker_timeout, log):
+    """Start gunicorn on port and wait until it answers; returns the master process"""
+    env = dict(os.environ)
+    if serving_mode == 'threaded':
+        env['SERVING_MODE'] = 'threaded'
+        if threads:
+            env['SERVING_THREADS'] = str(threads)
+    else:
+        env.pop('SERVING_MODE', None)
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers)]
+    if worker_timeout:
+        command += ['--timeout', str(worker_timeout)]
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError(f'gunicorn did not answer within {STARTUP_TIMEOUT} s')
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def process_tree(root):
+    """{pid: role} of root's workers ('worker') and their children ('offload'), from /proc"""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # The command name is in parentheses and may contain spaces
+                parents[int(name)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    workers = {pid for pid, parent in parents.items() if parent == root}
+    roles = {pid: 'worker' for pid in workers}
+    roles.update((pid, 'offload') for pid, parent in parents.items() if parent in workers)
+    return roles
+
+
+def resident_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """Samples the resident memory of a gunicorn master's workers until stopped"""
+
+    def __init__(self, master, interval):
+        super().__init__(daemon=True)
+        self.master = master
+        self.interval = interval
+        self.processes = {}
+        self.stopped = threading.Event()
+
+    def sample(self):
+        for pid, role in process_tree(self.master).items():
+            rss = resident_kb(pid)
+            if rss is None:
+                continue
+            process = self.processes.setdefault(pid, {'pid': pid, 'role': role, 'start_mb': rss / 1024})
+            process['peak_mb'] = max(process.get('peak_mb', 0), rss / 1024)
+            process['end_mb'] = rss / 1024
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return sorted(self.processes.values(), key=lambda p: (p['role'] != 'worker', p['pid']))
+
+
+def post(host, port, connection, path, body):
+    """Send one request; returns (connection to reuse or None, status or exception name, bytes received)"""
+    try:
+        if connection is None:
+            connection = http.client.HTTPConnection(host, port, timeout=600)
+        connection.request('POST', path, body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        received = len(response.read())
+        if response.will_close:
+            connection.close()
+            connection = None
+        return connection, response.status, received
+    except (OSError, http.client.HTTPException) as e:
+        if connection is not None:
+            connection.close()
+        return None, type(e).__name__, 0
+
+
+def stop_condition(requests, duration):
+    """A function that turns true after requests calls, or else after duration seconds"""
+    if requests:
+        budget = itertools.count()
+        return lambda: next(budget) >= requests
+    deadline = time.monotonic() + duration
+    return lambda: time.monotonic() >= deadline
+
+
+def run_client(host, port, plan, payloads, rng, stop, results):
+    """Send requests until stop() is true; appends (format, status, seconds, sent, received) to results"""
+    connection = None
+    formats, weights = plan
+    while not stop():
+        fmt = rng.choices(formats, weights)[0]
+        _, body = rng.choice(payloads[fmt])
+        start = time.perf_counter()
+        connection, status, received = post(host, port, connection, comparator_spec(fmt).path, body)
+        results.append((fmt, status, time.perf_counter() - start, len(body), received))
+    if connection is not None:
+        connection.close()
+
+
+def summarize(results, elapsed):
+    """{format: metrics} plus 'all'"""
+    groups = defaultdict(list)
+    for result in results:
+        groups[result[0]].append(result)
+        groups['all'].append(result)
+    summary = {}
+    for name, group in groups.items():
+        latencies = [r[2] for r in group]
+        errors = sum(1 for r in group if not (isinstance(r[1], int) and 200 <= r[1] < 300))
+        summary[name] = {
+            'requests': len(group),
+            'errors': errors,
+            'error_rate': round(errors / len(group), 4),
+            'requests_per_s': round(len(group) / elapsed, 2),
+            'sent_mb_per_s': round(sum(r[3] for r in group) / elapsed / (1024 * 1024), 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 1),
+            **{f'p{pct:g}_ms': round(percentile(latencies, pct) * 1000, 1) for pct in PERCENTILES},
+            'max_ms': round(max(latencies) * 1000, 1),
+            'statuses': dict(Counter(str(r[1]) for r in group)),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='format:weight:min-max KB, comma separated')
+    parser.add_argument('--concurrency', type=int, default=16, help='client threads')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--requests', type=int, help='total requests to send instead of --duration')
+    parser.add_argument('--payloads', type=int, default=4, help='generated pairs per format')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--density', type=float, default=0.05, help='fraction of leaves changed')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help='target a running server instead of starting one')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers of a started server')
+    parser.add_argument('--serving-mode', choices=('sync', 'threaded'), default='sync')
+    parser.add_argument('--threads', type=int, help='SERVING_THREADS in threaded mode')
+    parser.add_argument('--worker-timeout', type=int, help="gunicorn --timeout (default gunicorn's)")
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='seconds between memory samples')
+    parser.add_argument('--max-error-rate', type=float, help='exit with status 1 above this percentage')
+    parser.add_argument('--save', help='write results as JSON')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.concurrency < 1 or args.payloads < 1:
+        parser.error('--concurrency and --payloads must be at least 1')
+
+    print(f'generating {args.payloads} payload(s) per format ...')
+    payloads = make_payloads(mix, args.payloads, args.depth, args.density, args.seed)
+    for fmt, bodies in payloads.items():
+        sizes = ', '.join(f'{len(body) / 1024:.0f}' for _, body in sorted(bodies))
+        print(f'  {fmt:<5} request KB: {sizes}')
+
+    server = log = sampler = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = '127.0.0.1', free_port()
+        log = tempfile.NamedTemporaryFile('w+', prefix='load_test_', suffix='.log', delete=False)
+        print(f'starting gunicorn: {args.workers} {args.serving_mode} worker(s) on port {port}, log {log.name}')
+        server = start_server(port, args.workers, args.serving_mode, args.threads, args.worker_timeout, log)
+
+    try:
+        # Warm-up: one request per format, so workers have served each before memory is sampled
+        for fmt, _, _, _ in mix:
+            _, body = min(payloads[fmt])
+            connection, _, _ = post(host, port, None, comparator_spec(fmt).path, body)
+            if connection is not None:
+                connection.close()
+        if server is not None:
+            sampler = MemorySampler(server.pid, args.sample_interval)
+            sampler.sample()
+            sampler.start()
+
+        plan = ([m[0] for m in mix], [m[1] for m in mix])
+        stop = stop_condition(args.requests, args.duration)
+        results = []
+        clients = [threading.Thread(target=run_client, daemon=True,
+                                    args=(host, port, plan, payloads, random.Random(args.seed + i), stop, results))
+                   for i in range(args.concurrency)]
+        print(f'running {args.concurrency} client(s) for '
+              + (f'{args.requests} requests' if args.requests else f'{args.duration:g} s') + ' ...')
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+        processes = sampler.stop() if sampler else []
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    if not results:
+        print('no requests completed')
+        return 1
+    summary = summarize(results, elapsed)
+
+    print(f'\n{"format":<6} {"requests":>8} {"req/s":>8} {"errors":>7} {"mean ms":>9} '
+          + ' '.join(f'{"p" + format(pct, "g") + " ms":>9}' for pct in PERCENTILES) + f' {"max ms":>9}')
+    for name in [m[0] for m in mix if m[0] in summary] + ['all']:
+        m = summary[name]
+        print(f'{name:<6} {m["requests"]:>8} {m["requests_per_s"]:>8.2f} {m["error_rate"] * 100:>6.1f}% '
+              f'{m["mean_ms"]:>9.1f} ' + ' '.join(f'{m[f"p{pct:g}_ms"]:>9.1f}' for pct in PERCENTILES)
+              + f' {m["max_ms"]:>9.1f}')
+    print(f'\n{elapsed:.1f} s, {summary["all"]["requests_per_s"]:.2f} req/s, '
+          f'{summary["all"]["sent_mb_per_s"]:.2f} MB/s sent; statuses {summary["all"]["statuses"]}')
+
+    if processes:
+        print(f'\n{"pid":>8} {"role":<8} {"start MB":>9} {"peak MB":>9} {"end MB":>9} {"growth MB":>10}')
+        for p in processes:
+            p['growth_mb'] = p['end_mb'] - p['start_mb']
+            print(f'{p["pid"]:>8} {p["role"]:<8} {p["start_mb"]:>9.1f} {p["peak_mb"]:>9.1f} '
+                  f'{p["end_mb"]:>9.1f} {p["growth_mb"]:>+10.1f}')
+
+    if args.save:
+        config = {key: value for key, value in vars(args).items() if key not in ('save', 'max_error_rate')}
+        with open(args.save, 'w') as f:
+            json.dump({'config': config, 'codec': json_codec.BACKEND, 'python': platform.python_version(),
+                       'elapsed_s': round(elapsed, 2), 'results': summary,
+                       'processes': [{k: round(v, 1) if isinstance(v, float) else v for k, v in p.items()}
+                                     for p in processes]}, f, indent=2)
+        print(f'\nsaved {args.save}')
+
+    if args.max_error_rate is not None and summary['all']['error_rate'] * 100 > args.max_error_rate:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""
+Compare two binary files by content-defined chunks.
+
+    python binary_compare.py firmware-1.0.bin firmware-1.1.bin [--chunk-size 8192]
+
+Both inputs are read a block at a time and cut into chunks where their
+content says so rather than at fixed offsets: a cut falls after a two-byte
+marker whose preceding 32-byte window has a CRC-32 divisible by the
+sampling divisor, at least chunk_size / 4 and at most 8 * chunk_size bytes
+after the previous cut. Markers are found with bytes.translate() and
+bytes.find(), so the window hash is only computed where a marker occurs.
+An insertion or deletion therefore changes only the chunks around it, and
+the chunks after it line up again.
+
+Chunks are matched by SHA-256, so a comparison is linear in the input size
+and holds one block and a digest per chunk in memory. Differences are
+chunk-aligned byte ranges: bytes of the first file that are gone (Removed
+Bytes), new bytes of the second (Added Bytes) and ranges replaced in place
+(Modified Bytes). delta_bytes is how much of the second file a delta
+against the first would have to carry as literal bytes.
+"""
+import argparse
+import hashlib
+import io
+import sys
+import zlib
+from array import array
+
+import json_codec
+from limits import cap_differences, check_budget
+
+DEFAULT_CHUNK_SIZE = 8 * 1024
+MIN_CHUNK_SIZE = 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Bytes before a cut whose CRC-32 decides it
+WINDOW_SIZE = 32
+
+# Marker bytes: a byte of the first class followed by one of the second,
+# on average once every 256 bytes of random data. Zero is in the first
+# class, so a cut can follow the end of a run of padding.
+_ORDER = sorted(range(1, 256), key=lambda b: hashlib.sha256(bytes([b])).digest())
+_MARKS = bytearray(256)
+for _b in [0] + _ORDER[:15]:
+    _MARKS[_b] = 1
+for _b in _ORDER[15:31]:
+    _MARKS[_b] = 2
+_MARKS = bytes(_MARKS)
+_MARKER = b'\x01\x02'
+_MARKER_RATE = 256
+
+
+def binary_compare_options(data):
+    """Read and validate binary comparison options from a request payload or CLI arguments"""
+    chunk_size = data.get('chunk_size', DEFAULT_CHUNK_SIZE)
+    if (not isinstance(chunk_size, int) or isinstance(chunk_size, bool)
+            or not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE):
+        raise ValueError(f'chunk_size must be an integer from {MIN_CHUNK_SIZE} to {MAX_CHUNK_SIZE}')
+    return {'chunk_size': chunk_size}
+
+
+class Chunker:
+    """Cuts a byte stream, fed block by block, into content-defined chunks"""
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.min_size = chunk_size // 4
+        self.max_size = chunk_size * 8
+        # Keep one marker in this many, so chunks average about chunk_size
+        self.divisor = max(1, round((chunk_size - self.min_size) / _MARKER_RATE))
+        self.buffer = b''
+        self.marks = b''
+        # Stream offset of buffer[0], and where in buffer the marker search resumes
+        self.offset = 0
+        self.search = 0
+
+    def feed(self, block):
+        """Yield (digest, offset, length) for each chunk this block completes"""
+        self.buffer += block
+        self.marks += block.translate(_MARKS)
+        return self._chunks(final=False)
+
+    def finish(self):
+        """Yield the chunks left at the end of the stream"""
+        return self._chunks(final=True)
+
+    def _chunks(self, final):
+        buffer, marks = self.buffer, self.marks
+        view = memoryview(buffer)
+        length = len(buffer)
+        find, crc32, sha256 = marks.find, zlib.crc32, hashlib.sha256
+        min_size, max_size, divisor = self.min_size, self.max_size, self.divisor
+        start = 0
+        search = self.search
+        try:
+            while start < length:
+                limit = start + max_size
+                cut = None
+                i = find(_MARKER, max(search, start + min_size - 2))
+                while i != -1 and i + 2 <= limit:
+                    end = i + 2
+                    if crc32(view[end - WINDOW_SIZE:end]) % divisor == 0:
+                        cut = end
+                        break
+                    i = find(_MARKER, i + 1)
+                if cut is None:
+                    if limit <= length:
+                        cut = limit
+                    elif final:
+                        cut = length
+                    else:
+                        # A marker may straddle the next block
+                        search = length - 1
+                        break
+                yield sha256(view[start:cut]).digest(), self.offset + start, cut - start
+                start = cut
+                search = start
+        finally:
+            view.release()
+        self.buffer = buffer[start:]
+        self.marks = marks[start:]
+        self.offset += start
+        self.search = max(0, search - start)
+
+
+def chunk_stream(fileobj, chunk_size=DEFAULT_CHUNK_SIZE, block_size=READ_BLOCK_SIZE):
+    """Yield (digest, offset, length) for the content-defined chunks of a binary file object"""
+    chunker = Chunker(chunk_size)
+    for block in iter(lambda: fileobj.read(block_size), b''):
+        check_budget()
+        yield from chunker.feed(block)
+    yield from chunker.finish()
+
+
+def _range(diff_type, offset1, length1, offset2, length2):
+    return {'Difference Type': diff_type, 'Offset1': offset1, 'Length1': length1,
+            'Offset2': offset2, 'Length2': length2}
+
+
+def compare_binary_streams(file1, file2, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compare two binary file objects by content-defined chunks.
+    Returns (differences, statistics), differences ordered by offset in the
+    first file.
+    """
+    # The first file: chunk start offsets (plus its size), and where each digest occurs
+    offsets1 = array('Q')
+    digests1 = []
+    first = {}
+    next_same = array('l')
+    last = {}
+    size1 = 0
+    for index, (digest, offset, length) in enumerate(chunk_stream(file1, chunk_size)):
+        offsets1.append(offset)
+        digests1.append(digest)
+        size1 = offset + length
+        next_same.append(-1)
+        if digest in last:
+            next_same[last[digest]] = index
+        else:
+            first[digest] = index
+        last[digest] = index
+    chunks1 = len(offsets1)
+    del last
+
+    # The second file: each chunk's match in the first. A chunk that occurs
+    # more than once pairs with the copy following the previous match, else
+    # with the first unused copy, else with the first copy
+    cursor = dict(first)
+    used1 = bytearray(chunks1)
+    offsets2 = array('Q')
+    match2 = array('l')
+    size2 = 0
+    previous = -1
+    for digest, offset, length in chunk_stream(file2, chunk_size):
+        offsets2.append(offset)
+        size2 = offset + length
+        following = previous + 1
+        if following < chunks1 and not used1[following] and digests1[following] == digest:
+            index = following
+        else:
+            index = cursor.get(digest)
+            if index is None:
+                match2.append(-1)
+                continue
+            while index != -1 and used1[index]:
+                index = next_same[index]
+            cursor[digest] = index
+            if index == -1:
+                index = first[digest]
+        used1[index] = 1
+        match2.append(index)
+        previous = index
+    chunks2 = len(offsets2)
+    del digests1, first, cursor, next_same
+    offsets1.append(size1)
+    offsets2.append(size2)
+
+    diffs = []
+    # A range of the first file replaced in place is not also reported removed
+    replaced1 = bytearray(chunks1)
+    # Offset in the second file just past the copy of each used chunk of the first
+    after2 = array('Q', bytes(8 * chunks1))
+    previous = -1
+    copies = 0
+    matched_bytes = 0
+    j = 0
+    while j < chunks2:
+        index = match2[j]
+        if index != -1:
+            after2[index] = offsets2[j + 1]
+            matched_bytes += offsets2[j + 1] - offsets2[j]
+            if j == 0 or index != match2[j - 1] + 1 or match2[j - 1] == -1:
+                copies += 1
+            previous = index
+            j += 1
+            continue
+        run_end = j
+        while run_end < chunks2 and match2[run_end] == -1:
+            run_end += 1
+        # The unclaimed chunks of the first file after the previous match
+        # (up to the next one, if it lies ahead) are what this run replaced
+        following = match2[run_end] if run_end < chunks2 else chunks1
+        gap_start = gap_end = previous + 1
+        while (gap_end < chunks1 and not (used1[gap_end] or replaced1[gap_end])
+               and (gap_end < following or following <= gap_start)):
+            gap_end += 1
+        if gap_end > gap_start:
+            replaced1[gap_start:gap_end] = b'\x01' * (gap_end - gap_start)
+            diffs.append(_range('Modified Bytes', offsets1[gap_start], offsets1[gap_end] - offsets1[gap_start],
+                                offsets2[j], offsets2[run_end] - offsets2[j]))
+        else:
+            diffs.append(_range('Added Bytes', offsets1[gap_start], 0,
+                                offsets2[j], offsets2[run_end] - offsets2[j]))
+        j = run_end
+
+    k = 0
+    while k < chunks1:
+        if used1[k] or replaced1[k]:
+            k += 1
+            continue
+        run_end = k
+        while run_end < chunks1 and not (used1[run_end] or replaced1[run_end]):
+            run_end += 1
+        diffs.append(_range('Removed Bytes', offsets1[k], offsets1[run_end] - offsets1[k],
+                            after2[k - 1] if k else 0, 0))
+        k = run_end
+
+    diffs.sort(key=lambda d: (d['Offset1'], d['Offset2']))
+    added = sum(d['Length2'] for d in diffs if d['Difference Type'] == 'Added Bytes')
+    modified2 = sum(d['Length2'] for d in diffs if d['Difference Type'] == 'Modified Bytes')
+    statistics = {
+        'total_differences': len(diffs),
+        'missing_items': len([d for d in diffs if d['Difference Type'] == 'Removed Bytes']),
+        'extra_items': len([d for d in diffs if d['Difference Type'] == 'Added Bytes']),
+        'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Modified Bytes']),
+        'size1': size1,
+        'size2': size2,
+        'chunks1': chunks1,
+        'chunks2': chunks2,
+        'matched_bytes': matched_bytes,
+        'delta_bytes': added + modified2,
+        'copy_operations': copies,
+    }
+    return diffs, statistics
+
+
+def compare_binary_data(data1, data2, chunk_size=DEFAULT_CHUNK_SIZE):
+    """compare_binary_streams() for two in-memory byte strings"""
+    return compare_binary_streams(io.BytesIO(data1), io.BytesIO(data2), chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file1')
+    parser.add_argument('file2')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='average chunk size in bytes (default %(default)s)')
+    parser.add_argument('--max-differences', type=int)
+    args = parser.parse_args()
+
+    try:
+        options = binary_compare_options({'chunk_size': args.chunk_size})
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        with open(args.file1, 'rb') as file1, open(args.file2, 'rb') as file2:
+            diffs, statistics = compare_binary_streams(file1, file2, **options)
+    except OSError as e:
+        parser.error(str(e))
+    diffs, truncated = cap_differences(diffs, args.max_differences)
+    for diff in diffs:
+        sys.stdout.write(json_codec.dumps(diff) + '\n')
+    sys.stdout.write(json_codec.dumps({'statistics': statistics, 'truncated': truncated}) + '\n')
+    return 1 if statistics['total_differences'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
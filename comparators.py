@@ -0,0 +1,180 @@
+"""
+Registry of document comparators, one per format.
+
+Each format is a Comparator subclass that owns the stages of a two-document
+comparison: options() reads its request options, parse_documents() turns
+both sides into documents, compare() diffs them, highlight() renders the
+panes, statistics() summarizes, and patch() produces the change set.
+app.py serves every registered format through one route at its path, so
+limits, timings, baselines, compact encoding and patch output apply to all
+formats alike.
+
+Formats are registered by name with the "module:Class" that implements
+them, and the module is imported the first time the format is used, so a
+worker does not load the YAML or CSV backends it never serves.
+warm_up() loads every format and runs a small sample comparison through
+it, so code that is imported or built on first use (expat, the difflib and
+regex caches) is loaded too; gunicorn.conf.py calls it in the master so
+workers fork warm.
+
+Further formats are added with register_comparator() from a module listed
+in COMPARATOR_PLUGINS (comma separated), which app.py imports before it
+adds the routes.
+"""
+import importlib
+import os
+import threading
+from collections import namedtuple
+
+from metrics import stage
+
+ComparatorSpec = namedtuple('ComparatorSpec', 'format target path fields')
+
+_specs = {}
+_comparators = {}
+_lock = threading.Lock()
+
+
+class ComparisonInputError(ValueError):
+    """A side of a comparison could not be parsed"""
+
+
+class Comparison:
+    """
+    The state of one comparison request: both texts, their parsed documents,
+    the stored baseline standing in for the first side (if any) and the
+    options read by the comparator.
+    """
+
+    __slots__ = ('text1', 'text2', 'doc1', 'doc2', 'baseline', 'options', 'output', 'limit')
+
+    def __init__(self, text1, text2, doc1=None, doc2=None, baseline=None, options=None):
+        self.text1 = text1
+        self.text2 = text2
+        self.doc1 = doc1
+        self.doc2 = doc2
+        self.baseline = baseline
+        self.options = options or {}
+        self.output = None
+        self.limit = None
+
+
+class Comparator:
+    """
+    Base class of a format's comparator. Each stage method times itself
+    ('parse', 'compare', 'highlight'), directly or through the functions
+    it calls.
+    """
+
+    format = None
+    # Name used in messages
+    label = None
+    # A small (text1, text2) pair that warm_up() compares
+    sample = None
+
+    def options(self, data):
+        """Read and validate this format's options from a request payload; raises ValueError"""
+        return {}
+
+    def parse(self, text):
+        """The document compare() consumes; raises ComparisonInputError"""
+        return text
+
+    def baseline_document(self, baseline):
+        """parse()'s result for a stored baseline, from its index"""
+        return self.parse(baseline.content)
+
+    def parse_documents(self, comparison):
+        """Set comparison.doc1 and doc2, the first from the stored baseline when there is one"""
+        with stage('parse'):
+            if comparison.baseline is not None:
+                comparison.doc1 = self.baseline_document(comparison.baseline)
+            else:
+                comparison.doc1 = self.parse(comparison.text1)
+            comparison.doc2 = self.parse(comparison.text2)
+
+    def compare(self, comparison, max_differences=None):
+        """The list of differences, stopping once max_differences are found"""
+        raise NotImplementedError
+
+    def highlight(self, text1, text2, diffs, comparison=None):
+        """The (left, right) panes; comparison, when given, holds the parsed documents"""
+        raise NotImplementedError
+
+    def statistics(self, diffs):
+        raise NotImplementedError
+
+    def patch(self, comparison):
+        """
+        The change set for output 'patch', as (pieces, mimetype, operations,
+        truncated), or None when the format has none.
+        """
+        return None
+
+    def value_documents(self, comparison):
+        """(documents1, documents2) whose values /compare_value can serve, or None"""
+        return None
+
+    def warm_up(self):
+        """Run the sample through every stage, loading what the first request would"""
+        if self.sample is None:
+            return
+        comparison = Comparison(*self.sample, options=self.options({}))
+        self.parse_documents(comparison)
+        diffs = self.compare(comparison)
+        self.highlight(comparison.text1, comparison.text2, diffs, comparison)
+        self.statistics(diffs)
+
+
+def register_comparator(fmt, target, path=None, fields=None):
+    """
+    Register a format. target is "module:Class"; path defaults to
+    /compare_<format> and fields, the request fields of both sides,
+    to <format>1 and <format>2.
+    """
+    spec = ComparatorSpec(fmt, target, path or f'/compare_{fmt}', tuple(fields or (f'{fmt}1', f'{fmt}2')))
+    with _lock:
+        _specs[fmt] = spec
+        _comparators.pop(fmt, None)
+    return spec
+
+
+register_comparator('xml', 'xml_compare:XmlComparator', '/compare')
+register_comparator('json', 'json_compare:JsonComparator')
+register_comparator('yaml', 'yaml_compare:YamlComparator')
+register_comparator('csv', 'csv_compare:CsvComparator')
+register_comparator('text', 'text_compare:TextComparator')
+
+
+def comparator_specs():
+    return list(_specs.values())
+
+
+def comparator_spec(fmt):
+    """The registration of a format; KeyError if unregistered"""
+    return _specs[fmt]
+
+
+def comparator_for(fmt):
+    """The format's Comparator, importing its module on first use; KeyError if unregistered"""
+    comparator = _comparators.get(fmt)
+    if comparator is None:
+        spec = _specs[fmt]
+        module_name, _, class_name = spec.target.partition(':')
+        comparator = getattr(importlib.import_module(module_name), class_name)()
+        with _lock:
+            comparator = _comparators.setdefault(fmt, comparator)
+    return comparator
+
+
+def load_plugins():
+    """Import the modules named in COMPARATOR_PLUGINS, which register their formats"""
+    for name in (os.environ.get('COMPARATOR_PLUGINS') or '').split(','):
+        if name.strip():
+            importlib.import_module(name.strip())
+
+
+def warm_up():
+    """Load every registered format"""
+    for spec in comparator_specs():
+        comparator_for(spec.format).warm_up()
@@ -0,0 +1,306 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional backend
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional backend
+    zstandard = None
+
+from flask import current_app, jsonify, request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+# Bytes pulled from the compressed stream per read
+READ_CHUNK_SIZE = 64 * 1024
+
+# Responses smaller than this are sent as-is
+DEFAULT_MIN_SIZE = 1024
+
+# Brotli bodies are only accepted where each step's output can be capped (brotli 1.2+)
+_BROTLI_BOUNDED = brotli is not None and hasattr(brotli.Decompressor, 'can_accept_more_data')
+
+# What the decoders raise on a corrupt body
+_DECODE_ERRORS = ((zlib.error,) + ((brotli.error,) if brotli is not None else ())
+                  + ((zstandard.ZstdError,) if zstandard is not None else ()))
+
+
+class InvalidRequestBody(BadRequest):
+    """A compressed request body that does not decode"""
+
+
+class DecompressingStream:
+    """
+    File-like wrapper that inflates a compressed request body on demand,
+    so the body is never held in memory in both compressed and raw form.
+    Inflating past max_size raises RequestEntityTooLarge; a corrupt or
+    truncated body raises InvalidRequestBody (a 400).
+    """
+
+    def __init__(self, raw, decoder, max_size=None, encoding=None):
+        self.raw = raw
+        self.decoder = decoder
+        self.encoding = encoding
+        self.max_size = max_size
+        self.decoded = 0
+        self.buffer = bytearray()
+        self.eof = False
+
+    def _append(self, data):
+        self.decoded += len(data)
+        if self.max_size is not None and self.decoded > self.max_size:
+            raise RequestEntityTooLarge()
+        self.buffer += data
+
+    def _fill(self, size):
+        try:
+            while not self.eof and (size < 0 or len(self.buffer) < size):
+                if self.decoder.has_pending():
+                    self._append(self.decoder.decompress(b''))
+                    continue
+                chunk = self.raw.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    self._append(self.decoder.flush())
+                    self.eof = True
+                    if not self.decoder.finished():
+                        raise InvalidRequestBody(f'Invalid {self.encoding} request body: truncated')
+                    break
+                self._append(self.decoder.decompress(chunk))
+        except _DECODE_ERRORS:
+            self.eof = True
+            raise InvalidRequestBody(f'Invalid {self.encoding} request body') from None
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0 or size >= len(self.buffer):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while b'\n' not in self.buffer and not self.eof:
+            self._fill(len(self.buffer) + READ_CHUNK_SIZE)
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        if 0 <= size < end:
+            end = size
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class _ZlibDecoder:
+    # Cap output per step so a tiny bomb cannot expand unchecked
+    MAX_OUTPUT = 16 * READ_CHUNK_SIZE
+
+    def __init__(self, wbits):
+        self.obj = zlib.decompressobj(wbits)
+
+    def has_pending(self):
+        return bool(self.obj.unconsumed_tail)
+
+    def decompress(self, data):
+        return self.obj.decompress(self.obj.unconsumed_tail + data, self.MAX_OUTPUT)
+
+    def flush(self):
+        return self.obj.flush()
+
+    def finished(self):
+        return self.obj.eof
+
+
+class _BrotliDecoder:
+    MAX_OUTPUT = _ZlibDecoder.MAX_OUTPUT
+
+    def __init__(self):
+        self.obj = brotli.Decompressor()
+
+    def has_pending(self):
+        # Output held back by the limit is drained before more input is given
+        return not self.obj.is_finished() and not self.obj.can_accept_more_data()
+
+    def decompress(self, data):
+        return self.obj.process(data, output_buffer_limit=self.MAX_OUTPUT)
+
+    def flush(self):
+        return b''
+
+    def finished(self):
+        return self.obj.is_finished()
+
+
+class _ZstdDecoder:
+    MAX_OUTPUT = _ZlibDecoder.MAX_OUTPUT
+    # decompressobj() has no output limit, so input is fed a few bytes at a
+    # time: a block header and one byte can stand for a 128 KB block, so 32
+    # bytes inflate to at most about 1.4 MB
+    INPUT_STEP = 32
+
+    def __init__(self):
+        self.obj = zstandard.ZstdDecompressor().decompressobj()
+        self.pending = b''
+        self.offset = 0
+
+    def has_pending(self):
+        return self.offset < len(self.pending) and not self.finished()
+
+    def decompress(self, data):
+        if data:
+            self.pending = self.pending[self.offset:] + data
+            self.offset = 0
+        output = []
+        size = 0
+        while self.offset < len(self.pending) and size < self.MAX_OUTPUT and not self.finished():
+            piece = self.obj.decompress(self.pending[self.offset:self.offset + self.INPUT_STEP])
+            self.offset += self.INPUT_STEP
+            output.append(piece)
+            size += len(piece)
+        return b''.join(output)
+
+    def flush(self):
+        return b''
+
+    def finished(self):
+        # eof is missing from older zstandard releases
+        return getattr(self.obj, 'eof', True)
+
+
+def _decoder_for(encoding):
+    if encoding in ('gzip', 'x-gzip'):
+        return _ZlibDecoder(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        # Auto-detect zlib header vs. raw deflate
+        return _ZlibDecoder(32 + zlib.MAX_WBITS)
+    if encoding == 'br' and _BROTLI_BOUNDED:
+        return _BrotliDecoder()
+    if encoding == 'zstd' and zstandard is not None:
+        return _ZstdDecoder()
+    return None
+
+
+def supported_encodings():
+    """Content codings this server can both accept and produce, best first"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.extend(['gzip', 'deflate'])
+    return encodings
+
+
+def compress_bytes(data, encoding, level=None):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level or 3).compress(data)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level or 5)
+    if encoding == 'gzip':
+        obj = zlib.compressobj(level or 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return obj.compress(data) + obj.flush()
+    if encoding == 'deflate':
+        return zlib.compress(data, level or 6)
+    raise ValueError(f'Unsupported content encoding: {encoding}')
+
+
+class DecompressionMiddleware:
+    """
+    WSGI middleware that decodes Content-Encoding'd request bodies before
+    Flask sees them. The decoded length is unknown up front, so the stream
+    is marked as terminated. Werkzeug truncates a terminated stream at
+    MAX_CONTENT_LENGTH rather than rejecting it, so the stream enforces
+    max_size() (the app's limit) itself, and init_compression() reads the
+    body before the view runs and rejects one with bytes left over.
+    """
+
+    def __init__(self, wsgi_app, max_size=lambda: None):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            decoder = _decoder_for(encoding)
+            if decoder is None:
+                body = b'{"error": "Unsupported Content-Encoding: ' + encoding.encode('latin-1', 'replace') + b'"}'
+                start_response('415 Unsupported Media Type', [
+                    ('Content-Type', 'application/json'),
+                    ('Content-Length', str(len(body))),
+                    ('Accept-Encoding', ', '.join(e for e in supported_encodings() if _decoder_for(e))),
+                ])
+                return [body]
+
+            environ['wsgi.input'] = DecompressingStream(environ['wsgi.input'], decoder, self.max_size(), encoding)
+            environ['wsgi.input_terminated'] = True
+            environ.pop('CONTENT_LENGTH', None)
+            del environ['HTTP_CONTENT_ENCODING']
+
+        return self.wsgi_app(environ, start_response)
+
+
+def compress_response(response):
+    """Negotiate a compressed response body from Accept-Encoding"""
+    config = current_app.config
+    if (response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200
+            or response.status_code in (204, 304)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE):
+        return response
+
+    encoding = request.accept_encodings.best_match(supported_encodings())
+    if not encoding:
+        return response
+
+    response.set_data(compress_bytes(data, encoding, config.get('COMPRESS_LEVEL')))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    """
+    Enable compressed request bodies and negotiated response compression.
+    Must be called before any other after_request hooks are registered, so
+    that compression runs last on the finished response.
+    """
+    app.wsgi_app = DecompressionMiddleware(app.wsgi_app, lambda: app.config.get('MAX_CONTENT_LENGTH'))
+    app.after_request(compress_response)
+
+    @app.before_request
+    def decode_body():
+        # Decode a compressed body before the view runs, under the route's
+        # body limit, so one that does not decode is answered 400 here.
+        # Uploads are spooled to temporary files as usual.
+        stream = request.environ.get('wsgi.input')
+        if isinstance(stream, DecompressingStream):
+            stream.max_size = request.max_content_length
+            if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+                request.form
+            else:
+                request.get_data()
+            # Werkzeug stops reading at the limit instead of rejecting the rest
+            if stream.read(1):
+                raise RequestEntityTooLarge()
+
+    @app.errorhandler(InvalidRequestBody)
+    def invalid_body(e):
+        return jsonify({'error': e.description}), 400
+    return app
@@ -0,0 +1,522 @@
+import collections
+import csv
+import io
+import itertools
+import random
+import zlib
+
+from comparators import Comparator, ComparisonInputError
+from limits import check_budget
+from metrics import stage
+
+# How rows are paired:
+#   key   - by the value of the key column only
+#   fuzzy - by key, then leftover rows by content similarity (MinHash/LSH)
+ROW_MATCHING_MODES = ('key', 'fuzzy')
+
+# Least Jaccard similarity of two rows' cells for a fuzzy match
+DEFAULT_SIMILARITY = 0.5
+
+# MinHash signature length; split into LSH bands of equal size
+MINHASH_PERMUTATIONS = 32
+
+# A band bucket holding more left x right rows than this pairs too much alike
+# content to tell rows apart, and is skipped
+BUCKET_PAIR_LIMIT = 10000
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def detect_delimiter(csv_str):
+    """Tab or semicolon when they outnumber commas in the first 1 KB"""
+    sample = csv_str[:1024]
+    delimiter = ','
+    if '\t' in sample and sample.count('\t') > sample.count(','):
+        delimiter = '\t'
+    elif ';' in sample and sample.count(';') > sample.count(','):
+        delimiter = ';'
+    return delimiter
+
+
+def csv_compare_options(data):
+    """Read and validate row matching options from a request payload"""
+    row_matching = data.get('row_matching') or 'key'
+    if row_matching not in ROW_MATCHING_MODES:
+        raise ValueError(f"row_matching must be one of: {', '.join(ROW_MATCHING_MODES)}")
+    similarity = data.get('similarity', DEFAULT_SIMILARITY)
+    if (not isinstance(similarity, (int, float)) or isinstance(similarity, bool)
+            or not 0 < similarity <= 1):
+        raise ValueError("similarity must be a number greater than 0 and at most 1")
+    return {'row_matching': row_matching, 'similarity': similarity}
+
+
+def parse_csv_string(csv_str):
+    """Parse CSV string and return list of dictionaries"""
+    csv_file = io.StringIO(csv_str.strip())
+    
+    # Try to detect delimiter
+    delimiter = detect_delimiter(csv_str)
+    
+    reader = csv.DictReader(csv_file, delimiter=delimiter)
+    data = []
+    for row_num, row in enumerate(reader, start=1):
+        row['__row_number__'] = row_num
+        data.append(row)
+    
+    return data
+
+
+def compare_csv_headers(headers1, headers2):
+    """Missing/extra column differences between two header sets"""
+    differences = []
+    for col in headers1 - headers2:
+        differences.append({
+            'Difference Type': 'Missing Column',
+            'Column': col,
+            'Details': f'Column "{col}" exists in CSV 1 but not in CSV 2'
+        })
+    
+    for col in headers2 - headers1:
+        differences.append({
+            'Difference Type': 'Extra Column',
+            'Column': col,
+            'Details': f'Column "{col}" exists in CSV 2 but not in CSV 1'
+        })
+    return differences
+
+
+def csv_key_column(common_headers):
+    """Column used to match rows: an ID-like column, else the first alphabetically"""
+    for potential_id in ['ID', 'Id', 'id', 'KEY', 'Key', 'key']:
+        if potential_id in common_headers:
+            return potential_id
+    return sorted(common_headers)[0]
+
+
+def compare_csv_rows(key, row1, row2, first_col, common_headers, right_key=None):
+    """
+    Differences for the rows matched by one key; a missing row is None.
+    Rows paired by content pass row2's own key as right_key, which their
+    cell differences then carry as 'Right Key'.
+    """
+    differences = []
+    if row1 is None:
+        # Row exists only in CSV 2
+        differences.append({
+            'Difference Type': 'Extra Row',
+            'Row': str(row2['__row_number__']),
+            'Key': key,
+            'Details': f'Row with {first_col}="{key}" exists only in CSV 2'
+        })
+    elif row2 is None:
+        # Row exists only in CSV 1
+        differences.append({
+            'Difference Type': 'Missing Row',
+            'Row': str(row1['__row_number__']),
+            'Key': key,
+            'Details': f'Row with {first_col}="{key}" exists only in CSV 1'
+        })
+    else:
+        # Row exists in both, compare cell values
+        for header in common_headers:
+            val1 = (row1.get(header) or '').strip()
+            val2 = (row2.get(header) or '').strip()
+            if val1 != val2:
+                differences.append({
+                    'Difference Type': 'Cell Value Mismatch',
+                    'Row1': str(row1['__row_number__']),
+                    'Row2': str(row2['__row_number__']),
+                    'Column': header,
+                    'Key': key,
+                    'Details': f'"{val1}" → "{val2}"'
+                })
+                if right_key is not None:
+                    differences[-1]['Right Key'] = right_key
+    return differences
+
+
+def _lsh_bands(similarity):
+    """
+    (bands, rows per band) for the MinHash signature. The band count sets
+    the similarity from which rows are likely to share a bucket, about
+    (1/bands) ** (1/rows); it is kept well below the requested similarity so
+    few true matches are missed, while fewer, wider bands keep buckets small.
+    """
+    for rows in (16, 8, 4, 2):
+        bands = MINHASH_PERMUTATIONS // rows
+        if (1 / bands) ** (1 / rows) <= similarity * 0.8:
+            return bands, rows
+    return MINHASH_PERMUTATIONS, 1
+
+
+class MinHasher:
+    """MinHash signatures of token sets, from seeded universal hashes of each token"""
+
+    __slots__ = ('coefficients', 'cache')
+
+    # Tokens whose hashes are kept; repeated cell values are hashed once
+    CACHE_SIZE = 65536
+
+    def __init__(self, permutations=MINHASH_PERMUTATIONS, seed=1):
+        rng = random.Random(seed)
+        self.coefficients = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(_MERSENNE_PRIME))
+                             for _ in range(permutations)]
+        self.cache = {}
+
+    def token_hashes(self, token):
+        hashes = self.cache.get(token)
+        if hashes is None:
+            if len(self.cache) >= self.CACHE_SIZE:
+                self.cache.clear()
+            x = zlib.crc32(token.encode('utf-8', 'surrogatepass'))
+            hashes = self.cache[token] = tuple([(a * x + b) % _MERSENNE_PRIME for a, b in self.coefficients])
+        return hashes
+
+    def signature(self, tokens):
+        """Per permutation, the least hash of any token"""
+        return tuple(map(min, zip(*map(self.token_hashes, tokens))))
+
+
+def _row_tokens(row, headers):
+    """A row's cells as a set of column/value tokens"""
+    return frozenset([f'{header}\x1f{(row.get(header) or "").strip()}' for header in headers])
+
+
+def fuzzy_row_pairs(rows1, rows2, headers, similarity=DEFAULT_SIMILARITY):
+    """
+    Pair rows of rows1 with rows of rows2 by their cells in headers, as
+    (index1, index2) tuples. Rows with identical cells pair in order. The
+    rest are pairs whose cells have at least the given Jaccard similarity,
+    most similar first: MinHash signatures are split into LSH bands, and
+    only rows sharing a band bucket are compared, so the work grows with
+    the number of rows rather than with their product.
+    """
+    headers = sorted(headers)
+    tokens1 = [_row_tokens(row, headers) for row in rows1]
+    tokens2 = [_row_tokens(row, headers) for row in rows2]
+
+    pairs = []
+    identical = {}
+    for j, tokens in enumerate(tokens2):
+        identical.setdefault(tokens, collections.deque()).append(j)
+    unmatched1 = []
+    for i, tokens in enumerate(tokens1):
+        waiting = identical.get(tokens)
+        if waiting:
+            pairs.append((i, waiting.popleft()))
+        else:
+            unmatched1.append(i)
+    unmatched2 = sorted(j for waiting in identical.values() for j in waiting)
+    if similarity >= 1 or not unmatched1 or not unmatched2:
+        return pairs
+
+    # Bucket rows1 by band; rows2 only join buckets rows1 already hold
+    bands, width = _lsh_bands(similarity)
+    hasher = MinHasher(bands * width)
+    buckets = {}
+    for i in unmatched1:
+        check_budget()
+        signature = hasher.signature(tokens1[i])
+        for band in range(bands):
+            key = (band, hash(signature[band * width:(band + 1) * width]))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = ([i], [])
+            else:
+                bucket[0].append(i)
+    for j in unmatched2:
+        check_budget()
+        signature = hasher.signature(tokens2[j])
+        for band in range(bands):
+            bucket = buckets.get((band, hash(signature[band * width:(band + 1) * width])))
+            if bucket is not None:
+                bucket[1].append(j)
+
+    candidates = set()
+    for left, right in buckets.values():
+        if right and len(left) * len(right) <= BUCKET_PAIR_LIMIT:
+            candidates.update(itertools.product(left, right))
+
+    # Every row has one token per header, so the union is 2n minus the overlap
+    size = len(headers)
+    scored = []
+    for i, j in candidates:
+        shared = len(tokens1[i] & tokens2[j])
+        score = shared / (2 * size - shared)
+        if score >= similarity:
+            distance = abs(rows1[i]['__row_number__'] - rows2[j]['__row_number__'])
+            scored.append((-score, distance, i, j))
+    scored.sort()
+
+    paired1, paired2 = set(), set()
+    for _, _, i, j in scored:
+        if i not in paired1 and j not in paired2:
+            paired1.add(i)
+            paired2.add(j)
+            pairs.append((i, j))
+    return pairs
+
+
+def compare_csv_data(data1, data2, max_differences=None, row_matching='key', similarity=DEFAULT_SIMILARITY):
+    """
+    Compare two CSV datasets and return differences, stopping once max_differences are found.
+    With row_matching 'fuzzy', rows whose key has no partner are then paired
+    by the rest of their cells (fuzzy_row_pairs) instead of being reported
+    as missing and extra.
+    """
+    # Get headers
+    headers1 = set(data1[0].keys()) - {'__row_number__'} if data1 else set()
+    headers2 = set(data2[0].keys()) - {'__row_number__'} if data2 else set()
+    
+    # Check for missing/extra columns
+    differences = compare_csv_headers(headers1, headers2)
+    
+    # Try content-based comparison using first column as identifier
+    common_headers = headers1 & headers2
+    if not common_headers:
+        return differences
+        
+    # Use first column as primary key for matching (usually ID, Name, etc.)
+    first_col = csv_key_column(common_headers)
+    
+    # Create dictionaries for easier lookup
+    data1_dict = {row[first_col]: row for row in data1}
+    data2_dict = {row[first_col]: row for row in data2}
+    
+    all_keys = set(data1_dict.keys()) | set(data2_dict.keys())
+
+    # Fuzzy matching needs a cell besides the key to compare
+    fuzzy = row_matching == 'fuzzy' and len(common_headers) > 1
+    unmatched = ([], [])
+    
+    for key in all_keys:
+        if max_differences is not None and len(differences) >= max_differences:
+            break
+        check_budget()
+        row1, row2 = data1_dict.get(key), data2_dict.get(key)
+        if fuzzy and (row1 is None or row2 is None):
+            unmatched[row1 is None].append(row1 or row2)
+            continue
+        differences.extend(compare_csv_rows(key, row1, row2, first_col, common_headers))
+
+    if fuzzy and (max_differences is None or len(differences) < max_differences):
+        rows1, rows2 = (sorted(rows, key=lambda row: row['__row_number__']) for rows in unmatched)
+        pairs = fuzzy_row_pairs(rows1, rows2, common_headers - {first_col}, similarity)
+        paired1 = {i for i, _ in pairs}
+        paired2 = {j for _, j in pairs}
+        rows = [(rows1[i], rows2[j]) for i, j in pairs]
+        rows += [(row, None) for i, row in enumerate(rows1) if i not in paired1]
+        rows += [(None, row) for j, row in enumerate(rows2) if j not in paired2]
+        for row1, row2 in rows:
+            if max_differences is not None and len(differences) >= max_differences:
+                break
+            check_budget()
+            key = (row1 or row2)[first_col]
+            right_key = row2[first_col] if row1 is not None and row2 is not None else None
+            differences.extend(compare_csv_rows(key, row1, row2, first_col, common_headers, right_key))
+    
+    if max_differences is not None:
+        del differences[max_differences:]
+    return differences
+
+
+def csv_statistics(diffs):
+    """Summary counts for a list of compare_csv_data differences"""
+    return {
+        'total_differences': len(diffs),
+        'missing_items': len([d for d in diffs if d['Difference Type'] == 'Missing Row']),
+        'extra_items': len([d for d in diffs if d['Difference Type'] == 'Extra Row']),
+        'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Cell Value Mismatch']),
+        'fuzzy_matches': len({d['Row1'] for d in diffs if 'Right Key' in d})
+    }
+
+
+def highlight_csv_strings(csv1_str, csv2_str, diffs):
+    """Add highlighting to CSV strings based on differences - highlight only specific cells"""
+    lines1 = csv1_str.strip().splitlines()
+    lines2 = csv2_str.strip().splitlines()
+    
+    # Create mapping of row IDs to differences
+    missing_rows = set()  # Rows completely missing from CSV2
+    added_rows = set()    # Rows completely missing from CSV1 
+    modified_cells = {}   # {row_id: {column: True}}
+    modified_cells2 = {}  # the same for CSV2, whose row IDs differ for fuzzy-matched rows
+    missing_cells = {}    # {row_id: {column: True}} - cells missing in CSV2
+    
+    for diff in diffs:
+        diff_type = diff.get('Difference Type', '')
+        
+        if diff_type == 'Missing Row':
+            key = diff.get('Key', '')
+            missing_rows.add(key)
+        elif diff_type == 'Extra Row':
+            key = diff.get('Key', '')
+            added_rows.add(key)
+        elif diff_type == 'Cell Value Mismatch':
+            key = diff.get('Key', '')
+            column = diff.get('Column', '')
+            
+            if key not in modified_cells:
+                modified_cells[key] = {}
+            modified_cells[key][column] = True
+            modified_cells2.setdefault(diff.get('Right Key', key), {})[column] = True
+    
+    # Parse CSV data to identify missing cells (data present in CSV1 but not CSV2)
+    try:
+        csv1_data = {}
+        csv2_data = {}
+        
+        # Parse CSV1
+        reader1 = csv.DictReader(io.StringIO(csv1_str))
+        for row in reader1:
+            row_id = list(row.values())[0] if row else ""
+            csv1_data[row_id] = row
+        
+        # Parse CSV2
+        reader2 = csv.DictReader(io.StringIO(csv2_str))
+        for row in reader2:
+            row_id = list(row.values())[0] if row else ""
+            csv2_data[row_id] = row
+        
+        # Identify missing cells (present in CSV1 but missing/empty in CSV2)
+        for row_id, row1 in csv1_data.items():
+            if row_id in csv2_data:
+                row2 = csv2_data[row_id]
+                for column, value1 in row1.items():
+                    value2 = row2.get(column, "").strip()
+                    value1 = value1.strip()
+                    
+                    # If CSV1 has data but CSV2 is empty/missing
+                    if value1 and not value2:
+                        if row_id not in missing_cells:
+                            missing_cells[row_id] = {}
+                        missing_cells[row_id][column] = True
+        
+    except Exception as e:
+        print(f"Error parsing CSV for missing cells: {e}")
+    
+    # Get headers
+    headers1 = [h.strip() for h in lines1[0].split(',')] if lines1 else []
+    headers2 = [h.strip() for h in lines2[0].split(',')] if lines2 else []
+    
+    # Process CSV1 lines
+    highlighted1 = []
+    for i, line in enumerate(lines1):
+        if i == 0:
+            # Header line - no highlighting
+            highlighted1.append(line)
+        else:
+            # Get first column value as row ID
+            try:
+                reader = csv.reader(io.StringIO(line))
+                cells = next(reader)
+                row_id = cells[0].strip() if cells else ""
+            except:
+                row_id = line.split(',')[0].strip().strip('"')
+            
+            if row_id in missing_rows:
+                # Entire row missing - highlight red
+                highlighted1.append(f'<span class="diff-removed">{line}</span>')
+            elif row_id in modified_cells or row_id in missing_cells:
+                # Some cells modified or missing - highlight specific cells
+                try:
+                    reader = csv.reader(io.StringIO(line))
+                    cells = next(reader)
+                    highlighted_parts = []
+                    
+                    for j, cell in enumerate(cells):
+                        if j < len(headers1):
+                            header = headers1[j]
+                            
+                            # Check if this specific cell is missing in CSV2
+                            if row_id in missing_cells and header in missing_cells[row_id]:
+                                highlighted_parts.append(f'<span class="diff-removed">{cell}</span>')
+                            # Check if this specific cell is modified
+                            elif row_id in modified_cells and header in modified_cells[row_id]:
+                                highlighted_parts.append(f'<span class="diff-modified">{cell}</span>')
+                            else:
+                                highlighted_parts.append(cell)
+                        else:
+                            highlighted_parts.append(cell)
+                    
+                    # Join back with commas, preserving CSV format
+                    highlighted_line = ','.join(highlighted_parts)
+                    highlighted1.append(highlighted_line)
+                except:
+                    # Fallback to simple highlighting
+                    highlighted1.append(line)
+            else:
+                highlighted1.append(line)
+    
+    # Process CSV2 lines
+    highlighted2 = []
+    for i, line in enumerate(lines2):
+        if i == 0:
+            # Header line - no highlighting
+            highlighted2.append(line)
+        else:
+            # Get first column value as row ID
+            try:
+                reader = csv.reader(io.StringIO(line))
+                cells = next(reader)
+                row_id = cells[0].strip() if cells else ""
+            except:
+                row_id = line.split(',')[0].strip().strip('"')
+            
+            if row_id in added_rows:
+                # Entire row added - highlight green
+                highlighted2.append(f'<span class="diff-added">{line}</span>')
+            elif row_id in modified_cells2:
+                # Some cells modified - highlight specific cells
+                try:
+                    reader = csv.reader(io.StringIO(line))
+                    cells = next(reader)
+                    highlighted_parts = []
+                    
+                    for j, cell in enumerate(cells):
+                        if j < len(headers2) and headers2[j] in modified_cells2[row_id]:
+                            highlighted_parts.append(f'<span class="diff-modified">{cell}</span>')
+                        else:
+                            highlighted_parts.append(cell)
+                    
+                    # Join back with commas, preserving CSV format
+                    highlighted_line = ','.join(highlighted_parts)
+                    highlighted2.append(highlighted_line)
+                except:
+                    # Fallback to simple highlighting
+                    highlighted2.append(line)
+            else:
+                highlighted2.append(line)
+    
+    return '\n'.join(highlighted1), '\n'.join(highlighted2)
+
+
+class CsvComparator(Comparator):
+    """The /compare_csv comparator; CSV has no patch output"""
+
+    format = 'csv'
+    label = 'CSV'
+    sample = ('id,name,size\n1,a,10\n2,b,20\n', 'id,name,size\n1,a,11\n3,c,30\n')
+
+    def options(self, data):
+        return csv_compare_options(data)
+
+    def parse(self, text):
+        try:
+            return parse_csv_string(text)
+        except Exception as e:
+            raise ComparisonInputError(f'Invalid CSV: {str(e)}')
+
+    def baseline_document(self, baseline):
+        return baseline.index['rows']
+
+    def compare(self, comparison, max_differences=None):
+        with stage('compare'):
+            return compare_csv_data(comparison.doc1, comparison.doc2, max_differences, **comparison.options)
+
+    def highlight(self, text1, text2, diffs, comparison=None):
+        with stage('highlight'):
+            return highlight_csv_strings(text1, text2, diffs)
+
+    def statistics(self, diffs):
+        return csv_statistics(diffs)
@@ -0,0 +1,223 @@
+"""
+Compact, columnar encoding of difference lists.
+
+Responses normally carry `differences` as a list of dicts with verbose keys
+and full paths. With `"diff_encoding": "compact"` the list is sent as
+
+    {"encoding": "compact", "version": 1,
+     "types": ["Tag missing", "Extra tag", ...],
+     "paths": {"parent": [-1, 0, 1], "segment": ["/root[1]", "/item[2]", "/name[1]"]},
+     "strings": ["-", "(text)"],
+     "interned": ["Attribute"],
+     "columns": {"type": [0, 4], "Tag Path": [2, 1], "Attribute": [0, 1]}}
+
+- `columns.type` holds one code per difference; a code indexes `types`.
+  The first codes are the fixed DIFFERENCE_TYPES, so they are stable.
+- Path fields ('Tag Path', 'Key Path', 'Right Key Path') index the `paths`
+  table, with -1 when a difference has no such field. The table is a
+  prefix tree. Path i is the path at parent[i] (empty for -1) followed by
+  segment[i], and a parent always comes before its children. Paths are
+  sent as strings: a top-level YAML key such as 1, true or a date, which
+  reaches Key Path unconverted, is sent as its str().
+- A column listed in `interned` indexes `strings`. Columns whose values
+  mostly repeat are interned. Any other column holds the values as they
+  are, with null when a difference has no such field.
+
+decode_differences() turns the encoding back into the list of dicts.
+"""
+import itertools
+import operator
+from array import array
+
+from metrics import timed
+
+DIFF_ENCODINGS = ('full', 'compact')
+
+COMPACT_VERSION = 1
+
+# Stable type codes: new types are only ever appended
+DIFFERENCE_TYPES = (
+    # XML
+    'Tag missing', 'Extra tag', 'Attribute missing', 'Attribute mismatch', 'Text mismatch',
+    'Namespace mismatch',
+    # JSON, YAML
+    'Missing', 'Extra', 'Value mismatch',
+    # CSV
+    'Missing Column', 'Extra Column', 'Missing Row', 'Extra Row', 'Cell Value Mismatch',
+    # Text
+    'Removed Line', 'Added Line', 'Modified Line',
+    # Binary
+    'Removed Bytes', 'Added Bytes', 'Modified Bytes',
+)
+
+# Path fields and the characters that start one of their segments:
+# XML steps, JSON keys and indexes
+PATH_FIELDS = {'Tag Path': ('/', '/'), 'Key Path': ('.', '['), 'Right Key Path': ('.', '[')}
+
+_TYPE_FIELD = 'Difference Type'
+
+
+def diff_encoding_option(data):
+    """Read and validate diff_encoding from a request payload"""
+    encoding = data.get('diff_encoding') or 'full'
+    if encoding not in DIFF_ENCODINGS:
+        raise ValueError(f"diff_encoding must be one of: {', '.join(DIFF_ENCODINGS)}")
+    return encoding
+
+
+class PathTable:
+    """Interned paths stored as a prefix tree of (parent, segment) entries"""
+
+    __slots__ = ('index', 'parents', 'segments')
+
+    def __init__(self):
+        self.index = {}
+        self.parents = array('i')
+        self.segments = []
+
+    def add(self, paths, separators):
+        """Add every path not yet in the table"""
+        index, parents, segments = self.index, self.parents, self.segments
+        first, second = separators
+        for path in paths:
+            if path in index:
+                continue
+            cut = max(path.rfind(first), path.rfind(second))
+            if cut <= 0:
+                parent = -1
+                cut = 0
+            else:
+                parent = index.get(path[:cut])
+                if parent is None:
+                    parent = self.intern(path[:cut], separators)
+            index[path] = len(segments)
+            parents.append(parent)
+            segments.append(path[cut:])
+
+    def intern(self, path, separators):
+        """Index of path, adding it and any missing ancestors"""
+        index = self.index
+        # Walk up to the longest prefix already in the table, then add the missing ones
+        missing = []
+        parent = -1
+        while True:
+            found = index.get(path)
+            if found is not None:
+                parent = found
+                break
+            cut = max(0, path.rfind(separators[0]), path.rfind(separators[1]))
+            missing.append((path, cut))
+            if cut == 0:
+                break
+            path = path[:cut]
+        for prefix, cut in reversed(missing):
+            index[prefix] = len(self.segments)
+            self.parents.append(parent)
+            self.segments.append(prefix[cut:])
+            parent = index[prefix]
+        return parent
+
+
+class CompactDifferences:
+    """Columnar form of a list of differences"""
+
+    __slots__ = ('type_codes', 'codes', 'paths', 'columns')
+
+    def __init__(self, diffs):
+        self.type_codes = {name: code for code, name in enumerate(DIFFERENCE_TYPES)}
+        self.paths = PathTable()
+        # Columns are built field by field with map(), so no Python code runs per row
+        fields = dict.fromkeys(itertools.chain.from_iterable(diffs))
+        fields.pop(_TYPE_FIELD, None)
+        types = _column(diffs, _TYPE_FIELD)
+        for diff_type in dict.fromkeys(types):
+            self.type_codes.setdefault(diff_type, len(self.type_codes))
+        self.codes = array('H', map(self.type_codes.__getitem__, types))
+        self.columns = {}
+        for field in fields:
+            column = _column(diffs, field)
+            if field in PATH_FIELDS:
+                distinct = dict.fromkeys(column)
+                distinct.pop(None, None)
+                if not all(isinstance(path, str) for path in distinct):
+                    column = [path if path is None or isinstance(path, str) else str(path) for path in column]
+                    distinct = dict.fromkeys(column)
+                    distinct.pop(None, None)
+                self.paths.add(distinct, PATH_FIELDS[field])
+                column = array('i', map(self.paths.index.get, column, itertools.repeat(-1)))
+            self.columns[field] = column
+
+    def as_dict(self):
+        strings, interned, columns = [], [], {'type': self.codes.tolist()}
+        string_index = {}
+        for field, column in self.columns.items():
+            if field in PATH_FIELDS:
+                columns[field] = column.tolist()
+                continue
+            distinct = dict.fromkeys(column)
+            distinct.pop(None, None)
+            # Intern string columns whose values mostly repeat
+            if len(distinct) * 2 > len(column) or not all(isinstance(value, str) for value in distinct):
+                columns[field] = column
+                continue
+            for value in distinct:
+                if value not in string_index:
+                    string_index[value] = len(strings)
+                    strings.append(value)
+            interned.append(field)
+            columns[field] = list(map(string_index.get, column))
+        return {
+            'encoding': 'compact',
+            'version': COMPACT_VERSION,
+            'types': sorted(self.type_codes, key=self.type_codes.get),
+            'paths': {'parent': self.paths.parents.tolist(), 'segment': self.paths.segments},
+            'strings': strings,
+            'interned': interned,
+            'columns': columns,
+        }
+
+
+def _column(diffs, field):
+    """The field's value in every difference, None where it is absent"""
+    try:
+        return list(map(operator.itemgetter(field), diffs))
+    except KeyError:
+        return [diff.get(field) for diff in diffs]
+
+
+@timed('serialize')
+def encode_differences(diffs):
+    """The compact encoding of a list of differences"""
+    return CompactDifferences(diffs).as_dict()
+
+
+def response_differences(diffs, encoding):
+    """differences as sent in a response: the list itself or its compact encoding"""
+    return encode_differences(diffs) if encoding == 'compact' else diffs
+
+
+def decode_differences(encoded):
+    """The list of difference dicts a compact encoding holds"""
+    parents, segments = encoded['paths']['parent'], encoded['paths']['segment']
+    paths = []
+    for parent, segment in zip(parents, segments):
+        paths.append(segment if parent < 0 else paths[parent] + segment)
+
+    strings = encoded['strings']
+    interned = set(encoded['interned'])
+    types = encoded['types']
+    columns = encoded['columns']
+    fields = [field for field in columns if field != 'type']
+    diffs = [{_TYPE_FIELD: types[code]} for code in columns['type']]
+    for field in fields:
+        column = columns[field]
+        if field in PATH_FIELDS:
+            for diff, index in zip(diffs, column):
+                if index >= 0:
+                    diff[field] = paths[index]
+        else:
+            table = strings if field in interned else None
+            for diff, value in zip(diffs, column):
+                if value is not None:
+                    diff[field] = table[value] if table is not None else value
+    return diffs
@@ -1,6 +1,13 @@
+import { useMemo } from 'react';
+import { decodeDifferences, differenceLocation, differenceDetail } from '../utils/diffEncoding';
 import '../styles/highlight.css';
 
+// Rows rendered in the differences list; the panes above show every difference
+const MAX_LISTED_DIFFERENCES = 500;
+
 export function ResultsDisplay({ results, format }) {
+    const differences = useMemo(() => decodeDifferences(results?.differences), [results]);
+
     if (!results) return null;
 
     const { left, right, statistics } = results;
@@ -90,6 +97,29 @@ export function ResultsDisplay({ results, format }) {
                     </div>
                 </div>
             </div>
+
+            {/* Difference List */}
+            {differences.length > 0 && (
+                <details className="bg-white rounded-lg shadow-sm border border-gray-200 mt-6">
+                    <summary className="px-6 py-4 cursor-pointer text-lg font-semibold text-gray-900">
+                        Differences ({differences.length}{results.truncated ? '+' : ''})
+                    </summary>
+                    <ul className="divide-y divide-gray-200 border-t border-gray-200 text-sm">
+                        {differences.slice(0, MAX_LISTED_DIFFERENCES).map((diff, i) => (
+                            <li key={i} className="px-6 py-2 flex gap-4">
+                                <span className="w-40 flex-shrink-0 font-medium text-gray-900">{diff['Difference Type']}</span>
+                                <span className="w-1/3 font-mono text-gray-700 break-all">{differenceLocation(diff)}</span>
+                                <span className="flex-1 text-gray-600 break-all">{differenceDetail(diff)}</span>
+                            </li>
+                        ))}
+                    </ul>
+                    {differences.length > MAX_LISTED_DIFFERENCES && (
+                        <p className="px-6 py-3 text-sm text-gray-500 border-t border-gray-200">
+                            Showing the first {MAX_LISTED_DIFFERENCES} differences.
+                        </p>
+                    )}
+                </details>
+            )}
         </div>
     );
 }
@@ -1,10 +1,37 @@
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import * as api from '../utils/api';
 
 export function useComparison() {
     const [isLoading, setIsLoading] = useState(false);
     const [results, setResults] = useState(null);
     const [error, setError] = useState(null);
+    // Last session and the texts it holds, so re-runs after an edit send only the change
+    const session = useRef(null);
+
+    const compareIncremental = async (format, content1, content2) => {
+        const previous = session.current;
+        if (previous && previous.format === format) {
+            const unchanged = [previous.content1 === content1, previous.content2 === content2];
+            if (unchanged[0] || unchanged[1]) {
+                const side = unchanged[0] ? 'right' : 'left';
+                const edit = unchanged[0]
+                    ? api.lineEdit(previous.content2, content2)
+                    : api.lineEdit(previous.content1, content1);
+                try {
+                    const data = await api.patchSession(previous.id, side, [edit]);
+                    session.current = { ...previous, content1, content2 };
+                    return data;
+                } catch (err) {
+                    // Expired session or a side that no longer parses: start over below
+                }
+            }
+        }
+
+        session.current = null;
+        const data = await api.createSession(format, content1, content2);
+        session.current = { id: data.session_id, format, content1, content2 };
+        return data;
+    };
 
     const compare = async (format, content1, content2) => {
         setIsLoading(true);
@@ -15,19 +42,11 @@ export function useComparison() {
 
             switch (format) {
                 case 'xml':
-                    data = await api.compareXML(content1, content2);
-                    break;
                 case 'json':
-                    data = await api.compareJSON(content1, content2);
-                    break;
                 case 'text':
-                    data = await api.compareText(content1, content2);
-                    break;
                 case 'csv':
-                    data = await api.compareCSV(content1, content2);
-                    break;
                 case 'yaml':
-                    data = await api.compareYAML(content1, content2);
+                    data = await compareIncremental(format, content1, content2);
                     break;
                 default:
                     throw new Error('Invalid format');
@@ -44,6 +63,7 @@ export function useComparison() {
     };
 
     const reset = () => {
+        session.current = null;
         setResults(null);
         setError(null);
     };
@@ -2,27 +2,28 @@
 
 const API_BASE_URL = '';  // Empty string for same origin, or use proxy in dev mode
 
-export async function compareXML(xml1, xml2) {
-    const response = await fetch(`${API_BASE_URL}/compare`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ xml1, xml2 })
-    });
+// Request bodies above this size are gzip-compressed when the browser supports it
+const COMPRESS_THRESHOLD = 64 * 1024;
 
-    const data = await response.json();
+async function buildRequest(payload) {
+    const body = JSON.stringify(payload);
+    const headers = { 'Content-Type': 'application/json' };
 
-    if (!response.ok) {
-        throw new Error(data.error || 'Comparison failed');
+    if (body.length < COMPRESS_THRESHOLD || typeof CompressionStream === 'undefined') {
+        return { headers, body };
     }
 
-    return data;
+    const stream = new Blob([body]).stream().pipeThrough(new CompressionStream('gzip'));
+    const compressed = await new Response(stream).blob();
+    headers['Content-Encoding'] = 'gzip';
+    return { headers, body: compressed };
 }
 
-export async function compareJSON(json1, json2) {
-    const response = await fetch(`${API_BASE_URL}/compare_json`, {
+async function postComparison(endpoint, payload) {
+    // Responses are decompressed transparently by the browser (Accept-Encoding)
+    const response = await fetch(`${API_BASE_URL}${endpoint}`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ json1, json2 })
+        ...(await buildRequest(payload))
     });
 
     const data = await response.json();
@@ -34,50 +35,58 @@ export async function compareJSON(json1, json2) {
     return data;
 }
 
-export async function compareText(text1, text2) {
-    const response = await fetch(`${API_BASE_URL}/compare_text`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text1, text2 })
-    });
-
-    const data = await response.json();
+export async function compareXML(xml1, xml2) {
+    return postComparison('/compare', { xml1, xml2 });
+}
 
-    if (!response.ok) {
-        throw new Error(data.error || 'Comparison failed');
-    }
+export async function compareJSON(json1, json2) {
+    return postComparison('/compare_json', { json1, json2 });
+}
 
-    return data;
+export async function compareText(text1, text2) {
+    return postComparison('/compare_text', { text1, text2 });
 }
 
 export async function compareCSV(csv1, csv2) {
-    const response = await fetch(`${API_BASE_URL}/compare_csv`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ csv1, csv2 })
-    });
-
-    const data = await response.json();
-
-    if (!response.ok) {
-        throw new Error(data.error || 'Comparison failed');
-    }
-
-    return data;
+    return postComparison('/compare_csv', { csv1, csv2 });
 }
 
 export async function compareYAML(yaml1, yaml2) {
-    const response = await fetch(`${API_BASE_URL}/compare_yaml`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ yaml1, yaml2 })
-    });
+    return postComparison('/compare_yaml', { yaml1, yaml2 });
+}
 
-    const data = await response.json();
+// Incremental sessions: the server keeps both parsed sides and re-diffs only edited parts.
+// Differences come back in the compact encoding; decode them with decodeDifferences().
+export async function createSession(format, left, right) {
+    return postComparison('/session', { format, left, right, highlight: true, diff_encoding: 'compact' });
+}
 
-    if (!response.ok) {
-        throw new Error(data.error || 'Comparison failed');
+export async function patchSession(sessionId, side, edits) {
+    return postComparison(`/session/${sessionId}/patch`, { side, edits, highlight: true, diff_encoding: 'compact' });
+}
+
+// Same line splitting as Python's str.splitlines(), so line indices agree with the server
+function splitLines(text) {
+    const lines = text.split(/\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]/);
+    if (lines[lines.length - 1] === '') {
+        lines.pop();
     }
+    return lines;
+}
 
-    return data;
+// The single line-range edit turning one text into another (common prefix/suffix trimmed)
+export function lineEdit(before, after) {
+    const a = splitLines(before);
+    const b = splitLines(after);
+    let start = 0;
+    while (start < a.length && start < b.length && a[start] === b[start]) {
+        start++;
+    }
+    let endA = a.length;
+    let endB = b.length;
+    while (endA > start && endB > start && a[endA - 1] === b[endB - 1]) {
+        endA--;
+        endB--;
+    }
+    return { start, end: endA, lines: b.slice(start, endB) };
 }
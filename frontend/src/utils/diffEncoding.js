@@ -0,0 +1,64 @@
+// Decoder for the compact difference encoding (diff_encoding: 'compact', see diff_encoding.py)
+
+const TYPE_FIELD = 'Difference Type';
+const PATH_FIELDS = new Set(['Tag Path', 'Key Path', 'Right Key Path']);
+
+// Paths are stored as a prefix tree: each entry is its parent's path plus a segment
+function decodePaths({ parent, segment }) {
+    const paths = new Array(segment.length);
+    for (let i = 0; i < segment.length; i++) {
+        paths[i] = parent[i] < 0 ? segment[i] : paths[parent[i]] + segment[i];
+    }
+    return paths;
+}
+
+// The list of difference objects, whether the response sent them compact or in full
+export function decodeDifferences(differences) {
+    if (!differences || Array.isArray(differences)) {
+        return differences || [];
+    }
+    if (differences.encoding !== 'compact') {
+        throw new Error(`Unsupported difference encoding: ${differences.encoding}`);
+    }
+
+    const { types, strings, columns } = differences;
+    const paths = decodePaths(differences.paths);
+    const interned = new Set(differences.interned);
+    const decoded = columns.type.map((code) => ({ [TYPE_FIELD]: types[code] }));
+
+    for (const [field, column] of Object.entries(columns)) {
+        if (field === 'type') {
+            continue;
+        }
+        const isPath = PATH_FIELDS.has(field);
+        const isInterned = interned.has(field);
+        for (let i = 0; i < column.length; i++) {
+            const value = column[i];
+            if (value === null || (isPath && value < 0)) {
+                continue;
+            }
+            decoded[i][field] = isPath ? paths[value] : isInterned ? strings[value] : value;
+        }
+    }
+    return decoded;
+}
+
+// Where a difference is, for any format
+export function differenceLocation(diff) {
+    if (diff['Tag Path'] !== undefined) {
+        return diff.Attribute && diff.Attribute !== '-' ? `${diff['Tag Path']} @${diff.Attribute}` : diff['Tag Path'];
+    }
+    if (diff['Key Path'] !== undefined) {
+        return diff['Key Path'] || '(root)';
+    }
+    if (diff['Line Number'] !== undefined) {
+        return diff['Line Number'];
+    }
+    const row = diff.Row || diff.Row1;
+    return [row && `Row ${row}`, diff.Column && `Column "${diff.Column}"`].filter(Boolean).join(', ');
+}
+
+// What changed, for any format
+export function differenceDetail(diff) {
+    return diff.Property ?? diff.Details ?? diff.Content ?? '';
+}
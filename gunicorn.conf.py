@@ -0,0 +1,38 @@
+"""
+gunicorn settings, read from the working directory by default.
+
+SERVING_MODE=threaded serves each worker's requests from SERVING_THREADS
+threads (default 16) and offloads big comparisons to a process pool (see
+serving.py); one or two workers are then enough. Otherwise gunicorn's sync
+workers are used as before.
+
+The master imports the app and warms it up (app.warm_up(): every comparator
+and feature module loaded, each comparator's sample compared) before it
+forks, so new workers serve their first request without importing
+anything. WARM_UP=0 turns this off, e.g. for --reload.
+"""
+import os
+
+# Load the app once in the master; workers inherit it on fork
+preload_app = os.environ.get('WARM_UP', '1').lower() not in ('0', 'false', 'no')
+
+if os.environ.get('SERVING_MODE') == 'threaded':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('SERVING_THREADS') or 16)
+
+# Seconds in-flight requests get to finish after SIGTERM
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT') or 30)
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.warm_up()
+
+
+def worker_exit(server, worker):
+    # Stop the worker's pools once it has finished serving
+    import serving
+    import worker_pool
+    serving.shutdown()
+    worker_pool.shutdown()
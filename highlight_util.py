@@ -1,6 +1,14 @@
 import html
 import re
 
+from limits import check_budget
+from metrics import timed
+
+# "skill[2]": the tag name and its position among same-named siblings
+_POSITION = re.compile(r'\[\d+\]')
+_POSITION_NUMBER = re.compile(r'\[(\d+)\]')
+
+@timed('highlight')
 def highlight_xml_strings(xml1, xml2, diffs):
     """
     Balanced highlighting that works correctly for multiple occurrences
@@ -30,10 +38,10 @@ def highlight_xml_strings(xml1, xml2, diffs):
                 continue
                 
             last_part = path_parts[-1]
-            tag_name = re.sub(r'\[\d+\]', '', last_part)
+            tag_name = _POSITION.sub('', last_part)
             
             # Extract the index number if present (e.g., "skill[1]" -> 1)
-            index_match = re.search(r'\[(\d+)\]', last_part)
+            index_match = _POSITION_NUMBER.search(last_part)
             tag_index = int(index_match.group(1)) if index_match else 1
             
             if not tag_name or tag_name.lower() in ['root', 'document']:
@@ -50,6 +58,7 @@ def highlight_xml_strings(xml1, xml2, diffs):
         
         # Apply modifications using index-aware approach
         for mod in modifications:
+            check_budget()
             if mod['type'] == "Text mismatch":
                 highlighted = highlight_nth_occurrence(highlighted, mod['tag'], mod['index'], "highlight-mismatch")
                 
@@ -0,0 +1,837 @@
+"""
+Incremental comparison sessions.
+
+A session keeps both sides of a comparison parsed and split into units:
+top-level members of a JSON object, top-level keys of a YAML mapping,
+children of the XML root, CSV rows, or (for text) the diff opcodes.
+Line-range edits re-parse only the units they touch and re-diff only
+the units whose value changed, so re-comparison cost follows the size
+of the edit rather than the size of the documents. When an edit cannot
+be handled locally (it spans structure outside the units, or the
+fragment no longer parses on its own) the edited side is re-indexed in
+full and still only the changed units are re-diffed.
+"""
+import bisect
+import csv
+import difflib
+import io
+import itertools
+import json
+import re
+import threading
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+import yaml
+
+import json_codec
+from csv_compare import (parse_csv_string, detect_delimiter, compare_csv_data, compare_csv_headers,
+                         compare_csv_rows, csv_key_column, csv_statistics)
+from json_compare import compare_json_objects, json_statistics
+from text_compare import text_differences, text_statistics
+from value_store import ValueStore
+from xml_compare import (parse_xml_from_string, flatten_elements, compare_xml, xml_statistics,
+                         strip_ns, canonical_tag, canonical_attr, IGNORE_TAGS)
+from yaml_compare import parse_yaml_stream, compare_yaml_documents
+
+SESSION_FORMATS = ('xml', 'json', 'yaml', 'csv', 'text')
+
+# Unchanged lines re-matched on each side of a text edit
+TEXT_CONTEXT = 3
+
+# Key of the single unit used when a side cannot be split
+WHOLE = object()
+MISSING = object()
+
+sessions = ValueStore(max_entries=64, ttl=3600)
+
+
+class SessionError(ValueError):
+    """An edit was malformed, or left a side that no longer parses"""
+
+
+class Unit:
+    """One independently comparable piece of a side, spanning lines [start, end)"""
+    __slots__ = ('key', 'value', 'start', 'end', 'exclusive', 'meta')
+
+    def __init__(self, key, value, start, end, exclusive=True, meta=None):
+        self.key = key
+        self.value = value
+        self.start = start
+        self.end = end
+        # False when the unit shares a line with other content
+        self.exclusive = exclusive
+        self.meta = meta
+
+
+def read_edits(edits):
+    """
+    Validate {"start", "end", "lines"} edits: lines [start, end) of the
+    current text (0-based) are replaced by "lines" (or by "text" split
+    into lines). Returns (start, end, new_lines) tuples.
+    """
+    if not isinstance(edits, list) or not edits:
+        raise SessionError('edits must be a non-empty list')
+    parsed = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise SessionError('each edit must be an object')
+        start = edit.get('start')
+        end = edit.get('end', start)
+        if type(start) is not int or type(end) is not int or not 0 <= start <= end:
+            raise SessionError('edit start and end must be line indices with start <= end')
+        new_lines = edit.get('lines')
+        if new_lines is None:
+            new_lines = (edit.get('text') or '').splitlines()
+        elif not isinstance(new_lines, list) or not all(isinstance(line, str) for line in new_lines):
+            raise SessionError('edit lines must be a list of strings')
+        parsed.append((start, end, new_lines))
+    return parsed
+
+
+def apply_edit(lines, start, end, new_lines):
+    if end > len(lines):
+        raise SessionError(f'edit range {start}-{end} is past the end of the document ({len(lines)} lines)')
+    lines[start:end] = new_lines
+
+
+class ComparisonSession:
+    def __init__(self, fmt, left, right):
+        self.format = fmt
+        self.lines = [left.splitlines(), right.splitlines()]
+        self.lock = threading.Lock()
+
+    def text(self, side):
+        return '\n'.join(self.lines[side])
+
+
+class TextSession(ComparisonSession):
+    """Line diff kept as SequenceMatcher opcodes; edits re-match only their hunk window"""
+
+    def __init__(self, left, right):
+        super().__init__('text', left, right)
+        self.opcodes = difflib.SequenceMatcher(None, *self.lines).get_opcodes()
+
+    def differences(self):
+        return text_differences(self.lines[0], self.lines[1], self.opcodes)
+
+    def statistics(self, diffs):
+        return text_statistics(diffs)
+
+    def patch(self, side, edits):
+        recomputed = 0
+        for start, end, new_lines in read_edits(edits):
+            old_length = len(self.lines[side])
+            apply_edit(self.lines[side], start, end, new_lines)
+            # Work in the orientation where the edited side is "a"
+            opcodes = self.opcodes if side == 0 else swap_opcodes(self.opcodes)
+            opcodes, window = rematch_window(opcodes, self.lines[side], self.lines[1 - side],
+                                             old_length, start, end, len(new_lines))
+            self.opcodes = opcodes if side == 0 else swap_opcodes(opcodes)
+            recomputed += window
+        return {'mode': 'local', 'recomputed_lines': recomputed}
+
+
+def swap_opcodes(opcodes):
+    swapped = {'insert': 'delete', 'delete': 'insert'}
+    return [(swapped.get(tag, tag), j1, j2, i1, i2) for tag, i1, i2, j1, j2 in opcodes]
+
+
+def rematch_window(opcodes, a, b, old_length, start, end, count):
+    """
+    a[start:end] (of an a that had old_length lines) was replaced by count
+    lines. Widen that range by TEXT_CONTEXT lines and out to the nearest
+    equal runs, re-match only the window, and keep the opcodes on either
+    side (shifted). Returns (opcodes, lines re-matched).
+    """
+    delta = count - (end - start)
+
+    def anchor(x, low):
+        # Move x until it sits in an equal run, where a and b positions correspond
+        while True:
+            if low and x == 0:
+                return 0, 0
+            if not low and x == old_length:
+                return x, len(b)
+            equal = [op for op in opcodes if op[0] == 'equal' and op[1] <= x <= op[2]]
+            if equal:
+                _, i1, _, j1, _ = equal[0] if low else equal[-1]
+                return x, j1 + (x - i1)
+            if low:
+                x = next(i1 for _, i1, i2, _, _ in opcodes if i1 < x <= i2)
+            else:
+                x = next(i2 for _, i1, i2, _, _ in opcodes if i1 <= x < i2)
+
+    lo, b_lo = anchor(max(0, start - TEXT_CONTEXT), True)
+    hi, b_hi = anchor(min(old_length, end + TEXT_CONTEXT), False)
+
+    before, after = [], []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i2 <= lo and j2 <= b_lo:
+            before.append((tag, i1, i2, j1, j2))
+        elif i1 >= hi and j1 >= b_hi:
+            after.append((tag, i1 + delta, i2 + delta, j1, j2))
+        elif tag == 'equal':
+            # Equal runs crossing the window edges are clipped
+            if i1 < lo:
+                before.append(('equal', i1, lo, j1, j1 + lo - i1))
+            if i2 > hi:
+                after.append(('equal', hi + delta, i2 + delta, j2 - (i2 - hi), j2))
+
+    matcher = difflib.SequenceMatcher(None, a[lo:hi + delta], b[b_lo:b_hi])
+    window = [(tag, i1 + lo, i2 + lo, j1 + b_lo, j2 + b_lo) for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+    return before + window + after, (hi + delta - lo) + (b_hi - b_lo)
+
+
+class UnitSession(ComparisonSession):
+    """
+    Both sides split into keyed units by a format indexer. Differences are
+    cached per unit key; an edit re-diffs only the keys whose value changed.
+    A side that cannot be split is a single WHOLE unit, and the two sides
+    are then compared as whole documents.
+    """
+
+    def __init__(self, fmt, indexer, left, right):
+        super().__init__(fmt, left, right)
+        self.indexer = indexer
+        self.units = [[], []]
+        # Each side's unit start lines, sorted, for finding the units an edit touches
+        self.starts = [[], []]
+        self.by_key = [{}, {}]
+        self.keyed = [False, False]
+        self.invalid = [None, None]
+        self.pending = set()
+        self.diffs = {}
+        for side in (0, 1):
+            self.reindex(side)
+        if indexer.pair_changed():
+            self.reindex(0)
+        self.recompute_all()
+
+    def reindex(self, side):
+        try:
+            units, keyed = self.indexer.index(self.lines[side], side)
+        except ValueError as e:
+            self.invalid[side] = str(e)
+            raise SessionError(f"{('left', 'right')[side]}: {e}")
+        self.invalid[side] = None
+        self.units[side] = units
+        self.starts[side] = [unit.start for unit in units]
+        self.keyed[side] = keyed
+        self.by_key[side] = {unit.key: unit for unit in units}
+
+    def whole(self, side):
+        return self.indexer.whole(self.units[side], self.lines[side], self.keyed[side])
+
+    def rediff(self, key):
+        unit1 = self.by_key[0].get(key)
+        unit2 = self.by_key[1].get(key)
+        if unit1 is None and unit2 is None:
+            self.diffs.pop(key, None)
+            return
+        diffs = self.indexer.compare(key,
+                                     MISSING if unit1 is None else unit1.value,
+                                     MISSING if unit2 is None else unit2.value)
+        if diffs:
+            self.diffs[key] = diffs
+        else:
+            self.diffs.pop(key, None)
+
+    def recompute_all(self):
+        self.diffs = {}
+        self.pending = set()
+        if all(self.keyed):
+            for key in self.by_key[0].keys() | self.by_key[1].keys():
+                self.rediff(key)
+        else:
+            self.diffs[WHOLE] = self.indexer.compare_whole(self.whole(0), self.whole(1))
+        return len(self.by_key[0].keys() | self.by_key[1].keys())
+
+    def differences(self):
+        for side in (0, 1):
+            if self.invalid[side]:
+                raise SessionError(f"{('left', 'right')[side]}: {self.invalid[side]}")
+        if not all(self.keyed):
+            return list(self.diffs.get(WHOLE, []))
+
+        diffs = self.indexer.pair_differences()
+        for unit in self.units[0]:
+            diffs.extend(self.diffs.get(unit.key, ()))
+        for unit in self.units[1]:
+            if unit.key not in self.by_key[0]:
+                diffs.extend(self.diffs.get(unit.key, ()))
+        return self.indexer.renumber(diffs, self.units)
+
+    def statistics(self, diffs):
+        return self.indexer.statistics(diffs)
+
+    def patch(self, side, edits):
+        local = self.invalid[0] is None and self.invalid[1] is None and all(self.keyed)
+        for start, end, new_lines in read_edits(edits):
+            apply_edit(self.lines[side], start, end, new_lines)
+            if local:
+                keys = self.update_region(side, start, end, len(new_lines))
+                if keys is None:
+                    local = False
+                else:
+                    self.pending |= keys
+
+        if not local:
+            return self.update_side(side)
+
+        recomputed = len(self.pending)
+        for key in self.pending:
+            self.rediff(key)
+        self.pending = set()
+        return {'mode': 'local', 'recomputed_units': recomputed}
+
+    def update_region(self, side, start, end, count):
+        """
+        Re-parse the units touched by an edit that replaced lines
+        [start, end) with count lines. Returns the keys to re-diff,
+        or None when the edit has to be handled by a full re-index.
+        """
+        units = self.units[side]
+        starts = self.starts[side]
+        # Units are ordered and do not overlap: those touched start before the
+        # edit's end and end after its start
+        first = max(0, bisect.bisect_right(starts, start) - 1)
+        if first < len(units) and units[first].end <= start:
+            first += 1
+        last = bisect.bisect_left(starts, end) - 1
+        if first > last and start == end:
+            # A pure insertion joins the unit it precedes, or else the one it follows
+            if first < len(units) and starts[first] == start:
+                last = first
+            elif first and units[first - 1].end == start:
+                first = last = first - 1
+        if first > last:
+            return None
+        old_units = units[first:last + 1]
+        region_start, region_end = old_units[0].start, old_units[-1].end
+        if not all(unit.exclusive for unit in old_units) or start < region_start or end > region_end:
+            return None
+
+        delta = count - (end - start)
+        new_units = self.indexer.index_region(self.lines[side], region_start, region_end + delta,
+                                              old_units, side)
+        if new_units is None or (not new_units and len(old_units) == len(units)):
+            return None
+
+        by_key = self.by_key[side]
+        old_values = {unit.key: unit.value for unit in old_units}
+        new_values = {unit.key: unit.value for unit in new_units}
+        if len(new_values) != len(new_units):
+            return None
+        if any(key in by_key and key not in old_values for key in new_values):
+            return None
+
+        units[first:last + 1] = new_units
+        starts[first:last + 1] = [unit.start for unit in new_units]
+        if delta:
+            for i in range(first + len(new_units), len(units)):
+                units[i].start += delta
+                units[i].end += delta
+                starts[i] += delta
+        for key in old_values:
+            del by_key[key]
+        for unit in new_units:
+            by_key[unit.key] = unit
+
+        # Touched units are few, so all of them are re-diffed (a reordered value renders differently)
+        return old_values.keys() | new_values.keys()
+
+    def update_side(self, side):
+        """Re-index a whole side, then re-diff only the keys whose value changed"""
+        old = self.by_key[side]
+        was_keyed = self.keyed[side]
+        self.reindex(side)
+        if self.invalid[1 - side]:
+            raise SessionError(f"{('left', 'right')[1 - side]}: {self.invalid[1 - side]}")
+
+        if self.indexer.pair_changed():
+            self.reindex(1 - side)
+            return {'mode': 'full', 'recomputed_units': self.recompute_all()}
+        if not (was_keyed and all(self.keyed)):
+            return {'mode': 'full', 'recomputed_units': self.recompute_all()}
+
+        new = self.by_key[side]
+        changed = self.pending | {key for key in old.keys() | new.keys()
+                                  if key not in old or key not in new or old[key].value != new[key].value}
+        for key in changed:
+            self.rediff(key)
+        self.pending = set()
+        return {'mode': 'full', 'recomputed_units': len(changed)}
+
+
+class Indexer:
+    """Splits one side of a format into units and compares them"""
+
+    def pair_changed(self):
+        return False
+
+    def pair_differences(self):
+        return []
+
+    def renumber(self, diffs, units):
+        return diffs
+
+    def whole(self, units, lines, keyed):
+        return units[0].value
+
+
+def line_starts(lines):
+    return [0] + list(itertools.accumulate(len(line) + 1 for line in lines))[:-1]
+
+
+_json_decoder = json.JSONDecoder()
+_json_space = json.decoder.WHITESPACE.match
+
+
+def scan_json_members(text):
+    """
+    (key, value, start, end, comma) for each member of a top-level JSON
+    object, where [start, end) covers the member and its comma. None if the
+    text is not a single object with unique keys.
+    """
+    members = []
+    try:
+        pos = _json_space(text, 0).end()
+        if text[pos:pos + 1] != '{':
+            return None
+        pos = _json_space(text, pos + 1).end()
+        closed = text[pos:pos + 1] == '}'
+        while not closed:
+            if text[pos:pos + 1] != '"':
+                return None
+            start = pos
+            key, pos = json.decoder.scanstring(text, pos + 1)
+            pos = _json_space(text, pos).end()
+            if text[pos:pos + 1] != ':':
+                return None
+            value, pos = _json_decoder.raw_decode(text, _json_space(text, pos + 1).end())
+            end = pos
+            pos = _json_space(text, pos).end()
+            if text[pos:pos + 1] == ',':
+                members.append((key, value, start, pos + 1, True))
+                pos = _json_space(text, pos + 1).end()
+            else:
+                members.append((key, value, start, end, False))
+                closed = True
+        if text[pos:pos + 1] != '}' or _json_space(text, pos + 1).end() != len(text):
+            return None
+    except ValueError:
+        return None
+    if len({member[0] for member in members}) != len(members):
+        return None
+    return members
+
+
+def json_units(members, lines, offset):
+    starts = line_starts(lines)
+    units = []
+    for key, value, start, end, comma in members:
+        first = bisect.bisect_right(starts, start) - 1
+        last = bisect.bisect_right(starts, end - 1) - 1
+        exclusive = (not lines[first][:start - starts[first]].strip()
+                     and not lines[last][end - starts[last]:].strip())
+        units.append(Unit(key, value, first + offset, last + 1 + offset, exclusive, comma))
+    return units
+
+
+class JsonIndexer(Indexer):
+    """Units are the members of a top-level object"""
+
+    def __init__(self, options):
+        self.options = options
+
+    def index(self, lines, side):
+        text = '\n'.join(lines)
+        members = scan_json_members(text)
+        if members is None:
+            try:
+                value = json_codec.loads(text)
+            except json_codec.JSONDecodeError as e:
+                raise ValueError(f'Invalid JSON: {str(e)}')
+            return [Unit(WHOLE, value, 0, len(lines), exclusive=False)], False
+        return json_units(members, lines, 0), True
+
+    def index_region(self, lines, start, end, old_units, side):
+        text = '\n'.join(lines[start:end]).rstrip()
+        # The region's last member keeps its trailing comma (or lack of one)
+        comma = text.endswith(',')
+        if comma != old_units[-1].meta:
+            return None
+        if comma:
+            text = text[:-1]
+        wrapped = ['{'] + text.split('\n') + ['}']
+        members = scan_json_members('\n'.join(wrapped))
+        if not members:
+            return None
+        units = json_units(members, wrapped, start - 1)
+        units[-1].meta = comma
+        return units
+
+    def whole(self, units, lines, keyed):
+        return {unit.key: unit.value for unit in units} if keyed else units[0].value
+
+    def compare(self, key, value1, value2):
+        obj1 = {} if value1 is MISSING else {key: value1}
+        obj2 = {} if value2 is MISSING else {key: value2}
+        return compare_json_objects(obj1, obj2, **self.options)
+
+    def compare_whole(self, value1, value2):
+        return compare_json_objects(value1, value2, **self.options)
+
+    def statistics(self, diffs):
+        return json_statistics(diffs)
+
+
+# Anchors/aliases tie keys together and directives apply to the whole stream
+_YAML_REFERENCE = re.compile(r'(?<![^\s\[{,])[&*]\S|^%', re.MULTILINE)
+
+
+def yaml_units(docs, nodes, text, line_count, offset):
+    """Units for the top-level keys of a single block-mapping document, or None"""
+    if len(docs) != 1 or not isinstance(docs[0], dict) or not isinstance(nodes[0], yaml.MappingNode):
+        return None
+    if nodes[0].flow_style or _YAML_REFERENCE.search(text) or len(nodes[0].value) != len(docs[0]):
+        return None
+    units = []
+    for (key_node, _), (key, value) in zip(nodes[0].value, docs[0].items()):
+        if key_node.start_mark.column != 0:
+            return None
+        units.append(Unit(key, value, key_node.start_mark.line + offset, 0))
+    # Each key runs up to the next one, so comments and blank lines belong to a unit
+    for unit, following in zip(units, units[1:]):
+        unit.end = following.start
+    if units:
+        units[-1].end = line_count + offset
+    return units
+
+
+class YamlIndexer(JsonIndexer):
+    """Units are the top-level keys of a single-document block mapping"""
+
+    def index(self, lines, side):
+        text = '\n'.join(lines)
+        try:
+            docs, nodes = parse_yaml_stream(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f'Invalid YAML: {str(e)}')
+        units = yaml_units(docs, nodes, text, len(lines), 0)
+        if units is None:
+            return [Unit(WHOLE, docs, 0, len(lines), exclusive=False)], False
+        return units, True
+
+    def index_region(self, lines, start, end, old_units, side):
+        text = '\n'.join(lines[start:end])
+        try:
+            docs, nodes = parse_yaml_stream(text)
+        except yaml.YAMLError:
+            return None
+        units = yaml_units(docs, nodes, text, end - start, start)
+        if not units or units[0].start != start:
+            return None
+        return units
+
+    def whole(self, units, lines, keyed):
+        return [{unit.key: unit.value for unit in units}] if keyed else units[0].value
+
+    def compare_whole(self, value1, value2):
+        return compare_yaml_documents(value1, value2, **self.options)
+
+
+def xml_layout(text):
+    """
+    Positions needed to split an XML document by the root's children:
+    the root start tag text and qualified name, the (line, column) of each
+    child's start tag and of the root end tag. None if expat cannot read it.
+    """
+    data = text.encode('utf-8')
+    parser = expat.ParserCreate()
+    state = {'depth': 0, 'open': None, 'open_end': None, 'qname': None, 'end': None}
+    children = []
+
+    def mark(*args):
+        # The first event after the root start tag marks where that tag ends
+        if state['depth'] == 1 and state['open_end'] is None:
+            state['open_end'] = parser.CurrentByteIndex
+
+    def start(name, attrs):
+        mark()
+        if state['depth'] == 0:
+            state['qname'] = name
+            state['open'] = parser.CurrentByteIndex
+        elif state['depth'] == 1:
+            children.append((parser.CurrentLineNumber - 1, parser.CurrentColumnNumber))
+        state['depth'] += 1
+
+    def end(name):
+        mark()
+        state['depth'] -= 1
+        if state['depth'] == 0:
+            state['end'] = (parser.CurrentLineNumber - 1, parser.CurrentColumnNumber)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = mark
+    parser.CommentHandler = mark
+    parser.ProcessingInstructionHandler = mark
+    try:
+        parser.Parse(data, True)
+    except expat.ExpatError:
+        return None
+    if state['open_end'] is None:
+        return None
+    root_open = data[state['open']:state['open_end']].decode('utf-8')
+    return root_open, state['qname'], children, state['end']
+
+
+def xml_identity(elem):
+    """What decides a child's path step: its tag, plus the name for name-keyed tags"""
+    canon = canonical_tag(strip_ns(elem.tag))
+    if canon in IGNORE_TAGS:
+        return ('ignored', canon)
+    name = {canonical_attr(strip_ns(k)): v for k, v in elem.attrib.items()}.get('name')
+    return (canon, name if canon in {'ProtocolData', 'UserDataField'} and name else None)
+
+
+def xml_units(root, lines, layout, offset, normalize=frozenset()):
+    """A fixed unit for the root element itself, then one unit per child of the root"""
+    _, _, positions, (end_line, end_column) = layout
+    children = list(root)
+    if len(children) != len(positions):
+        return None
+    element_map = {}
+    flat = flatten_elements(root, element_map, normalize)
+    if not flat:
+        return None
+    paths = {id(elem): path for path, elem in element_map.items()}
+    items = iter(flat.items())
+    root_path, root_entry = next(items)
+
+    # A child spans from its start tag to the next child's (or the root end tag);
+    # it is exclusive when both of those tags start their lines
+    clean = [not lines[line][:column].strip() for line, column in positions]
+    clean.append(not lines[end_line][:end_column].strip())
+    bounds = [line for line, _ in positions] + [end_line]
+
+    units = [Unit(root_path, {root_path: root_entry}, -1, -1, exclusive=False)]
+    child_units = {}
+    for i, child in enumerate(children):
+        path = paths.get(id(child))
+        key = ('ignored', i) if path is None else path
+        unit = Unit(key, {}, bounds[i] + offset, bounds[i + 1] + offset,
+                    clean[i] and clean[i + 1], xml_identity(child))
+        units.append(unit)
+        if path is not None:
+            child_units[path] = unit
+
+    # flatten_elements lists paths depth first, so each child's subtree is contiguous
+    current = None
+    for path, entry in items:
+        current = child_units.get(path, current)
+        current.value[path] = entry
+    return units
+
+
+class XmlIndexer(Indexer):
+    """Units are the root element and each of its children (with their subtrees)"""
+
+    def __init__(self, options):
+        self.normalize = options.get('normalize', frozenset())
+        self.roots = [None, None]
+
+    def index(self, lines, side):
+        text = '\n'.join(lines)
+        root, error = parse_xml_from_string(text)
+        if error:
+            raise ValueError(error)
+        layout = xml_layout(text)
+        units = xml_units(root, lines, layout, 0, self.normalize) if layout is not None else None
+        if units is None:
+            return [Unit(WHOLE, flatten_elements(root, normalize=self.normalize), 0, len(lines), exclusive=False)], False
+        self.roots[side] = layout[:2]
+        return units, True
+
+    def index_region(self, lines, start, end, old_units, side):
+        root_open, qname = self.roots[side]
+        # Re-parse the children inside the original root start tag, so namespaces resolve
+        wrapped = root_open.split('\n') + lines[start:end] + [f'</{qname}>']
+        text = '\n'.join(wrapped)
+        try:
+            root = ET.fromstring(text)
+        except ET.ParseError:
+            return None
+        layout = xml_layout(text)
+        if layout is None:
+            return None
+        offset = root_open.count('\n') + 1
+        units = xml_units(root, wrapped, layout, start - offset, self.normalize)
+        if units is None:
+            return None
+        units = units[1:]
+        if len(units) != len(old_units) or (units and units[0].start != start):
+            return None
+
+        # The wrapper numbers siblings from 1; same identities keep the original paths
+        rekeyed = []
+        for new, old in zip(units, old_units):
+            if new.meta != old.meta:
+                return None
+            value = {old.key + path[len(new.key):]: entry for path, entry in new.value.items()}
+            rekeyed.append(Unit(old.key, value, new.start, new.end, new.exclusive, old.meta))
+        return rekeyed
+
+    def whole(self, units, lines, keyed):
+        if not keyed:
+            return units[0].value
+        flat = {}
+        for unit in units:
+            flat.update(unit.value)
+        return flat
+
+    def compare(self, key, value1, value2):
+        return compare_xml({} if value1 is MISSING else value1, {} if value2 is MISSING else value2)
+
+    def compare_whole(self, value1, value2):
+        return compare_xml(value1, value2)
+
+    def statistics(self, diffs):
+        return xml_statistics(diffs)
+
+
+class CsvIndexer(Indexer):
+    """
+    Units are rows keyed by the key column. The key column depends on the
+    headers of both sides, so a header change re-indexes both sides.
+    """
+
+    def __init__(self):
+        self.headers = [None, None]
+        self.readers = [None, None]
+        self.used = [None, None]
+
+    def binding(self):
+        headers = [h for h in self.headers if h is not None]
+        if not headers:
+            return None
+        common = frozenset.intersection(*headers)
+        return (csv_key_column(common), common) if common else None
+
+    def pair_changed(self):
+        binding = self.binding()
+        return any(self.headers[side] is not None and self.used[side] != binding for side in (0, 1))
+
+    def index(self, lines, side):
+        text = '\n'.join(lines)
+        whole = [Unit(WHOLE, text, 0, len(lines), exclusive=False)], False
+        self.headers[side] = None
+        if not text.strip() or text != text.lstrip():
+            return whole
+
+        delimiter = detect_delimiter(text)
+        reader = csv.DictReader(io.StringIO(text.rstrip()), delimiter=delimiter)
+        try:
+            fieldnames = reader.fieldnames
+            if not fieldnames or reader.line_num != 1 or len(set(fieldnames)) != len(fieldnames):
+                return whole
+            self.headers[side] = frozenset(fieldnames)
+            self.readers[side] = (fieldnames, delimiter)
+            binding = self.used[side] = self.binding()
+            if binding is None:
+                return whole
+            units = self.read_rows(reader, binding[0])
+        except csv.Error as e:
+            raise ValueError(f'Invalid CSV: {e}')
+        if not units or len({unit.key for unit in units}) != len(units):
+            self.headers[side] = None
+            return whole
+        return units, True
+
+    def read_rows(self, reader, key_column):
+        # A row spans from the end of the previous one, so skipped blank lines belong to it
+        units = []
+        previous = reader.line_num
+        for row in reader:
+            if None in row:
+                # More fields than headers
+                return None
+            row['__row_number__'] = len(units) + 1
+            units.append(Unit(row.get(key_column), row, previous, reader.line_num))
+            previous = reader.line_num
+        return units
+
+    def index_region(self, lines, start, end, old_units, side):
+        text = '\n'.join(lines[start:end])
+        if end == len(lines):
+            text = text.rstrip()
+        # Balanced quotes keep quoted line breaks from reaching past the region
+        if text.count('"') % 2:
+            return None
+        fieldnames, delimiter = self.readers[side]
+        reader = csv.DictReader(io.StringIO(text), fieldnames=fieldnames, delimiter=delimiter)
+        units = []
+        previous = 0
+        try:
+            for row in reader:
+                if None in row:
+                    return None
+                row['__row_number__'] = 0
+                units.append(Unit(row.get(self.used[side][0]), row, start + previous, start + reader.line_num))
+                previous = reader.line_num
+        except csv.Error:
+            return None
+        if not units:
+            return [] if start == end else None
+        units[0].start = start
+        units[-1].end = end
+        return units
+
+    def whole(self, units, lines, keyed):
+        return '\n'.join(lines)
+
+    def compare(self, key, value1, value2):
+        key_column, common = self.binding()
+        return compare_csv_rows(key, None if value1 is MISSING else value1, None if value2 is MISSING else value2,
+                                key_column, common)
+
+    def compare_whole(self, value1, value2):
+        return compare_csv_data(parse_csv_string(value1), parse_csv_string(value2))
+
+    def pair_differences(self):
+        return compare_csv_headers(set(self.headers[0]), set(self.headers[1]))
+
+    def renumber(self, diffs, units):
+        # Row numbers shift with every inserted or deleted row, so they are filled in on output
+        positions = [{unit.key: str(i + 1) for i, unit in enumerate(side)} for side in units]
+        renumbered = []
+        for diff in diffs:
+            if 'Key' in diff:
+                diff = dict(diff)
+                key = diff['Key']
+                if 'Row1' in diff:
+                    diff['Row1'] = positions[0][key]
+                    diff['Row2'] = positions[1][key]
+                else:
+                    diff['Row'] = positions[0 if diff['Difference Type'] == 'Missing Row' else 1][key]
+            renumbered.append(diff)
+        return renumbered
+
+    def statistics(self, diffs):
+        return csv_statistics(diffs)
+
+
+def create_session(fmt, left, right, options=None):
+    """Parse and index both sides; raises SessionError if either does not parse"""
+    options = options or {}
+    if fmt == 'text':
+        return TextSession(left, right)
+    indexer = {
+        'json': lambda: JsonIndexer(options),
+        'yaml': lambda: YamlIndexer(options),
+        'xml': lambda: XmlIndexer(options),
+        'csv': CsvIndexer,
+    }[fmt]()
+    return UnitSession(fmt, indexer, left, right)
@@ -0,0 +1,118 @@
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional backend
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # optional backend
+    ujson = None
+
+
+def _select_backend():
+    # JSON_CODEC=json forces the standard library (e.g. to compare output)
+    requested = os.environ.get('JSON_CODEC', '').lower()
+    available = {'orjson': orjson, 'ujson': ujson, 'json': json}
+    if requested in available and available[requested] is not None:
+        return requested
+    if orjson is not None:
+        return 'orjson'
+    if ujson is not None:
+        return 'ujson'
+    return 'json'
+
+
+BACKEND = _select_backend()
+
+JSONDecodeError = json.JSONDecodeError
+
+# orjson and ujson read integers beyond 64 bits as floats (or fail), so
+# inputs with a run of 19+ digits are parsed by the standard library instead.
+# Mapping digits to 'd' and searching is several times faster than a regex.
+_DIGIT_TABLE = bytes(0x64 if 0x30 <= c <= 0x39 else 0x20 for c in range(256))
+_LONG_NUMBER = b'd' * 19
+
+
+def _may_overflow(data):
+    return _LONG_NUMBER in data.translate(_DIGIT_TABLE)
+
+
+def loads(s):
+    """Parse JSON text or bytes; errors are raised as json.JSONDecodeError"""
+    if BACKEND == 'json':
+        return json.loads(s)
+
+    data = s.encode('utf-8', 'surrogatepass') if isinstance(s, str) else bytes(s)
+    if _may_overflow(data):
+        return json.loads(s)
+    try:
+        if BACKEND == 'orjson':
+            return orjson.loads(data)
+        return ujson.loads(data)
+    except ValueError:
+        # Re-parse for the standard library's error message (and NaN/Infinity support)
+        return json.loads(s)
+
+
+def dumps(obj):
+    """Compact single-line JSON"""
+    try:
+        if BACKEND == 'orjson':
+            return orjson.dumps(obj).decode()
+        if BACKEND == 'ujson':
+            return ujson.dumps(obj, escape_forward_slashes=False)
+    except (TypeError, OverflowError):
+        pass
+    return json.dumps(obj)
+
+
+def dumps_pretty(obj):
+    """Two-space indented JSON, as shown in the comparison panes"""
+    try:
+        if BACKEND == 'orjson':
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+        if BACKEND == 'ujson':
+            return ujson.dumps(obj, indent=2, escape_forward_slashes=False)
+    except (TypeError, OverflowError):
+        pass
+    return json.dumps(obj, indent=2)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by the fastest available codec, used by
+    jsonify() and request.get_json(). Anything the fast codec cannot
+    encode (huge integers, unusual key types) falls back to the default.
+    """
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if BACKEND != 'orjson' or self._app.debug or self.compact is False:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        # Dates go through self.default so they render exactly as before
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            body = orjson.dumps(obj, default=self.default, option=option)
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def init_json_codec(app):
+    if BACKEND != 'json':
+        app.json_provider_class = FastJSONProvider
+        app.json = FastJSONProvider(app)
+    return app
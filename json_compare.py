@@ -0,0 +1,464 @@
+import difflib
+import hashlib
+import json
+
+import json_codec
+from comparators import Comparator, ComparisonInputError
+from limits import check_budget, BudgetExceeded
+from metrics import stage, timed
+
+# How list items are paired before comparing them:
+#   index - by position (the original behaviour)
+#   lcs   - by content hash, aligned with a longest-matching-subsequence pass
+#   key   - by the value of an identity key (array_key), lcs for the rest
+ARRAY_MODES = ('index', 'lcs', 'key')
+
+
+# Longest 'Property' rendering of a value before it is summarized
+VALUE_PREVIEW_LIMIT = 200
+
+
+def json_compare_options(data):
+    """Read and validate array alignment and value rendering options from a request payload"""
+    array_mode = data.get('array_mode') or 'index'
+    array_key = data.get('array_key')
+    if array_mode not in ARRAY_MODES:
+        raise ValueError(f"array_mode must be one of: {', '.join(ARRAY_MODES)}")
+    if array_mode == 'key' and not array_key:
+        raise ValueError("array_mode 'key' requires an array_key")
+
+    value_limit = data.get('value_limit', VALUE_PREVIEW_LIMIT)
+    if value_limit is not None and (not isinstance(value_limit, int) or isinstance(value_limit, bool)
+                                    or value_limit < 0):
+        raise ValueError("value_limit must be a non-negative integer or null")
+    return {'array_mode': array_mode, 'array_key': array_key, 'value_limit': value_limit}
+
+
+def content_hash(value):
+    """Stable hash of a JSON/YAML value, used to align list items"""
+    try:
+        return hash(json.dumps(value, sort_keys=True, default=str))
+    except TypeError:
+        # Mixed key types cannot be sorted
+        return hash(repr(value))
+
+
+def value_summary(value):
+    """Short description of a value: type, size and content hash"""
+    if isinstance(value, str):
+        content = value
+    else:
+        try:
+            content = json.dumps(value, sort_keys=True, default=str)
+        except TypeError:
+            content = repr(value)
+    digest = hashlib.sha1(content.encode('utf-8', 'replace')).hexdigest()[:12]
+
+    if isinstance(value, dict):
+        size = f'{len(value)} keys'
+    elif isinstance(value, list):
+        size = f'{len(value)} items'
+    else:
+        size = f'{len(str(value))} chars'
+    return f'{type(value).__name__}({size}, sha1 {digest})'
+
+
+def _repr_pieces(value):
+    """Yield str(value) for containers piece by piece, so it can be cut short"""
+    if isinstance(value, dict):
+        yield '{'
+        for n, (key, item) in enumerate(value.items()):
+            yield f'{", " if n else ""}{key!r}: '
+            yield from _repr_pieces(item)
+        yield '}'
+    elif isinstance(value, list):
+        yield '['
+        for n, item in enumerate(value):
+            if n:
+                yield ', '
+            yield from _repr_pieces(item)
+        yield ']'
+    else:
+        yield repr(value)
+
+
+def render_value(value, limit=VALUE_PREVIEW_LIMIT):
+    """
+    str(value), unless it is longer than limit; then a summary plus the
+    first limit characters. Returns (text, truncated). Large subtrees are
+    never rendered in full.
+    """
+    if limit is None:
+        return str(value), False
+
+    if isinstance(value, (dict, list)):
+        pieces = []
+        size = 0
+        for piece in _repr_pieces(value):
+            pieces.append(piece)
+            size += len(piece)
+            if size > limit:
+                break
+        else:
+            return ''.join(pieces), False
+        text = ''.join(pieces)
+    else:
+        text = str(value)
+        if len(text) <= limit:
+            return text, False
+
+    return f'{value_summary(value)} {text[:limit]}…', True
+
+
+def resolve_key_path(obj, path):
+    """
+    Find the value at a Key Path ("a.b[0].c") produced by compare_json_objects.
+    Keys may themselves contain '.' or '[', so candidate keys are matched
+    against the remaining path. Raises KeyError when nothing matches.
+    """
+    def resolve(value, rest, top):
+        if not rest:
+            return value
+        if isinstance(value, list) and rest.startswith('['):
+            end = rest.find(']')
+            index = rest[1:end]
+            if end > 0 and index.isdigit() and int(index) < len(value):
+                return resolve(value[int(index)], rest[end + 1:], False)
+        if isinstance(value, dict):
+            if not top:
+                if not rest.startswith('.'):
+                    raise KeyError(rest)
+                rest = rest[1:]
+            # Longest key first, so 'a.b' wins over 'a' for the path 'a.b'
+            for key in sorted(value, key=lambda k: -len(str(k))):
+                name = str(key)
+                if rest == name or (rest.startswith(name) and rest[len(name)] in '.['):
+                    try:
+                        return resolve(value[key], rest[len(name):], False)
+                    except KeyError:
+                        continue
+        raise KeyError(rest)
+
+    return resolve(obj, str(path), True)
+
+
+def json_path_map(obj, path=""):
+    """Map every Key Path in a JSON value to the value at that path"""
+    path_map = {}
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            current_path = f"{path}.{key}" if path else key
+            path_map[current_path] = value
+            if isinstance(value, (dict, list)):
+                path_map.update(json_path_map(value, current_path))
+    elif isinstance(obj, list):
+        for i, item in enumerate(obj):
+            current_path = f"{path}[{i}]"
+            path_map[current_path] = item
+            if isinstance(item, (dict, list)):
+                path_map.update(json_path_map(item, current_path))
+    return path_map
+
+
+def align_lists(list1, list2, array_mode='index', array_key=None):
+    """
+    Pair up list items. Returns (i, j) tuples in output order, where
+    i or j is None for an item that only exists on one side.
+    """
+    if array_mode == 'index':
+        return [(i if i < len(list1) else None, i if i < len(list2) else None)
+                for i in range(max(len(list1), len(list2)))]
+
+    if array_mode == 'key':
+        def identity(item):
+            if isinstance(item, dict) and array_key in item:
+                return content_hash(item[array_key])
+            return None
+
+        keyed2 = {}
+        for j, item in enumerate(list2):
+            ident = identity(item)
+            if ident is not None and ident not in keyed2:
+                keyed2[ident] = j
+
+        pairs = []
+        matched2 = set()
+        rest1 = []
+        for i, item in enumerate(list1):
+            ident = identity(item)
+            j = keyed2.get(ident) if ident is not None else None
+            if j is not None and j not in matched2:
+                matched2.add(j)
+                pairs.append((i, j))
+            else:
+                rest1.append(i)
+
+        # Items without a usable key are aligned by content
+        rest2 = [j for j in range(len(list2)) if j not in matched2]
+        for i, j in _align_by_content([list1[i] for i in rest1], [list2[j] for j in rest2]):
+            pairs.append((rest1[i] if i is not None else None, rest2[j] if j is not None else None))
+        return pairs
+
+    return _align_by_content(list1, list2)
+
+
+def _align_by_content(list1, list2):
+    hashes1 = [content_hash(item) for item in list1]
+    hashes2 = [content_hash(item) for item in list2]
+    matcher = difflib.SequenceMatcher(None, hashes1, hashes2, autojunk=False)
+
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            pairs.extend(zip(range(i1, i2), range(j1, j2)))
+        elif tag == 'delete':
+            pairs.extend((i, None) for i in range(i1, i2))
+        elif tag == 'insert':
+            pairs.extend((None, j) for j in range(j1, j2))
+        else:
+            # Replaced runs are compared item by item, the surplus is missing/extra
+            common = min(i2 - i1, j2 - j1)
+            pairs.extend((i1 + k, j1 + k) for k in range(common))
+            pairs.extend((i, None) for i in range(i1 + common, i2))
+            pairs.extend((None, j) for j in range(j1 + common, j2))
+    return pairs
+
+
+class _DifferenceLimit(Exception):
+    """Raised inside compare_json_objects once max_differences are collected"""
+
+
+def compare_json_objects(obj1, obj2, path="", array_mode='index', array_key=None,
+                         value_limit=VALUE_PREVIEW_LIMIT, max_differences=None, right_path=None):
+    """
+    Compare two JSON objects and return list of differences.
+    With array alignment, a matched item can sit at a different index on
+    each side; its differences then also carry the 'Right Key Path'.
+    Values longer than value_limit are summarized and the difference is
+    flagged 'Truncated' (None renders values in full).
+    Comparison stops once max_differences differences are found.
+    right_path is obj2's own path when it differs from obj1's.
+    """
+    differences = []
+
+    def render(value):
+        text, truncated = render_value(value, value_limit)
+        if truncated:
+            state['truncated'] = True
+        return text
+
+    def add(diff_type, path1, path2, prop):
+        # Extra items are addressed on the right side, everything else on the left
+        if diff_type == 'Extra':
+            diff = {'Difference Type': diff_type, 'Key Path': path2, 'Property': prop}
+        else:
+            diff = {'Difference Type': diff_type, 'Key Path': path1, 'Property': prop}
+            if diff_type != 'Missing' and path2 != path1:
+                diff['Right Key Path'] = path2
+        if state['truncated']:
+            diff['Truncated'] = True
+            state['truncated'] = False
+        differences.append(diff)
+        if max_differences is not None and len(differences) >= max_differences:
+            raise _DifferenceLimit()
+
+    state = {'truncated': False}
+
+    def compare_values(val1, val2, path1, path2):
+        check_budget()
+        if type(val1) != type(val2):
+            add('Type mismatch', path1, path2, f'{type(val1).__name__} vs {type(val2).__name__}')
+            return
+
+        if isinstance(val1, dict) and isinstance(val2, dict):
+            all_keys = set(val1.keys()) | set(val2.keys())
+            for key in all_keys:
+                key_path1 = f"{path1}.{key}" if path1 else key
+                key_path2 = f"{path2}.{key}" if path2 else key
+                if key not in val1:
+                    add('Extra', key_path1, key_path2, render(val2[key]))
+                elif key not in val2:
+                    add('Missing', key_path1, key_path2, render(val1[key]))
+                else:
+                    compare_values(val1[key], val2[key], key_path1, key_path2)
+
+        elif isinstance(val1, list) and isinstance(val2, list):
+            for i, j in align_lists(val1, val2, array_mode, array_key):
+                if i is None:
+                    add('Extra', None, f"{path2}[{j}]", render(val2[j]))
+                elif j is None:
+                    add('Missing', f"{path1}[{i}]", None, render(val1[i]))
+                else:
+                    compare_values(val1[i], val2[j], f"{path1}[{i}]", f"{path2}[{j}]")
+        else:
+            if val1 != val2:
+                add('Value mismatch', path1, path2, f'{render(val1)} -> {render(val2)}')
+
+    if max_differences is not None and max_differences <= 0:
+        return differences
+    try:
+        compare_values(obj1, obj2, path, path if right_path is None else right_path)
+    except _DifferenceLimit:
+        pass
+    return differences
+
+
+def json_statistics(diffs):
+    """Summary counts for a list of compare_json_objects differences"""
+    return {
+        'total_differences': len(diffs),
+        'missing_items': len([d for d in diffs if d['Difference Type'] == 'Missing']),
+        'extra_items': len([d for d in diffs if d['Difference Type'] == 'Extra']),
+        'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Value mismatch'])
+    }
+
+
+@timed('highlight')
+def highlight_json_strings(json1_str, json2_str, diffs, json1_obj=None, json2_obj=None, path_map1=None):
+    """
+    Add highlighting to JSON strings based on differences - exact line mapping.
+    path_map1 is json_path_map(json1_obj), reused when given.
+    """
+    try:
+        # Parse (unless already parsed) and format JSON
+        if json1_obj is None:
+            json1_obj = json_codec.loads(json1_str)
+        if json2_obj is None:
+            json2_obj = json_codec.loads(json2_str)
+        formatted1 = json_codec.dumps_pretty(json1_obj)
+        formatted2 = json_codec.dumps_pretty(json2_obj)
+        
+        lines1 = formatted1.split('\n')
+        lines2 = formatted2.split('\n')
+        
+        # Maps of JSON paths to actual objects for precise value lookup
+        if path_map1 is None:
+            path_map1 = json_path_map(json1_obj)
+        path_map2 = json_path_map(json2_obj)
+        
+        # Create sets of lines to highlight
+        highlight_lines1 = set()
+        highlight_lines2 = set()
+        
+        for diff in diffs:
+            check_budget()
+            diff_type = diff['Difference Type']
+            key_path = diff['Key Path']
+            
+            if diff_type == 'Missing':
+                # Find the line in JSON1 that contains this missing value
+                if key_path in path_map1:
+                    value = path_map1[key_path]
+                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
+                    
+                    # Look for the exact line that contains this key-value pair
+                    target_pattern = f'"{key_name}": {json_codec.dumps(value)}'
+                    for i, line in enumerate(lines1):
+                        if target_pattern in line.strip():
+                            highlight_lines1.add(i)
+                            break
+            
+            elif diff_type == 'Value mismatch':
+                # Find lines in both JSON files
+                if key_path in path_map1:
+                    value1 = path_map1[key_path]
+                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
+                    
+                    # Find in JSON1
+                    target_pattern1 = f'"{key_name}": {json_codec.dumps(value1)}'
+                    for i, line in enumerate(lines1):
+                        if target_pattern1 in line.strip():
+                            highlight_lines1.add(i)
+                            break
+                
+                right_path = diff.get('Right Key Path', key_path)
+                if right_path in path_map2:
+                    value2 = path_map2[right_path]
+                    key_name = right_path.split('.')[-1] if '.' in right_path else right_path.split('[')[0]
+                    
+                    # Find in JSON2
+                    target_pattern2 = f'"{key_name}": {json_codec.dumps(value2)}'
+                    for i, line in enumerate(lines2):
+                        if target_pattern2 in line.strip():
+                            highlight_lines2.add(i)
+                            break
+            
+            elif diff_type == 'Extra':
+                # Find the line in JSON2 that contains this extra value
+                if key_path in path_map2:
+                    value = path_map2[key_path]
+                    key_name = key_path.split('.')[-1] if '.' in key_path else key_path.split('[')[0]
+                    
+                    target_pattern = f'"{key_name}": {json_codec.dumps(value)}'
+                    for i, line in enumerate(lines2):
+                        if target_pattern in line.strip():
+                            highlight_lines2.add(i)
+                            break
+        
+        # Apply highlights
+        highlighted1 = []
+        for i, line in enumerate(lines1):
+            if i in highlight_lines1:
+                highlighted1.append(f'<span class="diff-removed">{line}</span>')
+            else:
+                highlighted1.append(line)
+        
+        highlighted2 = []
+        for i, line in enumerate(lines2):
+            if i in highlight_lines2:
+                highlighted2.append(f'<span class="diff-modified">{line}</span>')
+            else:
+                highlighted2.append(line)
+        
+        return '\n'.join(highlighted1), '\n'.join(highlighted2)
+        
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        print(f"Error in JSON highlighting: {e}")
+        import traceback
+        traceback.print_exc()
+        return json1_str, json2_str
+
+
+class JsonComparator(Comparator):
+    """The /compare_json comparator"""
+
+    format = 'json'
+    label = 'JSON'
+    sample = ('{"id": 1, "tags": ["a", "b"], "name": "x"}', '{"id": 1, "tags": ["a", "c"], "size": 2}')
+
+    def options(self, data):
+        return json_compare_options(data)
+
+    def parse(self, text):
+        try:
+            return json_codec.loads(text)
+        except json_codec.JSONDecodeError as e:
+            raise ComparisonInputError(f'Invalid JSON: {str(e)}')
+
+    def baseline_document(self, baseline):
+        return baseline.index['document']
+
+    def compare(self, comparison, max_differences=None):
+        with stage('compare'):
+            return compare_json_objects(comparison.doc1, comparison.doc2, max_differences=max_differences,
+                                        **comparison.options)
+
+    def highlight(self, text1, text2, diffs, comparison=None):
+        if comparison is None:
+            return highlight_json_strings(text1, text2, diffs)
+        return highlight_json_strings(text1, text2, diffs, comparison.doc1, comparison.doc2,
+                                      comparison.baseline.index['path_map'] if comparison.baseline else None)
+
+    def statistics(self, diffs):
+        return json_statistics(diffs)
+
+    def patch(self, comparison):
+        from patch_output import json_patch, render_json_patch
+        ops, truncated = json_patch(comparison.doc1, comparison.doc2, comparison.options['array_mode'],
+                                    comparison.options['array_key'], comparison.limit)
+        return render_json_patch(ops), 'application/json-patch+json', len(ops), truncated
+
+    def value_documents(self, comparison):
+        return [comparison.doc1], [comparison.doc2]
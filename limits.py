@@ -0,0 +1,161 @@
+"""
+Request size, difference count and per-stage time limits.
+
+    MAX_CONTENT_LENGTH  largest accepted request body in bytes, after
+                        decompression (default 100 MB); larger bodies get 413
+    MAX_STREAM_CONTENT_LENGTH
+                        the same for routes marked @body_limit (default 16 GB)
+    MAX_DIFFERENCES     differences a comparison collects before it stops and
+                        answers with "truncated": true (default 100000, 0 for
+                        no cap); requests may lower it with max_differences
+    STAGE_BUDGET        wall-clock seconds any one stage may run (off by default)
+    STAGE_BUDGETS       per-stage overrides, e.g. "compare=10,highlight=20"
+
+Budgets are cooperative: stages entered through metrics.stage()/timed()
+set a deadline, and the comparator and highlighter loops call
+check_budget(), which raises BudgetExceeded once it has passed. Work that
+runs in the process pool is not budgeted.
+"""
+import contextvars
+import os
+import time
+
+from flask import Request, current_app, jsonify, request
+
+
+DEFAULT_MAX_CONTENT_LENGTH = 100 * 1024 * 1024
+DEFAULT_MAX_STREAM_CONTENT_LENGTH = 16 * 1024 ** 3
+DEFAULT_MAX_DIFFERENCES = 100000
+
+_budgets = contextvars.ContextVar('stage_budgets', default=None)
+_deadline = contextvars.ContextVar('stage_deadline', default=None)
+
+
+class BudgetExceeded(Exception):
+    """A stage ran past its time budget"""
+
+    def __init__(self, stage, seconds):
+        super().__init__(f'{stage} stage exceeded its {seconds:g}s budget')
+        self.stage = stage
+        self.seconds = seconds
+
+
+def parse_budgets(default, overrides):
+    """{stage: seconds} from STAGE_BUDGET and STAGE_BUDGETS; None key is the default"""
+    budgets = {}
+    if default:
+        budgets[None] = float(default)
+    for item in (overrides or '').split(','):
+        if item.strip():
+            name, _, seconds = item.partition('=')
+            budgets[name.strip()] = float(seconds)
+    return budgets
+
+
+def stage_budget(name):
+    """Seconds the named stage may run in the current request, or None"""
+    budgets = _budgets.get()
+    if not budgets:
+        return None
+    return budgets.get(name, budgets.get(None))
+
+
+def enter_budget(name, seconds):
+    """Start a stage deadline; returns the token for exit_budget"""
+    deadline = (time.monotonic() + seconds, name, seconds)
+    current = _deadline.get()
+    if current is not None and current[0] < deadline[0]:
+        deadline = current
+    return _deadline.set(deadline)
+
+
+def exit_budget(token):
+    _deadline.reset(token)
+
+
+def budgets_active():
+    return _budgets.get() is not None
+
+
+def check_budget():
+    """Raise BudgetExceeded if the current stage is past its deadline"""
+    deadline = _deadline.get()
+    if deadline is not None and time.monotonic() > deadline[0]:
+        raise BudgetExceeded(deadline[1], deadline[2])
+
+
+def difference_limit(data, limit):
+    """
+    The difference cap for a request: the configured limit, lowered by the
+    request's max_differences. Returns None when neither sets one.
+    Raises ValueError for an invalid max_differences.
+    """
+    requested = data.get('max_differences')
+    if requested is not None and (not isinstance(requested, int) or isinstance(requested, bool)
+                                  or requested < 1):
+        raise ValueError('max_differences must be a positive integer')
+    if requested is None:
+        return limit or None
+    return min(requested, limit) if limit else requested
+
+
+def collect_limit(limit):
+    """What to pass as a comparator's max_differences: one past the cap, to detect truncation"""
+    return None if limit is None else limit + 1
+
+
+def cap_differences(diffs, limit):
+    """Returns (diffs, truncated), keeping at most limit differences"""
+    if limit is None or len(diffs) <= limit:
+        return diffs, False
+    return diffs[:limit], True
+
+
+def body_limit(config_key):
+    """Route decorator: cap this route's request bodies by config_key instead of MAX_CONTENT_LENGTH"""
+    def decorate(view):
+        view.body_limit = config_key
+        return view
+    return decorate
+
+
+class LimitedRequest(Request):
+    """Request whose body size limit can be raised per route with @body_limit"""
+
+    @property
+    def max_content_length(self):
+        view = current_app.view_functions.get(self.endpoint) if self.endpoint else None
+        config_key = getattr(view, 'body_limit', None)
+        if config_key:
+            return current_app.config.get(config_key)
+        return super().max_content_length
+
+
+def init_limits(app):
+    """Apply the body size limit and per-request stage budgets from the environment"""
+    # Flask defines MAX_CONTENT_LENGTH as None (unlimited) by default
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH') or DEFAULT_MAX_CONTENT_LENGTH)
+    app.config.setdefault('MAX_STREAM_CONTENT_LENGTH',
+                          int(os.environ.get('MAX_STREAM_CONTENT_LENGTH') or DEFAULT_MAX_STREAM_CONTENT_LENGTH))
+    app.request_class = LimitedRequest
+    app.config.setdefault('MAX_DIFFERENCES',
+                          int(os.environ.get('MAX_DIFFERENCES') or DEFAULT_MAX_DIFFERENCES))
+    app.config.setdefault('STAGE_BUDGETS',
+                          parse_budgets(os.environ.get('STAGE_BUDGET'), os.environ.get('STAGE_BUDGETS')))
+
+    @app.before_request
+    def start_budgets():
+        _budgets.set(app.config['STAGE_BUDGETS'] or None)
+        _deadline.set(None)
+
+    @app.teardown_request
+    def clear_budgets(exc):
+        _budgets.set(None)
+        _deadline.set(None)
+
+    @app.errorhandler(413)
+    def body_too_large(e):
+        return jsonify({'error': f'Request body exceeds the {request.max_content_length} byte limit'}), 413
+
+    return app
@@ -0,0 +1,420 @@
+import copy
+import difflib
+import xml.etree.ElementTree as ET
+
+from json_compare import compare_json_objects, content_hash, render_value, VALUE_PREVIEW_LIMIT
+from text_compare import text_differences
+from xml_compare import flatten_elements, compare_xml, canonical_attr, strip_ns
+from yaml_compare import compare_yaml_documents, pair_documents
+
+# Placeholder for "not present on this side"
+MISSING = object()
+
+_INVERSE_TAG = {'equal': 'equal', 'replace': 'replace', 'delete': 'insert', 'insert': 'delete'}
+
+
+def base_opcodes(base, *others):
+    """
+    Opcodes from base to each other sequence. The base is indexed once
+    (SequenceMatcher's seq2) and reused for every other side.
+    """
+    matcher = difflib.SequenceMatcher(None, autojunk=False)
+    matcher.set_seq2(base)
+    result = []
+    for other in others:
+        matcher.set_seq1(other)
+        result.append([(_INVERSE_TAG[tag], j1, j2, i1, i2)
+                       for tag, i1, i2, j1, j2 in matcher.get_opcodes()])
+    return result
+
+
+def _next_change(ops, k):
+    """Index of the first non-equal opcode at or after k"""
+    while k < len(ops) and ops[k][0] == 'equal':
+        k += 1
+    return k
+
+
+def _side_region(base, seq, ops, first, stop, start, end):
+    """base[start:end] with the changes ops[first:stop] of one side applied"""
+    region = []
+    pos = start
+    for k in range(first, stop):
+        tag, i1, i2, j1, j2 = ops[k]
+        if tag != 'equal':
+            region.extend(base[pos:i1])
+            region.extend(seq[j1:j2])
+            pos = i2
+    region.extend(base[pos:end])
+    return region
+
+
+def merge_sequences(base, ours, theirs, ours_ops, theirs_ops):
+    """
+    diff3-style merge of two edits of a base sequence. Returns chunks:
+    ('ok', items) or ('conflict', base_items, ours_items, theirs_items, base_start).
+    Overlapping or touching edits from both sides conflict unless identical.
+    Both opcode lists are walked once, in step along the base.
+    """
+    sides = (ours, theirs)
+    ops = (ours_ops, theirs_ops)
+    heads = [_next_change(ours_ops, 0), _next_change(theirs_ops, 0)]
+
+    chunks = []
+    pos = 0
+    while heads[0] < len(ours_ops) or heads[1] < len(theirs_ops):
+        # Take changes in base order, ours first on ties, while they overlap or touch
+        first = heads[:]
+        stop = heads[:]
+        start = end = None
+        while True:
+            waiting = [(ops[side][heads[side]][1], ops[side][heads[side]][2], side)
+                       for side in (0, 1) if heads[side] < len(ops[side])]
+            if not waiting:
+                break
+            i1, i2, side = min(waiting)
+            if start is None:
+                start, end = i1, i2
+            elif i1 > end:
+                break
+            else:
+                end = max(end, i2)
+            stop[side] = heads[side] + 1
+            heads[side] = _next_change(ops[side], stop[side])
+
+        if start > pos:
+            chunks.append(('ok', base[pos:start]))
+
+        changed = [stop[side] > first[side] for side in (0, 1)]
+        regions = [_side_region(base, sides[side], ops[side], first[side], stop[side], start, end)
+                   if changed[side] else None for side in (0, 1)]
+        if not changed[1]:
+            chunks.append(('ok', regions[0]))
+        elif not changed[0] or regions[0] == regions[1]:
+            chunks.append(('ok', regions[1]))
+        else:
+            chunks.append(('conflict', base[start:end], regions[0], regions[1], start))
+        pos = end
+
+    if pos < len(base):
+        chunks.append(('ok', base[pos:]))
+    return chunks
+
+
+def _same(a, b):
+    return type(a) is type(b) and a == b
+
+
+def _render(value, limit):
+    if value is MISSING:
+        return '(absent)'
+    return render_value(value, limit)[0]
+
+
+def merge_values(base, ours, theirs, path, conflicts, limit=VALUE_PREVIEW_LIMIT):
+    """
+    Three-way merge of JSON/YAML values. Returns the merged value (MISSING
+    when the key should be dropped); conflicts keep ours and are recorded.
+    """
+    if _same(ours, theirs):
+        return ours
+    if _same(base, ours):
+        return theirs
+    if _same(base, theirs):
+        return ours
+
+    if isinstance(base, dict) and isinstance(ours, dict) and isinstance(theirs, dict):
+        merged = {}
+        for key in list(ours) + [key for key in theirs if key not in ours]:
+            key_path = f"{path}.{key}" if path else key
+            value = merge_values(base.get(key, MISSING), ours.get(key, MISSING),
+                                 theirs.get(key, MISSING), key_path, conflicts, limit)
+            if value is not MISSING:
+                merged[key] = value
+        return merged
+
+    if isinstance(base, list) and isinstance(ours, list) and isinstance(theirs, list):
+        ours_ops, theirs_ops = base_opcodes([content_hash(item) for item in base],
+                                            [content_hash(item) for item in ours],
+                                            [content_hash(item) for item in theirs])
+        merged = []
+        for chunk in merge_sequences(base, ours, theirs, ours_ops, theirs_ops):
+            if chunk[0] == 'ok':
+                merged.extend(chunk[1])
+                continue
+            _, base_items, ours_items, theirs_items, start = chunk
+            if len(base_items) == len(ours_items) == len(theirs_items):
+                # Same items edited on both sides: merge them one by one
+                for k in range(len(base_items)):
+                    merged.append(merge_values(base_items[k], ours_items[k], theirs_items[k],
+                                               f"{path}[{start + k}]", conflicts, limit))
+            else:
+                conflicts.append(_value_conflict(f"{path}[{start}]", base_items, ours_items, theirs_items, limit))
+                merged.extend(ours_items)
+        return merged
+
+    conflicts.append(_value_conflict(path, base, ours, theirs, limit))
+    return ours
+
+
+def _value_conflict(path, base, ours, theirs, limit):
+    return {
+        'Difference Type': 'Conflict',
+        'Key Path': path,
+        'Base': _render(base, limit),
+        'Ours': _render(ours, limit),
+        'Theirs': _render(theirs, limit),
+    }
+
+
+def merge_json(base, ours, theirs, **options):
+    """Merge parsed JSON documents; returns (merged, conflicts, ours_changes, theirs_changes)"""
+    limit = options.get('value_limit', VALUE_PREVIEW_LIMIT)
+    conflicts = []
+    merged = merge_values(base, ours, theirs, '', conflicts, limit)
+    return (None if merged is MISSING else merged, conflicts,
+            compare_json_objects(base, ours, **options),
+            compare_json_objects(base, theirs, **options))
+
+
+def _align(base_docs, other_docs):
+    """
+    pair_documents(base, other) split into {base index: (label, other index
+    or None)} and the other side's additions as [(label, other index)]
+    """
+    matched, added = {}, []
+    for label, base_index, index in pair_documents(base_docs, other_docs):
+        if base_index is None:
+            added.append((label, index))
+        else:
+            matched[base_index] = (label, index)
+    return matched, added
+
+
+def merge_yaml(base_docs, ours_docs, theirs_docs, **options):
+    """
+    Merge YAML streams. Base documents are paired with each side by
+    pair_documents(), as /compare_yaml pairs them, and merged like JSON;
+    documents both sides added are paired with each other the same way.
+    Returns a list of merged documents in ours' order, followed by theirs'
+    additions.
+    """
+    limit = options.get('value_limit', VALUE_PREVIEW_LIMIT)
+    conflicts = []
+    if len(base_docs) == len(ours_docs) == len(theirs_docs) == 1:
+        merged = [merge_values(base_docs[0], ours_docs[0], theirs_docs[0], '', conflicts, limit)]
+    else:
+        ours_matched, ours_added = _align(base_docs, ours_docs)
+        theirs_matched, theirs_added = _align(base_docs, theirs_docs)
+        base_index = {index: i for i, (_, index) in ours_matched.items() if index is not None}
+        added_labels = dict((index, label) for label, index in ours_added)
+        added_pairs = {}
+        theirs_only = []
+        for _, i, j in pair_documents([ours_docs[index] for _, index in ours_added],
+                                      [theirs_docs[index] for _, index in theirs_added]):
+            if i is None:
+                theirs_only.append(theirs_added[j])
+            elif j is not None:
+                added_pairs[ours_added[i][1]] = theirs_added[j][1]
+
+        def theirs_doc(index):
+            return MISSING if index is None else theirs_docs[index]
+
+        # (label, base, ours, theirs) for every document on any side
+        triples = []
+        for index, doc in enumerate(ours_docs):
+            if index in base_index:
+                i = base_index[index]
+                triples.append((ours_matched[i][0], base_docs[i], doc, theirs_doc(theirs_matched[i][1])))
+            else:
+                triples.append((added_labels[index], MISSING, doc, theirs_doc(added_pairs.get(index))))
+        for i, (label, index) in ours_matched.items():
+            if index is None:
+                # Deleted by ours
+                triples.append((label, base_docs[i], MISSING, theirs_doc(theirs_matched[i][1])))
+        triples.extend((label, MISSING, MISSING, theirs_docs[index]) for label, index in theirs_only)
+
+        merged = []
+        for label, base, ours, theirs in triples:
+            doc_conflicts = []
+            value = merge_values(base, ours, theirs, '', doc_conflicts, limit)
+            for conflict in doc_conflicts:
+                conflict['Document'] = label
+            conflicts.extend(doc_conflicts)
+            if value is not MISSING:
+                merged.append(value)
+
+    return ([doc for doc in merged if doc is not MISSING], conflicts,
+            compare_yaml_documents(base_docs, ours_docs, **options),
+            compare_yaml_documents(base_docs, theirs_docs, **options))
+
+
+def merge_text(base_text, ours_text, theirs_text):
+    """Line-based merge with conflict markers; returns (merged, conflicts, ours_changes, theirs_changes)"""
+    base = base_text.splitlines()
+    ours = ours_text.splitlines()
+    theirs = theirs_text.splitlines()
+    ours_ops, theirs_ops = base_opcodes(base, ours, theirs)
+
+    merged = []
+    conflicts = []
+    for chunk in merge_sequences(base, ours, theirs, ours_ops, theirs_ops):
+        if chunk[0] == 'ok':
+            merged.extend(chunk[1])
+            continue
+        _, base_lines, ours_lines, theirs_lines, start = chunk
+        conflicts.append({
+            'Difference Type': 'Conflict',
+            'Line Number': f'Line {start + 1}',
+            'Base': '\n'.join(base_lines),
+            'Ours': '\n'.join(ours_lines),
+            'Theirs': '\n'.join(theirs_lines),
+        })
+        merged.append('<<<<<<< ours')
+        merged.extend(ours_lines)
+        merged.append('=======')
+        merged.extend(theirs_lines)
+        merged.append('>>>>>>> theirs')
+
+    merged_text = '\n'.join(merged)
+    if merged and ours_text.endswith('\n'):
+        merged_text += '\n'
+    return (merged_text, conflicts,
+            text_differences(base, ours, ours_ops),
+            text_differences(base, theirs, theirs_ops))
+
+
+def _xml_conflict(path, attribute, base, ours, theirs):
+    return {
+        'Difference Type': 'Conflict',
+        'Tag Path': path,
+        'Attribute': attribute,
+        'Base': '(absent)' if base is None else base,
+        'Ours': '(absent)' if ours is None else ours,
+        'Theirs': '(absent)' if theirs is None else theirs,
+    }
+
+
+def _set_attribute(elem, name, value):
+    # Attributes are flattened under canonical local names; write back to the original key
+    key = next((k for k in elem.attrib if canonical_attr(strip_ns(k)) == name), name)
+    if value is None:
+        elem.attrib.pop(key, None)
+    else:
+        elem.set(key, value)
+
+
+def _subtree_paths(elem, paths):
+    """Flattened paths of elem and its descendants (ignored tags have none)"""
+    return {paths[e] for e in elem.iter() if e in paths}
+
+
+def merge_xml(base_root, ours_root, theirs_root):
+    """
+    Merge XML trees by applying theirs' changes (relative to a shared
+    flattened base) onto ours' element tree, so everything ours did not
+    touch - ignored tags, namespaces, formatting of text - is preserved.
+    Returns (merged_xml, conflicts, ours_changes, theirs_changes).
+    """
+    base_elements = {}
+    base = flatten_elements(base_root, base_elements)
+    ours_elements = {}
+    ours = flatten_elements(ours_root, ours_elements)
+    theirs_elements = {}
+    theirs = flatten_elements(theirs_root, theirs_elements)
+
+    ours_parents = {child: parent for parent in ours_root.iter() for child in parent}
+    theirs_parents = {child: parent for parent in theirs_root.iter() for child in parent}
+    base_parents = {child: parent for parent in base_root.iter() for child in parent}
+    base_paths = {elem: path for path, elem in base_elements.items()}
+    ours_paths = {elem: path for path, elem in ours_elements.items()}
+    theirs_paths = {elem: path for path, elem in theirs_elements.items()}
+
+    conflicts = []
+    handled = []  # subtrees already removed, copied or reported as a whole
+
+    def covered(path):
+        return any(path.startswith(prefix + '/') for prefix in handled)
+
+    def subtree_edited(path, side, side_elements, side_paths):
+        # Any element at or below path added, removed, or with other text or attributes
+        paths = _subtree_paths(side_elements[path], side_paths)
+        return (paths != _subtree_paths(base_elements[path], base_paths)
+                or any(side[p] != base[p] for p in paths))
+
+    def ours_deleted_root(path):
+        # The outermost element ours removed along with this base path
+        elem = base_elements[path]
+        parent = base_parents.get(elem)
+        while parent is not None and base_paths[parent] not in ours:
+            elem, parent = parent, base_parents.get(parent)
+        return base_paths[elem]
+
+    changed = [path for path, record in theirs.items() if base.get(path) != record]
+    changed += [path for path in base if path not in theirs]
+
+    for path in changed:
+        if covered(path):
+            continue
+        b, o, t = base.get(path), ours.get(path), theirs.get(path)
+
+        if o is None and b is not None:
+            # Deleted by ours, possibly with an ancestor: theirs must have left that subtree alone
+            root = ours_deleted_root(path)
+            if root in theirs and subtree_edited(root, theirs, theirs_elements, theirs_paths):
+                conflicts.append(_xml_conflict(root, '-', 'present', 'deleted', 'modified'))
+                handled.append(root)
+            continue
+
+        if t is None:
+            # Deleted by theirs: ours must not have changed anything in the subtree
+            if subtree_edited(path, ours, ours_elements, ours_paths):
+                conflicts.append(_xml_conflict(path, '-', 'present', 'modified', 'deleted'))
+                handled.append(path)
+                continue
+            elem = ours_elements[path]
+            parent = ours_parents.get(elem)
+            if parent is not None:
+                parent.remove(elem)
+                handled.append(path)
+
+        elif b is None:
+            # Added by theirs
+            if o is not None:
+                if o != t:
+                    conflicts.append(_xml_conflict(path, '-', None, 'added', 'added differently'))
+                continue
+            theirs_elem = theirs_elements[path]
+            theirs_parent = theirs_parents.get(theirs_elem)
+            parent = ours_elements.get(theirs_paths.get(theirs_parent))
+            if parent is None:
+                conflicts.append(_xml_conflict(path, '-', None, 'parent deleted', 'added'))
+                continue
+            position = len(parent)
+            siblings = list(theirs_parent)
+            index = siblings.index(theirs_elem)
+            if index > 0:
+                previous = ours_elements.get(theirs_paths.get(siblings[index - 1]))
+                if previous is not None and previous in list(parent):
+                    position = list(parent).index(previous) + 1
+            parent.insert(position, copy.deepcopy(theirs_elem))
+            handled.append(path)
+
+        else:
+            elem = ours_elements[path]
+            for name in set(b['attrib']) | set(t['attrib']):
+                bv, ov, tv = b['attrib'].get(name), o['attrib'].get(name), t['attrib'].get(name)
+                if tv == bv or ov == tv:
+                    continue
+                if ov == bv:
+                    _set_attribute(elem, name, tv)
+                else:
+                    conflicts.append(_xml_conflict(path, name, bv, ov, tv))
+            if t['text'] != b['text'] and o['text'] != t['text']:
+                if o['text'] == b['text']:
+                    elem.text = theirs_elements[path].text
+                else:
+                    conflicts.append(_xml_conflict(path, '(text)', b['text'], o['text'], t['text']))
+
+    merged = ET.tostring(ours_root, encoding='unicode')
+    return merged, conflicts, compare_xml(base, ours), compare_xml(base, theirs)
@@ -0,0 +1,307 @@
+"""
+Opt-in per-stage instrumentation of the comparison hot path.
+
+Code marks its stages with `with stage('parse'):` or `@timed('flatten')`.
+While a request is being measured each stage's duration (and, when
+tracemalloc is tracing, its allocation peak) is added to the request's
+Timings. Stages also carry the time budgets from limits.py; with neither
+active, marking a stage costs two context variable lookups.
+
+A request is measured when METRICS=1 is set, which also records every
+request into Prometheus histograms served at /metrics, or when it asks for
+a `timings` block in its response (`"timings": true` in the JSON body or
+`?timings=1`). METRICS_TRACEMALLOC=1 additionally starts tracemalloc so
+per-stage allocation peaks are recorded; it slows allocation-heavy stages
+noticeably and the peak is process-wide, so use it with one thread.
+
+Metrics are kept per worker process.
+"""
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+import tracemalloc
+
+from flask import Response, g, request
+
+import json_codec
+from limits import budgets_active, enter_budget, exit_budget, stage_budget
+
+_current = contextvars.ContextVar('metrics_timings', default=None)
+_NOT_MEASURED = contextlib.nullcontext()
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1 KB .. 256 MB
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _env_flag(name):
+    return os.environ.get(name, '').lower() not in ('', '0', 'false', 'no')
+
+
+class Timings:
+    """Stage durations and counters of one measured request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counts = {}
+        # Allocation peak an inner stage's reset_peak() hid from the stage around it
+        self.hidden_peak = 0
+
+    def add(self, name, seconds, peak=None):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {'seconds': 0.0, 'calls': 0}
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        if peak is not None:
+            entry['peak_bytes'] = max(entry.get('peak_bytes', 0), peak)
+
+    def as_dict(self):
+        block = {
+            'total_ms': round((time.perf_counter() - self.start) * 1000, 3),
+            'stages': {name: {'ms': round(entry['seconds'] * 1000, 3), 'calls': entry['calls'],
+                              **({'peak_bytes': entry['peak_bytes']} if 'peak_bytes' in entry else {})}
+                       for name, entry in self.stages.items()},
+        }
+        block.update(self.counts)
+        return block
+
+
+class _Stage:
+    __slots__ = ('timings', 'name', 'start', 'base', 'outer_peak', 'budget')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        # The stage's time budget (see limits.py) applies whether or not it is measured
+        self.budget = None
+        seconds = stage_budget(self.name)
+        if seconds:
+            self.budget = enter_budget(self.name, seconds)
+        self.base = None
+        if self.timings is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.base = current
+            # Resetting the peak hides it from an enclosing stage, so it is
+            # kept here and handed back on exit
+            self.outer_peak = max(peak, self.timings.hidden_peak)
+            self.timings.hidden_peak = 0
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.budget is not None:
+            exit_budget(self.budget)
+        if self.timings is None:
+            return False
+        elapsed = time.perf_counter() - self.start
+        peak = None
+        if self.base is not None:
+            absolute = max(tracemalloc.get_traced_memory()[1], self.timings.hidden_peak)
+            peak = max(0, absolute - self.base)
+            self.timings.hidden_peak = max(self.outer_peak, absolute)
+        self.timings.add(self.name, elapsed, peak)
+        return False
+
+
+def stage(name):
+    """Context manager timing (and budgeting) a stage of the current request"""
+    timings = _current.get()
+    if timings is None and not budgets_active():
+        return _NOT_MEASURED
+    return _Stage(timings, name)
+
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None and not budgets_active():
+                return func(*args, **kwargs)
+            with _Stage(timings, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value):
+    """Add to a counter of the current request (e.g. differences found)"""
+    timings = _current.get()
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, observed) in sorted(self.series.items()):
+            base = _labels(label_names, labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{base}le="{bound:g}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{base}le="+Inf"}} {observed}')
+            lines.append(f'{self.name}_sum{{{base.rstrip(",")}}} {total:g}')
+            lines.append(f'{self.name}_count{{{base.rstrip(",")}}} {observed}')
+        return lines
+
+
+class Metric:
+    """A counter (add) or a high-water-mark gauge (maximum)"""
+
+    def __init__(self, name, help_text, kind):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.series = {}
+
+    def add(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def maximum(self, labels, value):
+        self.series[labels] = max(self.series.get(labels, 0), value)
+
+    def render(self, label_names):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in sorted(self.series.items()):
+            lines.append(f'{self.name}{{{_labels(label_names, labels).rstrip(",")}}} {value:g}')
+        return lines
+
+
+def _labels(names, values):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in values)
+    return ''.join(f'{name}="{value}",' for name, value in zip(names, escaped))
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Metric('differ_requests_total', 'Requests handled', 'counter')
+        self.request_seconds = Histogram(
+            'differ_request_duration_seconds', 'Request handling time', DURATION_BUCKETS)
+        self.stage_seconds = Histogram(
+            'differ_stage_duration_seconds', 'Time spent in each comparison stage', DURATION_BUCKETS)
+        self.input_bytes = Histogram('differ_request_input_bytes', 'Request body size', SIZE_BUCKETS)
+        self.differences = Histogram('differ_differences', 'Differences found per request', COUNT_BUCKETS)
+        self.stage_peak = Metric(
+            'differ_stage_peak_memory_bytes', 'Largest allocation peak seen in each stage', 'gauge')
+
+    def record(self, endpoint, status, timings, input_bytes):
+        with self.lock:
+            self.requests.add((endpoint, status))
+            self.request_seconds.observe((endpoint,), time.perf_counter() - timings.start)
+            self.input_bytes.observe((endpoint,), input_bytes)
+            if 'differences' in timings.counts:
+                self.differences.observe((endpoint,), timings.counts['differences'])
+            for name, entry in timings.stages.items():
+                self.stage_seconds.observe((endpoint, name), entry['seconds'])
+                if 'peak_bytes' in entry:
+                    self.stage_peak.maximum((endpoint, name), entry['peak_bytes'])
+
+    def render(self):
+        with self.lock:
+            lines = (self.requests.render(('endpoint', 'status'))
+                     + self.request_seconds.render(('endpoint',))
+                     + self.stage_seconds.render(('endpoint', 'stage'))
+                     + self.input_bytes.render(('endpoint',))
+                     + self.differences.render(('endpoint',))
+                     + self.stage_peak.render(('endpoint', 'stage')))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def _wants_timings():
+    if request.args.get('timings', '').lower() in ('1', 'true'):
+        return True
+    if request.is_json:
+        data = request.get_json(silent=True)
+        return isinstance(data, dict) and bool(data.get('timings'))
+    return False
+
+
+def _add_timings(response, block):
+    """Splice "timings" into a JSON object body without re-encoding it"""
+    body = response.get_data()
+    end = body.rfind(b'}')
+    if not body.lstrip().startswith(b'{') or end < 0:
+        return
+    separator = b',' if body[:end].rstrip()[-1:] != b'{' else b''
+    response.set_data(body[:end] + separator + b'"timings":' + json_codec.dumps(block).encode() + body[end:])
+
+
+def init_metrics(app):
+    """
+    Measure requests that opt in (see the module docstring), time jsonify as
+    the "serialize" stage and serve /metrics when METRICS=1.
+    Call after init_compression and init_json_codec, so timings are added
+    before the body is compressed and the final JSON provider is wrapped.
+    """
+    app.config.setdefault('METRICS', _env_flag('METRICS'))
+    if _env_flag('METRICS_TRACEMALLOC') and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    provider_response = app.json.response
+
+    def serialize(*args, **kwargs):
+        with stage('serialize'):
+            return provider_response(*args, **kwargs)
+    app.json.response = serialize
+
+    @app.before_request
+    def start_timings():
+        if request.endpoint in (None, 'static', 'metrics'):
+            return
+        g.wants_timings = _wants_timings()
+        if app.config['METRICS'] or g.wants_timings:
+            g.timings = Timings()
+            _current.set(g.timings)
+
+    @app.after_request
+    def finish_timings(response):
+        timings = g.pop('timings', None)
+        if timings is None:
+            return response
+        _current.set(None)
+        if app.config['METRICS']:
+            input_bytes = request.content_length or (len(request.get_data()) if request.is_json else 0)
+            registry.record(request.endpoint, response.status_code, timings, input_bytes)
+        if g.get('wants_timings') and response.is_json and not response.is_streamed:
+            _add_timings(response, timings.as_dict())
+        return response
+
+    @app.teardown_request
+    def clear_timings(exc):
+        _current.set(None)
+
+    def metrics():
+        if not app.config['METRICS']:
+            return {'error': 'metrics are disabled; set METRICS=1'}, 404
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    return app
@@ -0,0 +1,384 @@
+"""
+Machine-readable change sets, for clients that do not need highlighted panes.
+
+    JSON, YAML  RFC 6902 JSON Patch: add/remove/replace/move operations with
+                JSON Pointer paths that turn the first document into the second
+    XML         RFC 5261-style <diff> of add/remove/replace operations whose
+                selectors are the XPath-like paths compare_xml reports
+    text        unified diff hunks
+
+Operations are ordered so they apply one after another: JSON array items
+are removed, added or moved at their position at that point, and XML
+elements are removed last-sibling-first, before anything is added. XML
+siblings are matched by tag and position as compare_xml matches them, so
+the patched document compares equal to the second one, though siblings
+with different tags may end up in another order.
+"""
+import copy
+import difflib
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+import json_codec
+from json_compare import align_lists
+from limits import check_budget
+from metrics import timed
+from xml_compare import attribute_key
+
+OUTPUT_MODES = ('panes', 'patch')
+
+DEFAULT_CONTEXT_LINES = 3
+
+# The position predicate ending a flattened XML path
+_POSITION = re.compile(r'\[(\d+)\]$')
+
+
+class _PatchLimit(Exception):
+    """Raised once max_operations operations are collected"""
+
+
+def output_options(data, args=None):
+    """
+    Read and validate output ("panes" or "patch") and, for unified diffs,
+    context (lines around each hunk) from a request payload or query string.
+    """
+    args = args or {}
+    output = data.get('output') or args.get('output') or 'panes'
+    if output not in OUTPUT_MODES:
+        raise ValueError(f"output must be one of: {', '.join(OUTPUT_MODES)}")
+    context = data.get('context', args.get('context', DEFAULT_CONTEXT_LINES))
+    try:
+        context = int(context)
+    except (TypeError, ValueError):
+        context = -1
+    if context < 0 or isinstance(data.get('context'), bool):
+        raise ValueError('context must be a non-negative integer')
+    return {'output': output, 'context': context}
+
+
+class _Operations(list):
+    """Patch operations, raising _PatchLimit on the first one past max_operations"""
+
+    def __init__(self, max_operations):
+        super().__init__()
+        self.max_operations = max_operations
+
+    def emit(self, op):
+        if self.max_operations is not None and len(self) >= self.max_operations:
+            raise _PatchLimit()
+        self.append(op)
+
+
+def _escape_token(token):
+    # RFC 6901: "~" and "/" inside a reference token
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+@timed('compare')
+def json_patch(obj1, obj2, array_mode='index', array_key=None, max_operations=None):
+    """
+    RFC 6902 operations turning obj1 into obj2, pairing list items as
+    compare_json_objects does. Returns (operations, truncated); a patch
+    with more than max_operations operations is cut to the first ones.
+    """
+    ops = _Operations(max_operations)
+
+    def diff_values(val1, val2, pointer):
+        check_budget()
+        if type(val1) != type(val2):
+            ops.emit({'op': 'replace', 'path': pointer, 'value': val2})
+        elif isinstance(val1, dict):
+            for key in val1:
+                if key not in val2:
+                    ops.emit({'op': 'remove', 'path': f'{pointer}/{_escape_token(key)}'})
+            for key, value in val1.items():
+                if key in val2:
+                    diff_values(value, val2[key], f'{pointer}/{_escape_token(key)}')
+            for key, value in val2.items():
+                if key not in val1:
+                    ops.emit({'op': 'add', 'path': f'{pointer}/{_escape_token(key)}', 'value': value})
+        elif isinstance(val1, list):
+            diff_lists(val1, val2, pointer)
+        elif val1 != val2:
+            ops.emit({'op': 'replace', 'path': pointer, 'value': val2})
+
+    def diff_lists(list1, list2, pointer):
+        pairs = align_lists(list1, list2, array_mode, array_key)
+        left = [i for i, _ in pairs if i is not None]
+        right = [j for _, j in pairs if j is not None]
+        if left == sorted(left) and right == sorted(right):
+            # Both sides in order: the first pos items are final, the rest is list1's tail
+            pos = 0
+            for i, j in pairs:
+                if j is None:
+                    ops.emit({'op': 'remove', 'path': f'{pointer}/{pos}'})
+                    continue
+                if i is None:
+                    ops.emit({'op': 'add', 'path': f'{pointer}/{pos}', 'value': list2[j]})
+                else:
+                    diff_values(list1[i], list2[j], f'{pointer}/{pos}')
+                pos += 1
+            return
+
+        # Items matched by key in a different order: remove, then move into place
+        source = {j: i for i, j in pairs if i is not None and j is not None}
+        for i in sorted((i for i, j in pairs if j is None), reverse=True):
+            ops.emit({'op': 'remove', 'path': f'{pointer}/{i}'})
+        working = sorted(source.values())
+        for t in range(len(list2)):
+            i = source.get(t)
+            if i is None:
+                ops.emit({'op': 'add', 'path': f'{pointer}/{t}', 'value': list2[t]})
+                working.insert(t, None)
+                continue
+            p = working.index(i, t)
+            if p != t:
+                ops.emit({'op': 'move', 'from': f'{pointer}/{p}', 'path': f'{pointer}/{t}'})
+                working.insert(t, working.pop(p))
+            diff_values(list1[i], list2[t], f'{pointer}/{t}')
+
+    try:
+        diff_values(obj1, obj2, '')
+    except _PatchLimit:
+        return list(ops), True
+    return list(ops), False
+
+
+def yaml_patch(docs1, docs2, array_mode='index', array_key=None, max_operations=None):
+    """
+    JSON Patch between two YAML streams: against the document itself when
+    both hold one document, otherwise against the list of documents.
+    """
+    if len(docs1) == 1 and len(docs2) == 1:
+        return json_patch(docs1[0], docs2[0], array_mode, array_key, max_operations)
+    return json_patch(docs1, docs2, 'index', None, max_operations)
+
+
+def render_json_patch(ops):
+    """Yield the JSON text of a patch document, an operation at a time"""
+    yield '['
+    for n, op in enumerate(ops):
+        yield (',\n' if n else '\n') + json_codec.dumps(op)
+    yield '\n]\n' if ops else ']\n'
+
+
+def _element_markup(elem):
+    # The element without the text that follows it in its parent
+    elem = copy.copy(elem)
+    elem.tail = None
+    return ET.tostring(elem, encoding='unicode')
+
+
+def _attribute_selector(path, key):
+    if key.startswith('{'):
+        uri, name = key[1:].split('}', 1)
+        return f"{path}/@*[local-name()='{name}' and namespace-uri()='{uri}']"
+    return f'{path}/@{key}'
+
+
+def _raw_attributes(elem, namespaces):
+    """{flattened attribute key: (name, raw value)}"""
+    return {attribute_key(name, namespaces): (name, value) for name, value in elem.attrib.items()}
+
+
+@timed('compare')
+def xml_patch(flat1, flat2, elements2, namespaces=False, max_operations=None):
+    """
+    RFC 5261-style operations turning one flattened document into another;
+    elements2 is the second document's element map from flatten_elements.
+    Each operation is {"op": "add"|"remove"|"replace", "sel": path, ...}
+    with an optional "pos" ("after"/"prepend") or "type" ("@name" for a
+    new attribute), and either "element" (markup) or "value" (text) for
+    the new content. Values compare as compare_xml compares them, so
+    normalization rules apply. Returns (operations, truncated).
+    """
+    ops = _Operations(max_operations)
+    try:
+        # A different root element replaces the whole document
+        if flat1 and flat2 and next(iter(flat1)) != next(iter(flat2)):
+            root2 = elements2[next(iter(flat2))]
+            ops.emit({'op': 'replace', 'sel': next(iter(flat1)), 'element': _element_markup(root2)})
+            return list(ops), False
+
+        # Elements only in the first document, last first so sibling positions stay valid.
+        # Flattened paths are in document order, so a subtree follows its root.
+        removed = []
+        for path in flat1:
+            if path not in flat2 and not (removed and path.startswith(removed[-1] + '/')):
+                removed.append(path)
+        for path in reversed(removed):
+            check_budget()
+            ops.emit({'op': 'remove', 'sel': path})
+
+        replaced = set()
+        skip = None
+        for path, entry1 in flat1.items():
+            entry2 = flat2.get(path)
+            if entry2 is None or (skip and path.startswith(skip + '/')):
+                continue
+            check_budget()
+            if entry1.get('ns') != entry2.get('ns'):
+                ops.emit({'op': 'replace', 'sel': path, 'element': _element_markup(elements2[path])})
+                replaced.add(path)
+                skip = path
+                continue
+
+            attrib1, attrib2 = entry1['attrib'], entry2['attrib']
+            if attrib1 != attrib2:
+                raw2 = _raw_attributes(elements2[path], namespaces)
+                for key in attrib1:
+                    if key not in attrib2:
+                        ops.emit({'op': 'remove', 'sel': _attribute_selector(path, key)})
+                    elif attrib1[key] != attrib2[key]:
+                        ops.emit({'op': 'replace', 'sel': _attribute_selector(path, key), 'value': raw2[key][1]})
+                for key in attrib2:
+                    if key not in attrib1:
+                        name, value = raw2[key]
+                        ops.emit({'op': 'add', 'sel': path, 'type': '@' + attribute_key(name), 'value': value})
+
+            if entry1['text'] != entry2['text']:
+                text = elements2[path].text or ''
+                if not entry1['text']:
+                    ops.emit({'op': 'add', 'sel': path, 'pos': 'prepend', 'value': text})
+                elif not entry2['text']:
+                    ops.emit({'op': 'remove', 'sel': f'{path}/text()[1]'})
+                else:
+                    ops.emit({'op': 'replace', 'sel': f'{path}/text()[1]', 'value': text})
+
+        # Elements only in the second document. Paths number elements per tag, so
+        # tag[k] goes right after tag[k-1]; a tag's first element after its preceding sibling.
+        siblings = None
+        skip = None
+        for path in flat2:
+            if skip and path.startswith(skip + '/'):
+                continue
+            if path in replaced:
+                skip = path
+                continue
+            if path in flat1:
+                continue
+            check_budget()
+            skip = path
+            if siblings is None:
+                siblings = _sibling_paths(elements2)
+            markup = _element_markup(elements2[path])
+            position = _POSITION.search(path)
+            if position and int(position.group(1)) > 1:
+                previous = f'{path[:position.start()]}[{int(position.group(1)) - 1}]'
+                ops.emit({'op': 'add', 'sel': previous, 'pos': 'after', 'element': markup})
+                continue
+            parent, previous = siblings[path]
+            if previous is not None:
+                ops.emit({'op': 'add', 'sel': previous, 'pos': 'after', 'element': markup})
+            else:
+                ops.emit({'op': 'add', 'sel': parent, 'pos': 'prepend', 'element': markup})
+    except _PatchLimit:
+        return list(ops), True
+    return list(ops), False
+
+
+def _sibling_paths(elements):
+    """{path: (parent path, preceding sibling path or None)} for flattened elements"""
+    paths = {id(elem): path for path, elem in elements.items()}
+    siblings = {}
+    for path, elem in elements.items():
+        previous = None
+        for child in elem:
+            child_path = paths.get(id(child))
+            if child_path is not None:
+                siblings[child_path] = (path, previous)
+                previous = child_path
+    return siblings
+
+
+def render_xml_patch(ops):
+    """Yield the RFC 5261 <diff> document of xml_patch operations, an operation at a time"""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<diff>\n'
+    for op in ops:
+        attrs = f' sel={quoteattr(op["sel"])}'
+        for name in ('pos', 'type'):
+            if name in op:
+                attrs += f' {name}={quoteattr(op[name])}'
+        if 'element' in op:
+            content = op['element']
+        elif 'value' in op:
+            content = escape(op['value'])
+        else:
+            yield f'  <{op["op"]}{attrs}/>\n'
+            continue
+        yield f'  <{op["op"]}{attrs}>{content}</{op["op"]}>\n'
+    yield '</diff>\n'
+
+
+def grouped_opcodes(opcodes, context=DEFAULT_CONTEXT_LINES):
+    """SequenceMatcher.get_grouped_opcodes() over already computed opcodes"""
+    codes = list(opcodes)
+    if not codes:
+        codes = [('equal', 0, 1, 0, 1)]
+    # Trim the context of a leading and trailing equal run
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # Split the group at an equal run longer than twice the context
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _hunk_range(start, length):
+    # As in unified diffs: an empty range names the line before it
+    if length == 1:
+        return f'{start + 1}'
+    if not length:
+        start -= 1
+    return f'{start + 1},{length}'
+
+
+def unified_diff(lines1, lines2, opcodes, context=DEFAULT_CONTEXT_LINES, fromfile='a', tofile='b',
+                 max_changes=None):
+    """
+    Unified diff hunks for SequenceMatcher opcodes over two line lists.
+    Returns (pieces, truncated): the file header and one text per hunk,
+    stopping after the hunk that brings the changed line count to max_changes.
+    """
+    hunks = []
+    changes = 0
+    for group in grouped_opcodes(opcodes, context):
+        if max_changes is not None and changes >= max_changes:
+            return hunks, True
+        check_budget()
+        if not hunks:
+            hunks.append(f'--- {fromfile}\n+++ {tofile}\n')
+        first, last = group[0], group[-1]
+        lines = [f'@@ -{_hunk_range(first[1], last[2] - first[1])} '
+                 f'+{_hunk_range(first[3], last[4] - first[3])} @@\n']
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend(' ' + line + '\n' for line in lines1[i1:i2])
+                continue
+            lines.extend('-' + line + '\n' for line in lines1[i1:i2])
+            lines.extend('+' + line + '\n' for line in lines2[j1:j2])
+            changes += (i2 - i1) + (j2 - j1)
+        hunks.append(''.join(lines))
+    return hunks, False
+
+
+@timed('compare')
+def text_patch(text1, text2, context=DEFAULT_CONTEXT_LINES, max_changes=None):
+    """unified_diff() of two texts, line-matched as compare_text_lines matches them"""
+    lines1 = text1.splitlines()
+    lines2 = text2.splitlines()
+    opcodes = difflib.SequenceMatcher(None, lines1, lines2).get_opcodes()
+    return unified_diff(lines1, lines2, opcodes, context, 'text1', 'text2', max_changes)
@@ -0,0 +1,197 @@
+"""
+On-demand profiling of individual /compare* requests.
+
+With PROFILING=1 set, a request sent with `X-Profile: cprofile` (or
+`?profile=cprofile`) runs under cProfile, and one sent with `X-Profile:
+sample` is sampled from a background thread every few milliseconds. The
+response carries an `X-Profile-Id` header; the artifact is fetched from
+`GET /profile/<id>`:
+
+    cprofile  ?format=pstats (default, loadable with pstats.Stats) or text
+    sample    collapsed stacks, one "frame;frame;frame count" line per stack,
+              the input of flamegraph.pl and speedscope
+
+Artifacts are kept in memory for 15 minutes and, when PROFILE_DIR is set,
+also written there so they survive the worker. PROFILING_TOKEN, if set,
+must be sent as `X-Profile-Token`. Work sent to the process pool is not
+included in the profile.
+"""
+import cProfile
+import collections
+import io
+import marshal
+import os
+import pstats
+import re
+import sys
+import threading
+
+from flask import Response, g, request
+
+from value_store import ValueStore
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+# Seconds between stack samples in "sample" mode (PROFILE_SAMPLE_INTERVAL overrides)
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+profiles = ValueStore(max_entries=16, ttl=900)
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _frame_label(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack into collapsed-stack counts"""
+
+    def __init__(self, thread_id, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def enable(self):
+        self.thread.start()
+
+    def disable(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {samples}\n' for stack, samples in self.stacks.most_common())
+
+
+def _artifact(mode, profiler):
+    if mode == 'cprofile':
+        stats = pstats.Stats(profiler)
+        # The same bytes pstats.Stats.dump_stats writes
+        return {'mode': mode, 'format': 'pstats', 'data': marshal.dumps(stats.stats)}
+    return {'mode': mode, 'format': 'collapsed', 'data': profiler.collapsed().encode()}
+
+
+def _save(profile_id, artifact, directory):
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{profile_id}.{artifact['format']}"), 'wb') as f:
+        f.write(artifact['data'])
+
+
+def _load(profile_id, directory):
+    artifact = profiles.get(profile_id)
+    if artifact is not None or not directory or not _PROFILE_ID.match(profile_id):
+        return artifact
+    for mode, fmt in (('cprofile', 'pstats'), ('sample', 'collapsed')):
+        path = os.path.join(directory, f'{profile_id}.{fmt}')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return {'mode': mode, 'format': fmt, 'data': f.read()}
+    return None
+
+
+def pstats_text(data, limit=60):
+    """Top functions by cumulative time, as printed by pstats"""
+    stats = pstats.Stats(_MarshalledStats(data), stream=io.StringIO())
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stats.stream.getvalue()
+
+
+class _MarshalledStats:
+    """Adapter so pstats.Stats can load marshalled stats without a file"""
+
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+
+def _requested_mode(app):
+    if not app.config['PROFILING'] or not request.path.startswith('/compare'):
+        return None
+    mode = (request.headers.get('X-Profile') or request.args.get('profile') or '').lower()
+    if mode not in PROFILE_MODES:
+        return None
+    token = app.config.get('PROFILING_TOKEN')
+    if token and request.headers.get('X-Profile-Token') != token:
+        return None
+    return mode
+
+
+def init_profiling(app):
+    """Profile /compare* requests that ask for it (see the module docstring)"""
+    app.config.setdefault('PROFILING', os.environ.get('PROFILING', '').lower() not in ('', '0', 'false', 'no'))
+    app.config.setdefault('PROFILING_TOKEN', os.environ.get('PROFILING_TOKEN'))
+    app.config.setdefault('PROFILE_DIR', os.environ.get('PROFILE_DIR'))
+    app.config.setdefault('PROFILE_SAMPLE_INTERVAL',
+                          float(os.environ.get('PROFILE_SAMPLE_INTERVAL') or DEFAULT_SAMPLE_INTERVAL))
+
+    @app.before_request
+    def start_profile():
+        mode = _requested_mode(app)
+        if mode is None:
+            return
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+        else:
+            profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILE_SAMPLE_INTERVAL'])
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return
+        g.profile = (mode, profiler)
+
+    def stop_profile():
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile[1].disable()
+        return profile
+
+    @app.after_request
+    def finish_profile(response):
+        profile = stop_profile()
+        if profile is None:
+            return response
+        artifact = _artifact(*profile)
+        profile_id = profiles.put(artifact)
+        _save(profile_id, artifact, app.config['PROFILE_DIR'])
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc):
+        stop_profile()
+
+    def profile_view(profile_id):
+        if not app.config['PROFILING']:
+            return {'error': 'profiling is disabled; set PROFILING=1'}, 404
+        artifact = _load(profile_id, app.config['PROFILE_DIR'])
+        if artifact is None:
+            return {'error': 'Profile not found'}, 404
+        fmt = request.args.get('format', artifact['format'])
+        if fmt == artifact['format']:
+            mimetype = 'application/octet-stream' if fmt == 'pstats' else 'text/plain'
+            response = Response(artifact['data'], mimetype=mimetype)
+            response.headers['Content-Disposition'] = f'attachment; filename={profile_id}.{fmt}'
+            return response
+        if fmt == 'text' and artifact['format'] == 'pstats':
+            return Response(pstats_text(artifact['data']), mimetype='text/plain')
+        return {'error': f"format must be {artifact['format']}" +
+                         (' or text' if artifact['format'] == 'pstats' else '')}, 400
+    app.add_url_rule('/profile/<profile_id>', 'profile', profile_view)
+    return app
@@ -0,0 +1,263 @@
+"""
+Concurrent serving mode: threaded workers with CPU offload and backpressure.
+
+Under gunicorn's default sync workers a worker serves one request at a
+time, so a slow upload or one big comparison holds it. With
+SERVING_MODE=threaded, gunicorn.conf.py switches to the gthread worker
+(SERVING_THREADS threads per worker), and init_serving() puts an offload
+middleware in front of the app:
+
+    OFFLOAD_PROCESSES   processes comparisons run in (default: CPU count)
+    OFFLOAD_QUEUE       offloaded requests that may wait for a process
+                        (default: twice OFFLOAD_PROCESSES)
+    OFFLOAD_MIN_BYTES   request bodies smaller than this run in the
+                        worker thread (default 256 KB)
+
+A POST to a comparison route whose body is at least OFFLOAD_MIN_BYTES is
+read by its thread and then run, whole, in the process pool: parsing,
+comparing, highlighting and serializing happen there and the finished
+response is sent back. The thread waits without holding the GIL, so small
+comparisons keep being answered inline while big ones run. Once every
+process is busy and the queue is full, further big requests are answered
+503 with Retry-After; bodies up to DRAIN_LIMIT are read, unparsed, and
+larger ones are left unread and the response asks for the connection to
+be closed (gunicorn drops that header and reads the rest of the body
+itself before it reuses a keep-alive connection).
+
+An offloaded request's body is buffered whole in the worker and again in
+the process serving it, so a worker holds at most OFFLOAD_PROCESSES +
+OFFLOAD_QUEUE bodies of up to MAX_CONTENT_LENGTH each; larger bodies are
+never offloaded.
+
+The pool processes are started by a fork server (spawned where there is
+none) rather than forked from the threaded worker, whose other threads
+may hold locks at that moment. Each builds the app from the environment
+when it starts, so settings made in code rather than in the environment
+do not reach it.
+
+Offloaded requests are measured and profiled in the pool process, so they
+do not appear in the serving worker's /metrics, and /compare_value for
+them rebuilds values from the request (as for another worker's result).
+Sessions, batches, tree and streaming comparisons always run in the
+thread. On shutdown (gunicorn's worker_exit hook) running comparisons
+finish and queued ones are answered 503.
+"""
+import io
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from comparators import comparator_specs
+from worker_pool import max_workers
+
+SERVING_MODES = ('sync', 'threaded')
+
+DEFAULT_OFFLOAD_MIN_BYTES = 256 * 1024
+
+# Seconds a rejected client is asked to wait
+RETRY_AFTER = 1
+
+DRAIN_CHUNK_SIZE = 64 * 1024
+
+# Largest body of a rejected request read before answering 503
+DRAIN_LIMIT = 1024 * 1024
+
+# Routes whose requests are self-contained, so any process can serve them,
+# besides every registered comparator's route
+OFFLOAD_PATHS = frozenset({'/merge3'})
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# The wrapped WSGI app, in the serving worker and in each pool process
+_wsgi_app = None
+
+
+def _init_process():
+    global _wsgi_app
+    # Ctrl-C reaches the whole process group; let the serving worker decide
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # An offloaded request already has a process to itself
+    os.environ['DIFF_WORKERS'] = '1'
+    # Build the app now rather than on this process's first request
+    from app import app
+    _wsgi_app = app.wsgi_app
+    if isinstance(_wsgi_app, OffloadMiddleware):
+        _wsgi_app = _wsgi_app.wsgi_app
+
+
+def _process_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def get_executor(processes):
+    """Lazily create the offload pool (after gunicorn forks its workers)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=processes, mp_context=_process_context(),
+                                            initializer=_init_process)
+        return _executor
+
+
+def shutdown():
+    """Finish running comparisons and cancel queued ones"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _reset(executor):
+    """Drop a broken pool so the next request starts a new one"""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _portable_environ(environ):
+    """The picklable part of a WSGI environ: CGI variables and simple wsgi.* values"""
+    return {key: value for key, value in environ.items()
+            if isinstance(value, (str, int, float, bool, tuple)) and key not in ('wsgi.input', 'wsgi.errors')}
+
+
+def run_request(environ, body):
+    """Serve one WSGI request in this process; returns (status, headers, body bytes)"""
+    app = _wsgi_app
+    environ['wsgi.input'] = io.BytesIO(body)
+    environ['wsgi.errors'] = sys.stderr
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return chunks.append
+
+    iterable = app(environ, start_response)
+    try:
+        chunks.extend(iterable)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    return response[0], response[1], b''.join(chunks)
+
+
+def _drain(stream, length):
+    """Read and discard a body of up to DRAIN_LIMIT bytes; returns False for a larger one, left unread"""
+    if length > DRAIN_LIMIT:
+        return False
+    while length > 0:
+        chunk = stream.read(min(length, DRAIN_CHUNK_SIZE))
+        if not chunk:
+            break
+        length -= len(chunk)
+    return True
+
+
+def _json_response(start_response, status, message, headers=()):
+    body = ('{"error": "%s"}' % message).encode()
+    start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body))),
+                            *headers])
+    return [body]
+
+
+class OffloadMiddleware:
+    """
+    WSGI middleware running large comparison requests in a process pool,
+    with at most processes + queue of them admitted at once.
+    """
+
+    def __init__(self, wsgi_app, processes, queue, min_bytes, max_bytes=lambda: None):
+        self.wsgi_app = wsgi_app
+        self.processes = processes
+        self.capacity = processes + queue
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.admitted = 0
+        self.lock = threading.Lock()
+        self.paths = None
+
+    def offloaded(self, environ):
+        if self.paths is None:
+            # Plugin comparators are registered by the time requests arrive
+            self.paths = OFFLOAD_PATHS | {spec.path for spec in comparator_specs()}
+        if environ.get('REQUEST_METHOD') != 'POST' or environ.get('PATH_INFO') not in self.paths:
+            return False
+        # Profiles are kept by the process that served the request
+        if environ.get('HTTP_X_PROFILE') or 'profile=' in environ.get('QUERY_STRING', ''):
+            return False
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return False
+        limit = self.max_bytes()
+        # Oversized bodies are rejected by the app without being read
+        return length >= self.min_bytes and (limit is None or length <= limit)
+
+    def __call__(self, environ, start_response):
+        if not self.offloaded(environ):
+            return self.wsgi_app(environ, start_response)
+
+        with self.lock:
+            admitted = self.admitted < self.capacity
+            if admitted:
+                self.admitted += 1
+        if not admitted:
+            # Read a small body, unparsed, so the client sees the answer rather than a reset
+            # connection; a big one would hold this thread for as long as it takes to upload
+            headers = [('Retry-After', str(RETRY_AFTER))]
+            if not _drain(environ['wsgi.input'], int(environ['CONTENT_LENGTH'])):
+                headers.append(('Connection', 'close'))
+            return _json_response(start_response, '503 Service Unavailable', 'Server is busy; retry later',
+                                  headers)
+        try:
+            length = int(environ['CONTENT_LENGTH'])
+            body = environ['wsgi.input'].read(length)
+            executor = get_executor(self.processes)
+            try:
+                future = executor.submit(run_request, _portable_environ(environ), body)
+                status, headers, data = future.result()
+            except BrokenProcessPool:
+                # A process died (e.g. killed for memory); serve this request here
+                _reset(executor)
+                environ['wsgi.input'] = io.BytesIO(body)
+                return self.wsgi_app(environ, start_response)
+            except (CancelledError, RuntimeError):
+                # Submitted after, or still queued at, shutdown
+                return _json_response(start_response, '503 Service Unavailable', 'Server is shutting down',
+                                      [('Retry-After', str(RETRY_AFTER))])
+        finally:
+            with self.lock:
+                self.admitted -= 1
+        start_response(status, headers)
+        return [data]
+
+
+def init_serving(app):
+    """
+    Install the offload middleware when SERVING_MODE is "threaded".
+    Call it after the other init_* functions so it wraps the whole app.
+    """
+    global _wsgi_app
+    mode = app.config.setdefault('SERVING_MODE', os.environ.get('SERVING_MODE') or 'sync')
+    if mode not in SERVING_MODES:
+        raise ValueError(f"SERVING_MODE must be one of: {', '.join(SERVING_MODES)}")
+    if mode != 'threaded':
+        return app
+    processes = app.config.setdefault('OFFLOAD_PROCESSES',
+                                      int(os.environ.get('OFFLOAD_PROCESSES') or max_workers()))
+    queue = app.config.setdefault('OFFLOAD_QUEUE', int(os.environ.get('OFFLOAD_QUEUE') or processes * 2))
+    min_bytes = app.config.setdefault('OFFLOAD_MIN_BYTES',
+                                      int(os.environ.get('OFFLOAD_MIN_BYTES') or DEFAULT_OFFLOAD_MIN_BYTES))
+    _wsgi_app = app.wsgi_app
+    app.wsgi_app = OffloadMiddleware(app.wsgi_app, processes, queue, min_bytes,
+                                     lambda: app.config.get('MAX_CONTENT_LENGTH'))
+    return app
@@ -0,0 +1,315 @@
+"""
+Compare two huge JSON arrays or NDJSON files record by record.
+
+    python stream_compare.py events-old.json events-new.ndjson [--array-key id]
+
+Records are read incrementally and diffed as soon as their partner is
+known, so only a record at a time is held in memory. By position
+(array_mode "index") both inputs are walked in lockstep; by key (array_mode
+"key") a record waits until the record with the same array_key arrives on
+the other side, so memory grows with how far apart matching records are.
+Differences are emitted as they are found, one JSON object per line.
+"""
+import argparse
+import codecs
+import collections
+import itertools
+import json
+import sys
+
+import json_codec
+from json_compare import compare_json_objects, content_hash, render_value, VALUE_PREVIEW_LIMIT
+
+STREAM_INPUT_FORMATS = ('auto', 'array', 'ndjson')
+STREAM_ARRAY_MODES = ('index', 'key')
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Largest single record; beyond it the input is treated as invalid
+DEFAULT_MAX_RECORD_BYTES = 64 * 1024 * 1024
+
+_WHITESPACE = ' \t\n\r'
+
+# Fill value past the end of the shorter input
+_END = object()
+
+
+class StreamInputError(ValueError):
+    """An input is not a JSON array or NDJSON, or a record does not parse"""
+
+
+def stream_compare_options(data):
+    """Read and validate streaming options from a request payload or CLI arguments"""
+    input_format = data.get('input_format') or 'auto'
+    if input_format not in STREAM_INPUT_FORMATS:
+        raise ValueError(f"input_format must be one of: {', '.join(STREAM_INPUT_FORMATS)}")
+    array_mode = data.get('array_mode') or 'index'
+    if array_mode not in STREAM_ARRAY_MODES:
+        raise ValueError(f"array_mode must be one of: {', '.join(STREAM_ARRAY_MODES)} when streaming")
+    array_key = data.get('array_key')
+    if array_mode == 'key' and not array_key:
+        raise ValueError("array_mode 'key' requires an array_key")
+    value_limit = data.get('value_limit', VALUE_PREVIEW_LIMIT)
+    if value_limit is not None and (not isinstance(value_limit, int) or isinstance(value_limit, bool)
+                                    or value_limit < 0):
+        raise ValueError("value_limit must be a non-negative integer or null")
+    return {'input_format': input_format, 'array_mode': array_mode, 'array_key': array_key,
+            'value_limit': value_limit}
+
+
+class RecordReader:
+    """
+    Iterates the records of a binary file: the items of a top-level JSON
+    array, or the values of an NDJSON file (one per non-blank line).
+    """
+
+    def __init__(self, fileobj, input_format='auto', max_record_bytes=DEFAULT_MAX_RECORD_BYTES):
+        self.fileobj = fileobj
+        self.input_format = input_format
+        self.max_record_bytes = max_record_bytes
+        self.decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.count = 0
+
+    def _read(self, size=READ_CHUNK_SIZE):
+        """Append at least one more chunk to the buffer; False at end of input"""
+        if self.eof:
+            return False
+        if self.pos > READ_CHUNK_SIZE:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.fileobj.read(size)
+        try:
+            text = self.decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as e:
+            raise StreamInputError(f'record {self.count + 1}: input is not UTF-8 ({e.reason})')
+        self.buffer += text
+        if not chunk:
+            self.eof = True
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._read():
+                return
+
+    def _peek(self):
+        self._skip_whitespace()
+        return self.buffer[self.pos] if self.pos < len(self.buffer) else ''
+
+    def __iter__(self):
+        first = self._peek()
+        if not first:
+            return
+        input_format = self.input_format
+        if input_format == 'auto':
+            input_format = 'array' if first == '[' else 'ndjson'
+        if input_format == 'ndjson':
+            yield from self._ndjson_records()
+        else:
+            yield from self._array_records()
+
+    def _ndjson_records(self):
+        # NDJSON records are whole lines, so the fast codec parses each one
+        while True:
+            end = self.buffer.find('\n', self.pos)
+            while end < 0:
+                # Only the newly read text can hold the newline; _read() may
+                # move the record to the start of the buffer, so count from pos
+                scanned = len(self.buffer) - self.pos
+                if not self._read():
+                    break
+                end = self.buffer.find('\n', self.pos + scanned)
+                self._check_record_size(len(self.buffer) - self.pos)
+            line = self.buffer[self.pos:] if end < 0 else self.buffer[self.pos:end]
+            self.pos = len(self.buffer) if end < 0 else end + 1
+            if line.strip():
+                self.count += 1
+                try:
+                    yield json_codec.loads(line)
+                except json_codec.JSONDecodeError as e:
+                    raise StreamInputError(f'record {self.count}: {e}')
+            if end < 0:
+                return
+
+    def _array_records(self):
+        if self._peek() != '[':
+            raise StreamInputError('expected a JSON array')
+        self.pos += 1
+        if self._peek() == ']':
+            self.pos += 1
+        else:
+            while True:
+                yield self._value()
+                separator = self._peek()
+                self.pos += 1
+                if separator == ']':
+                    break
+                if separator != ',':
+                    raise StreamInputError(f"record {self.count}: expected ',' or ']' after the record")
+        if self._peek():
+            raise StreamInputError('unexpected data after the JSON array')
+
+    def _value(self):
+        """Decode the next array item, reading more input until it is complete"""
+        self._skip_whitespace()
+        size = READ_CHUNK_SIZE
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    self.count += 1
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise StreamInputError(f'record {self.count + 1}: {e}')
+            self._check_record_size(len(self.buffer) - self.pos)
+            # Grow the read size so a large record is not re-parsed once per chunk
+            self._read(size)
+            size *= 2
+
+    def _check_record_size(self, size):
+        if self.max_record_bytes and size > self.max_record_bytes:
+            raise StreamInputError(f'record {self.count + 1} is larger than {self.max_record_bytes} '
+                                   'characters or is not valid JSON')
+
+
+def _one_sided(diff_type, path, record, value_limit):
+    text, truncated = render_value(record, value_limit)
+    diff = {'Difference Type': diff_type, 'Key Path': path, 'Property': text}
+    if truncated:
+        diff['Truncated'] = True
+    return diff
+
+
+def _by_index(records1, records2, options):
+    value_limit = options['value_limit']
+    for i, (record1, record2) in enumerate(itertools.zip_longest(records1, records2, fillvalue=_END)):
+        if record1 is _END:
+            yield _one_sided('Extra', f'[{i}]', record2, value_limit)
+        elif record2 is _END:
+            yield _one_sided('Missing', f'[{i}]', record1, value_limit)
+        else:
+            yield from compare_json_objects(record1, record2, f'[{i}]', value_limit=value_limit)
+
+
+def _by_key(records1, records2, options, state):
+    """
+    Pair records by array_key. Each side's unmatched records wait, per key,
+    until the other side produces the same key; records without the key
+    are paired by their order among keyless records.
+    """
+    array_key, value_limit = options['array_key'], options['value_limit']
+    pending = ({}, {})
+    keyless = (collections.deque(), collections.deque())
+
+    def identity(record):
+        if isinstance(record, dict) and array_key in record:
+            return content_hash(record[array_key])
+        return None
+
+    def arrive(side, index, record):
+        other = 1 - side
+        ident = identity(record)
+        waiting = keyless[other] if ident is None else pending[other].get(ident)
+        if waiting:
+            other_index, other_record = waiting.popleft()
+            if ident is not None and not waiting:
+                del pending[other][ident]
+            state['pending'] -= 1
+            if side == 0:
+                (i, record1), (j, record2) = (index, record), (other_index, other_record)
+            else:
+                (i, record1), (j, record2) = (other_index, other_record), (index, record)
+            return compare_json_objects(record1, record2, f'[{i}]', value_limit=value_limit, right_path=f'[{j}]')
+        queue = keyless[side] if ident is None else pending[side].setdefault(ident, collections.deque())
+        queue.append((index, record))
+        state['pending'] += 1
+        state['pending_peak'] = max(state['pending_peak'], state['pending'])
+        return ()
+
+    for index, (record1, record2) in enumerate(itertools.zip_longest(records1, records2, fillvalue=_END)):
+        if record1 is not _END:
+            yield from arrive(0, index, record1)
+        if record2 is not _END:
+            yield from arrive(1, index, record2)
+
+    leftovers = [(index, 0, record) for queues in pending[0].values() for index, record in queues]
+    leftovers += [(index, 0, record) for index, record in keyless[0]]
+    leftovers += [(index, 1, record) for queues in pending[1].values() for index, record in queues]
+    leftovers += [(index, 1, record) for index, record in keyless[1]]
+    for index, side, record in sorted(leftovers, key=lambda item: (item[1], item[0])):
+        yield _one_sided('Missing' if side == 0 else 'Extra', f'[{index}]', record, value_limit)
+
+
+_STATISTIC_KEYS = {'Missing': 'missing_items', 'Extra': 'extra_items', 'Value mismatch': 'value_mismatches'}
+
+
+def compare_streams(file1, file2, options, statistics, max_differences=None,
+                    max_record_bytes=DEFAULT_MAX_RECORD_BYTES):
+    """
+    Yield the differences between two binary files of records, stopping
+    after max_differences. statistics is filled in as records are read
+    (json_statistics keys plus record counts); it is complete once the
+    generator is exhausted. Raises StreamInputError on invalid input.
+    """
+    reader1 = RecordReader(file1, options['input_format'], max_record_bytes)
+    reader2 = RecordReader(file2, options['input_format'], max_record_bytes)
+    statistics.update({'total_differences': 0, 'missing_items': 0, 'extra_items': 0, 'value_mismatches': 0,
+                       'records1': 0, 'records2': 0, 'truncated': False})
+    state = {'pending': 0, 'pending_peak': 0}
+    if options['array_mode'] == 'key':
+        diffs = _by_key(reader1, reader2, options, state)
+    else:
+        diffs = _by_index(reader1, reader2, options)
+
+    try:
+        for diff in diffs:
+            if max_differences is not None and statistics['total_differences'] >= max_differences:
+                statistics['truncated'] = True
+                return
+            statistics['total_differences'] += 1
+            key = _STATISTIC_KEYS.get(diff['Difference Type'])
+            if key:
+                statistics[key] += 1
+            yield diff
+    finally:
+        statistics['records1'] = reader1.count
+        statistics['records2'] = reader2.count
+        if options['array_mode'] == 'key':
+            statistics['pending_peak'] = state['pending_peak']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file1', help='JSON array or NDJSON file')
+    parser.add_argument('file2', help='JSON array or NDJSON file')
+    parser.add_argument('--input-format', choices=STREAM_INPUT_FORMATS, default='auto')
+    parser.add_argument('--array-key', help='pair records by this key instead of by position')
+    parser.add_argument('--value-limit', type=int, default=VALUE_PREVIEW_LIMIT)
+    parser.add_argument('--max-differences', type=int)
+    args = parser.parse_args()
+
+    options = stream_compare_options({'input_format': args.input_format,
+                                      'array_mode': 'key' if args.array_key else 'index',
+                                      'array_key': args.array_key, 'value_limit': args.value_limit})
+    statistics = {}
+    try:
+        with open(args.file1, 'rb') as file1, open(args.file2, 'rb') as file2:
+            for diff in compare_streams(file1, file2, options, statistics, args.max_differences):
+                sys.stdout.write(json_codec.dumps(diff) + '\n')
+    except (OSError, StreamInputError) as e:
+        parser.error(str(e))
+    sys.stdout.write(json_codec.dumps({'statistics': statistics}) + '\n')
+    return 1 if statistics['total_differences'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,13 @@
+from app import app
+from diff_encoding import decode_differences
+
+
+def test_compact_encoding_of_non_string_yaml_keys():
+    response = app.test_client().post('/compare_yaml', json={
+        'yaml1': '1: a\n2020-01-01: d\nnested:\n  3: z\n',
+        'yaml2': '1: b\n2020-01-01: e\nnested:\n  3: w\n',
+        'diff_encoding': 'compact',
+    })
+    assert response.status_code == 200
+    diffs = decode_differences(response.get_json()['differences'])
+    assert sorted(diff['Key Path'] for diff in diffs) == ['1', '2020-01-01', 'nested.3']
@@ -0,0 +1,42 @@
+import xml.etree.ElementTree as ET
+
+from merge3 import merge_xml, merge_yaml
+from yaml_compare import parse_yaml_stream
+
+BASE_XML = '<root><section><item>1</item></section><keep /></root>'
+EDITED_XML = '<root><section><item>2</item></section><keep /></root>'
+DELETED_XML = '<root><keep /></root>'
+
+
+def merge_xml_strings(base, ours, theirs):
+    return merge_xml(ET.fromstring(base), ET.fromstring(ours), ET.fromstring(theirs))
+
+
+def test_deleting_a_subtree_the_other_side_edited_conflicts():
+    merged, conflicts, _, _ = merge_xml_strings(BASE_XML, EDITED_XML, DELETED_XML)
+    assert '<item>2</item>' in merged
+    assert [(c['Tag Path'], c['Ours'], c['Theirs']) for c in conflicts] == [
+        ('/root[1]/section[1]', 'modified', 'deleted')]
+
+    merged, conflicts, _, _ = merge_xml_strings(BASE_XML, DELETED_XML, EDITED_XML)
+    assert merged == '<root><keep /></root>'
+    assert [(c['Tag Path'], c['Ours'], c['Theirs']) for c in conflicts] == [
+        ('/root[1]/section[1]', 'deleted', 'modified')]
+
+
+def test_deleting_an_untouched_subtree_is_clean():
+    assert merge_xml_strings(BASE_XML, BASE_XML, DELETED_XML)[:2] == ('<root><keep /></root>', [])
+    assert merge_xml_strings(BASE_XML, DELETED_XML, BASE_XML)[:2] == ('<root><keep /></root>', [])
+
+
+def test_yaml_documents_are_paired_as_compare_yaml_pairs_them():
+    keyed = 'kind: ConfigMap\nmetadata:\n  name: {}\n'
+    base = keyed.format('settings') + '---\nvalue: 1\n'
+    # Ours inserts a document before both; theirs edits the one without an identity
+    ours = keyed.format('extra') + '---\n' + base
+    theirs = keyed.format('settings') + '---\nvalue: 2\n'
+
+    merged, conflicts, _, _ = merge_yaml(*(parse_yaml_stream(text)[0] for text in (base, ours, theirs)))
+    assert conflicts == []
+    assert merged[-1] == {'value': 2}
+    assert len(merged) == 3
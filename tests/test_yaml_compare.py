@@ -0,0 +1,39 @@
+from yaml_compare import compare_yaml_documents, document_index_map, pair_documents, parse_yaml_stream
+
+
+def documents(text):
+    return parse_yaml_stream(text)[0]
+
+
+def test_positional_labels_do_not_collide_with_right_leftovers():
+    # The keyed document shifts the left positions; the right inserts a third plain document
+    left = documents('kind: ConfigMap\nmetadata:\n  name: settings\n---\na: 1\n---\nb: 1\n')
+    right = documents('a: 1\n---\nb: 2\n---\nc: 1\n')
+
+    pairs = pair_documents(left, right)
+    labels = [label for label, _, _ in pairs]
+    assert len(set(labels)) == len(labels)
+    assert ('document 2', 1, 0) in pairs
+    assert ('document 3', 2, 1) in pairs
+    assert ('document 3 (right)', None, 2) in pairs
+
+    index_map = document_index_map(left, right)
+    assert len(index_map) == len(pairs)
+    assert index_map['document 3 (right)'] == (None, 2)
+
+    diffs = compare_yaml_documents(left, right)
+    by_document = {diff['Document']: diff for diff in diffs}
+    assert by_document['document 3']['Key Path'] == 'b'
+    assert by_document['document 3 (right)']['Difference Type'] == 'Extra'
+
+
+def test_repeated_identities_get_a_suffix():
+    manifest = 'kind: Service\nmetadata:\n  name: web\nport: {}\n'
+    left = documents('---\n'.join(manifest.format(port) for port in (80, 81)))
+    right = documents('---\n'.join(manifest.format(port) for port in (80, 82, 83)))
+
+    assert pair_documents(left, right) == [
+        ('Service/web', 0, 0),
+        ('Service/web (2)', 1, 1),
+        ('Service/web (3)', None, 2),
+    ]
@@ -0,0 +1,198 @@
+import difflib
+import html
+import itertools
+
+from comparators import Comparator
+from limits import check_budget
+from metrics import stage
+
+
+def compare_text_lines(text1, text2, max_differences=None):
+    """Compare two text strings line by line and return differences"""
+    lines1 = text1.splitlines()
+    lines2 = text2.splitlines()
+    
+    # Use difflib.SequenceMatcher for precise line-by-line comparison
+    matcher = difflib.SequenceMatcher(None, lines1, lines2)
+    return text_differences(lines1, lines2, matcher.get_opcodes(), max_differences)
+
+
+def index_text(text):
+    """
+    Split a text into lines and number its distinct lines, for texts
+    compared more than once. Returns (lines, numbers, {line: number}).
+    """
+    lines = text.splitlines()
+    numbering = {}
+    numbers = [numbering.setdefault(line, len(numbering)) for line in lines]
+    return lines, numbers, numbering
+
+
+def compare_indexed_text(index1, index2, max_differences=None):
+    """
+    compare_text_lines() for two index_text() results. Lines are matched by
+    their number in the first text, so each distinct line of the second is
+    looked up once and the matcher compares integers.
+    """
+    lines1, numbers1, numbering1 = index1
+    lines2, numbers2, numbering2 = index2
+    # Lines the first text does not have get negative numbers
+    renumber = [numbering1.get(line, -1 - number) for line, number in numbering2.items()]
+    matcher = difflib.SequenceMatcher(None, numbers1, [renumber[number] for number in numbers2])
+    return text_differences(lines1, lines2, matcher.get_opcodes(), max_differences)
+
+
+def text_differences(lines1, lines2, opcodes, max_differences=None):
+    """
+    Turn SequenceMatcher opcodes over two line lists into difference entries,
+    stopping once max_differences are found
+    """
+    return list(itertools.islice(_text_difference_entries(lines1, lines2, opcodes), max_differences))
+
+
+def _text_difference_entries(lines1, lines2, opcodes):
+    for tag, i1, i2, j1, j2 in opcodes:
+        check_budget()
+        if tag == 'equal':
+            # Lines are identical, skip
+            continue
+        elif tag == 'delete':
+            # Lines removed from file 1 (not present in file 2)
+            for i in range(i1, i2):
+                yield {
+                    'Difference Type': 'Removed Line',
+                    'Line Number': f'Line {i + 1}',
+                    'Content': lines1[i].strip()
+                }
+        elif tag == 'insert':
+            # Lines added to file 2 (not present in file 1)
+            for j in range(j1, j2):
+                yield {
+                    'Difference Type': 'Added Line',
+                    'Line Number': f'Line {j + 1}',
+                    'Content': lines2[j].strip()
+                }
+        elif tag == 'replace':
+            # Lines are different - analyze more carefully
+            num_lines1 = i2 - i1
+            num_lines2 = j2 - j1
+            
+            if num_lines1 == 1 and num_lines2 == 1:
+                # Single line modification
+                yield {
+                    'Difference Type': 'Modified Line',
+                    'Line Number': f'Line {i1 + 1}',
+                    'Content': f'"{lines1[i1].strip()}" → "{lines2[j1].strip()}"'
+                }
+            else:
+                # Multiple lines changed - treat as separate deletions and additions
+                for i in range(i1, i2):
+                    yield {
+                        'Difference Type': 'Removed Line',
+                        'Line Number': f'Line {i + 1}',
+                        'Content': lines1[i].strip()
+                    }
+                for j in range(j1, j2):
+                    yield {
+                        'Difference Type': 'Added Line',
+                        'Line Number': f'Line {j + 1}',
+                        'Content': lines2[j].strip()
+                    }
+
+
+def text_statistics(diffs):
+    """Summary counts for a list of compare_text_lines differences"""
+    return {
+        'total_differences': len(diffs),
+        'missing_items': len([d for d in diffs if d['Difference Type'] == 'Removed Line']),
+        'extra_items': len([d for d in diffs if d['Difference Type'] == 'Added Line']),
+        'value_mismatches': len([d for d in diffs if d['Difference Type'] == 'Modified Line'])
+    }
+
+
+def highlight_text_strings(text1, text2, diffs):
+    """Add highlighting to text strings based on differences - clean format without line numbers"""
+    lines1 = text1.splitlines()
+    lines2 = text2.splitlines()
+    
+    # Use difflib for proper alignment
+    matcher = difflib.SequenceMatcher(None, lines1, lines2)
+    
+    highlighted1 = []
+    highlighted2 = []
+    
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            # Lines are identical
+            for i in range(i1, i2):
+                highlighted1.append(html.escape(lines1[i]))
+                highlighted2.append(html.escape(lines2[j1 + (i - i1)]))
+                
+        elif tag == 'delete':
+            # Lines only in first file (removed)
+            for i in range(i1, i2):
+                highlighted1.append(f'<span class="diff-removed">{html.escape(lines1[i])}</span>')
+            # Add empty lines to second file for alignment
+            for _ in range(i1, i2):
+                highlighted2.append('')
+                
+        elif tag == 'insert':
+            # Lines only in second file (added)
+            for j in range(j1, j2):
+                highlighted2.append(f'<span class="diff-added">{html.escape(lines2[j])}</span>')
+            # Add empty lines to first file for alignment
+            for _ in range(j1, j2):
+                highlighted1.append('')
+                
+        elif tag == 'replace':
+            # Lines are different
+            # Handle case where number of lines differ
+            max_lines = max(i2 - i1, j2 - j1)
+            
+            for k in range(max_lines):
+                if k < (i2 - i1):
+                    if k < (j2 - j1):
+                        # Both files have lines - show as modified
+                        highlighted1.append(f'<span class="diff-modified">{html.escape(lines1[i1 + k])}</span>')
+                        highlighted2.append(f'<span class="diff-modified">{html.escape(lines2[j1 + k])}</span>')
+                    else:
+                        # Extra line in file 1 - show as removed
+                        highlighted1.append(f'<span class="diff-removed">{html.escape(lines1[i1 + k])}</span>')
+                        highlighted2.append('')
+                else:
+                    # Extra line in file 2 - show as added
+                    highlighted1.append('')
+                    highlighted2.append(f'<span class="diff-added">{html.escape(lines2[j1 + k])}</span>')
+    
+    return '\n'.join(highlighted1), '\n'.join(highlighted2)
+
+
+class TextComparator(Comparator):
+    """The /compare_text comparator: line by line, on the texts themselves"""
+
+    format = 'text'
+    label = 'text'
+    sample = ('first\nsecond\nthird\n', 'first\n2nd\nthird\nfourth\n')
+
+    def parse_documents(self, comparison):
+        # Nothing to parse
+        comparison.doc1 = comparison.text1
+        comparison.doc2 = comparison.text2
+
+    def compare(self, comparison, max_differences=None):
+        with stage('compare'):
+            return compare_text_lines(comparison.doc1, comparison.doc2, max_differences)
+
+    def highlight(self, text1, text2, diffs, comparison=None):
+        with stage('highlight'):
+            return highlight_text_strings(text1, text2, diffs)
+
+    def statistics(self, diffs):
+        return text_statistics(diffs)
+
+    def patch(self, comparison):
+        from patch_output import text_patch
+        hunks, truncated = text_patch(comparison.doc1, comparison.doc2, comparison.output['context'],
+                                      comparison.limit)
+        # The first piece is the file header
+        return hunks, 'text/x-diff', max(0, len(hunks) - 1), truncated
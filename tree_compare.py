@@ -0,0 +1,323 @@
+"""
+Compare two directory trees or two zip/tar archives file by file.
+
+    python tree_compare.py old_release/ new_release/ [--details]
+    python tree_compare.py bundle-1.0.tar.gz bundle-1.1.zip
+
+Files are paired by relative path. Pairs of different size are changed;
+pairs of equal size are hashed a block at a time and reported identical
+when the hashes match, without being parsed. Only changed files are loaded,
+a batch at a time, and compared by the comparator for their extension in
+the process pool.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tarfile
+import zipfile
+
+import json_codec
+from batch_compare import index_document, compare_indexed
+from binary_compare import compare_binary_data
+from csv_compare import parse_csv_string, compare_csv_data, csv_statistics
+from json_compare import ARRAY_MODES, json_compare_options
+from limits import cap_differences, collect_limit
+from worker_pool import parallel_map
+from xml_compare import xml_compare_options
+
+# Comparator by file extension; anything else is compared as text
+TREE_FORMATS = {
+    '.xml': 'xml',
+    '.json': 'json',
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.csv': 'csv',
+}
+
+# Below this combined size of changed files, comparison runs in-process
+PARALLEL_MIN_BYTES = 256 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Changed files are loaded and handed to the pool in batches of about this size
+LOAD_BATCH_BYTES = 32 * 1024 * 1024
+
+FILE_STATUSES = ('identical', 'equivalent', 'modified', 'added', 'removed', 'error')
+
+
+class TreeInputError(ValueError):
+    """A tree is neither a directory nor a readable zip/tar archive"""
+
+
+def normalize_path(name):
+    return name.replace('\\', '/').lstrip('/').removeprefix('./')
+
+
+class DirectoryTree:
+    def __init__(self, root):
+        self.root = root
+        self.sizes = {}
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                if os.path.isfile(full):
+                    rel = normalize_path(os.path.relpath(full, root))
+                    self.sizes[rel] = os.path.getsize(full)
+
+    def open(self, path):
+        return open(os.path.join(self.root, path), 'rb')
+
+
+class ZipTree:
+    def __init__(self, fileobj):
+        self.archive = zipfile.ZipFile(fileobj)
+        self.names = {}
+        self.sizes = {}
+        for info in self.archive.infolist():
+            if info.is_dir():
+                continue
+            rel = normalize_path(info.filename)
+            self.names[rel] = info
+            self.sizes[rel] = info.file_size
+
+    def open(self, path):
+        return self.archive.open(self.names[path])
+
+
+class TarTree:
+    def __init__(self, fileobj):
+        self.archive = tarfile.open(fileobj=fileobj, mode='r:*')
+        self.names = {}
+        self.sizes = {}
+        for member in self.archive.getmembers():
+            if not member.isfile():
+                continue
+            rel = normalize_path(member.name)
+            self.names[rel] = member
+            self.sizes[rel] = member.size
+
+    def open(self, path):
+        return self.archive.extractfile(self.names[path])
+
+
+def open_tree(source):
+    """Open a directory path, or an archive given as a path or seekable file object"""
+    if isinstance(source, str) and os.path.isdir(source):
+        return DirectoryTree(source)
+    try:
+        fileobj = open(source, 'rb') if isinstance(source, str) else source
+    except OSError as e:
+        raise TreeInputError(str(e))
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        try:
+            return ZipTree(fileobj)
+        except zipfile.BadZipFile as e:
+            raise TreeInputError(f'Invalid zip archive: {e}')
+    fileobj.seek(0)
+    try:
+        return TarTree(fileobj)
+    except tarfile.TarError:
+        raise TreeInputError('not a directory, zip or tar archive')
+
+
+def single_root(paths):
+    """The top-level directory every path sits under, if there is exactly one"""
+    roots = {path.split('/', 1)[0] for path in paths}
+    if len(roots) == 1 and all('/' in path for path in paths):
+        return roots.pop() + '/'
+    return None
+
+
+def strip_roots(tree1, tree2):
+    """
+    Archives usually wrap everything in a versioned directory (app-1.0/,
+    app-1.1/). When both sides have a single root, pair files below it.
+    Returns {relative path: original path} for each side.
+    """
+    root1, root2 = single_root(tree1.sizes), single_root(tree2.sizes)
+    if not (root1 and root2) or isinstance(tree1, DirectoryTree) or isinstance(tree2, DirectoryTree):
+        root1 = root2 = ''
+    return ({path[len(root1):]: path for path in tree1.sizes},
+            {path[len(root2):]: path for path in tree2.sizes})
+
+
+def hash_file(tree, path):
+    digest = hashlib.sha256()
+    with tree.open(path) as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def read_file(tree, path):
+    with tree.open(path) as f:
+        return f.read()
+
+
+def file_format(path):
+    return TREE_FORMATS.get(os.path.splitext(path)[1].lower(), 'text')
+
+
+def compare_file_pair(task):
+    """Compare the two versions of one changed file; runs in a pool worker"""
+    path, fmt, data1, data2, options, include_differences, max_differences = task
+    result = {'path': path, 'format': fmt}
+    try:
+        content1 = data1.decode('utf-8-sig')
+        content2 = data2.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Byte range statistics cover the whole file; only the ranges listed are capped
+        diffs, stats = compare_binary_data(data1, data2)
+        diffs, truncated = cap_differences(diffs, max_differences)
+        result.update({'format': 'binary', 'status': 'modified' if diffs else 'equivalent', 'statistics': stats})
+    else:
+        try:
+            if fmt == 'csv':
+                diffs = compare_csv_data(parse_csv_string(content1), parse_csv_string(content2),
+                                         collect_limit(max_differences))
+                diffs, truncated = cap_differences(diffs, max_differences)
+                stats = csv_statistics(diffs)
+            else:
+                format_options = options.get(fmt, {})
+                index1 = index_document(fmt, content1, format_options)
+                index2 = index_document(fmt, content2, format_options)
+                diffs, stats, truncated = compare_indexed(fmt, index1, index2, format_options, max_differences)
+        except Exception as e:
+            result.update({'status': 'error', 'error': str(e)})
+            return result
+
+        # Byte-level changes that the comparator ignores (formatting, key order)
+        result['status'] = 'modified' if stats['total_differences'] else 'equivalent'
+        result['statistics'] = stats
+
+    if include_differences:
+        result['differences'] = diffs
+    if truncated:
+        result['truncated'] = True
+    return result
+
+
+def summarize_tree(files):
+    """
+    Nest the per-file results into a directory tree with status counts
+    at every level. Directories with no changes are collapsed.
+    """
+    root = {'name': '', 'type': 'directory', 'summary': dict.fromkeys(FILE_STATUSES, 0), 'children': {}}
+    for result in files:
+        node = root
+        node['summary'][result['status']] += 1
+        *dirs, name = result['path'].split('/')
+        for part in dirs:
+            node = node['children'].setdefault(part, {
+                'name': part, 'type': 'directory',
+                'summary': dict.fromkeys(FILE_STATUSES, 0), 'children': {}})
+            node['summary'][result['status']] += 1
+        leaf = {'name': name, 'type': 'file', 'status': result['status']}
+        if 'statistics' in result:
+            leaf['total_differences'] = result['statistics']['total_differences']
+        node['children'][name] = leaf
+
+    def finish(node):
+        if node['type'] == 'file':
+            return node
+        unchanged = node['summary']['identical'] + node['summary']['equivalent']
+        if node['name'] and unchanged == sum(node['summary'].values()):
+            node['children'] = []
+        else:
+            node['children'] = [finish(child) for _, child in sorted(node['children'].items())]
+        return node
+
+    return finish(root)
+
+
+def compare_trees(source1, source2, options=None, include_differences=False, max_differences=None,
+                  max_size=None):
+    """
+    Compare two trees (directory paths or archives, as paths or file objects).
+    options maps a format to its comparator options, e.g. {'json': {...}};
+    each file keeps at most max_differences differences.
+    Returns (files, tree, statistics): per-file results sorted by path, the
+    summarized directory tree and overall counts.
+    Raises TreeInputError if either side cannot be opened, or if the files
+    present on both sides add up to more than max_size bytes once expanded.
+    """
+    options = options or {}
+    tree1, tree2 = open_tree(source1), open_tree(source2)
+    paths1, paths2 = strip_roots(tree1, tree2)
+
+    files = []
+    common = []
+    for path in sorted(paths1.keys() | paths2.keys()):
+        if path not in paths2:
+            files.append({'path': path, 'status': 'removed', 'size': tree1.sizes[paths1[path]]})
+        elif path not in paths1:
+            files.append({'path': path, 'status': 'added', 'size': tree2.sizes[paths2[path]]})
+        else:
+            common.append(path)
+
+    # Archive readers stop at the member sizes they list, so the listed sizes
+    # bound what reading the common files can expand to
+    if max_size is not None:
+        expanded = sum(tree1.sizes[paths1[path]] + tree2.sizes[paths2[path]] for path in common)
+        if expanded > max_size:
+            raise TreeInputError(f'files present in both trees expand to {expanded} bytes, '
+                                 f'more than the limit of {max_size}')
+
+    changed = []
+    for path in common:
+        size = tree1.sizes[paths1[path]]
+        if size == tree2.sizes[paths2[path]] and hash_file(tree1, paths1[path]) == hash_file(tree2, paths2[path]):
+            files.append({'path': path, 'status': 'identical', 'size': size})
+        else:
+            changed.append(path)
+
+    # Only one batch of changed files is held in memory at a time
+    batch, batch_size = [], 0
+    for i, path in enumerate(changed):
+        data1, data2 = read_file(tree1, paths1[path]), read_file(tree2, paths2[path])
+        batch.append((path, file_format(path), data1, data2, options, include_differences, max_differences))
+        batch_size += len(data1) + len(data2)
+        if batch_size >= LOAD_BATCH_BYTES or i == len(changed) - 1:
+            files.extend(parallel_map(compare_file_pair, batch, parallel=batch_size >= PARALLEL_MIN_BYTES))
+            batch, batch_size = [], 0
+    files.sort(key=lambda result: result['path'])
+
+    statistics = dict.fromkeys(FILE_STATUSES, 0)
+    for result in files:
+        statistics[result['status']] += 1
+    statistics['files'] = len(files)
+    statistics['total_differences'] = sum(r['statistics']['total_differences'] for r in files if 'statistics' in r)
+    return files, summarize_tree(files), statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('tree1', help='directory, zip or tar archive')
+    parser.add_argument('tree2', help='directory, zip or tar archive')
+    parser.add_argument('--details', action='store_true', help='include every difference')
+    parser.add_argument('--array-mode', default='index', help=f"JSON/YAML list alignment: {', '.join(ARRAY_MODES)}")
+    parser.add_argument('--array-key')
+    parser.add_argument('--normalize', action='append', default=[],
+                        help='XML normalization rule or preset (repeatable)')
+    args = parser.parse_args()
+
+    try:
+        json_options = json_compare_options({'array_mode': args.array_mode, 'array_key': args.array_key})
+        xml_options = xml_compare_options({'normalize': args.normalize})
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        files, tree, statistics = compare_trees(
+            args.tree1, args.tree2,
+            {'json': json_options, 'yaml': json_options, 'xml': xml_options},
+            include_differences=args.details)
+    except TreeInputError as e:
+        parser.error(str(e))
+    print(json_codec.dumps_pretty({'files': files, 'tree': tree, 'statistics': statistics}))
+    return 1 if statistics['modified'] + statistics['added'] + statistics['removed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
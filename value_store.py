@@ -0,0 +1,43 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class ValueStore:
+    """
+    Small in-process LRU of parsed comparison inputs, so the full value
+    behind a truncated difference can be fetched later by path.
+    Entries are per worker process and expire after ttl seconds.
+    """
+
+    def __init__(self, max_entries=32, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, entry):
+        result_id = uuid.uuid4().hex
+        with self.lock:
+            self.entries[result_id] = (time.monotonic(), entry)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result_id
+
+    def get(self, result_id):
+        if not result_id:
+            return None
+        with self.lock:
+            item = self.entries.get(result_id)
+            if item is None:
+                return None
+            stored_at, entry = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[result_id]
+                return None
+            self.entries.move_to_end(result_id)
+            return entry
+
+
+value_store = ValueStore()
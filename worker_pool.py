@@ -0,0 +1,43 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_executor = None
+
+
+def max_workers():
+    """Worker count for CPU-bound comparison work (DIFF_WORKERS overrides)"""
+    return int(os.environ.get('DIFF_WORKERS') or os.cpu_count() or 1)
+
+
+def get_executor():
+    """Lazily create the shared process pool (after any pre-fork)"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max_workers())
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def parallel_map(func, items, parallel=True):
+    """
+    Map a module-level function over items in the process pool.
+    Falls back to running in-process for single items, single-worker
+    setups, or when the pool has died.
+    """
+    items = list(items)
+    if not parallel or len(items) < 2 or max_workers() < 2:
+        return [func(item) for item in items]
+
+    chunksize = max(1, len(items) // (max_workers() * 4))
+    try:
+        return list(get_executor().map(func, items, chunksize=chunksize))
+    except BrokenProcessPool:
+        shutdown()
+        return [func(item) for item in items]
@@ -1,9 +1,19 @@
 import xml.etree.ElementTree as ET
 import re
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from comparators import Comparator, ComparisonInputError
+from highlight_util import highlight_xml_strings
+from limits import check_budget
+from metrics import stage, timed
 
 def strip_ns(tag):
     return tag.split('}', 1)[-1] if '}' in tag else tag
 
+def tag_namespace(tag):
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
 # Optionally extend these for alias mapping
 TAG_MAPPING = {}
 ATTR_MAPPING = {}
@@ -18,6 +28,78 @@ def canonical_tag(local):
 def canonical_attr(local):
     return ATTR_MAPPING.get(local, local)
 
+def attribute_key(name, namespaces=False):
+    """Key of an attribute in flattened entries; {uri}name with the "namespaces" rule"""
+    key = canonical_attr(strip_ns(name))
+    if namespaces and tag_namespace(name):
+        key = f"{{{tag_namespace(name)}}}{key}"
+    return key
+
+# Normalizations applied while flattening, so equivalent values never produce differences
+NORMALIZE_RULES = ('whitespace', 'numbers', 'dates', 'namespaces')
+NORMALIZE_PRESETS = {
+    # The Canonical XML rules that still matter once elements are flattened
+    # (attribute order, quoting and prefix spelling are already ignored)
+    'c14n': frozenset({'whitespace', 'namespaces'}),
+    'all': frozenset(NORMALIZE_RULES),
+}
+
+_NUMBER = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?')
+
+# Structure checks and parser messages, compiled once rather than per document
+_OPENING_TAG = re.compile(r'<[^/!?][^>]*[^/]>')
+_SELF_CLOSING_TAG = re.compile(r'<[^/!?][^>]*/>')
+_CLOSING_TAG = re.compile(r'</[^>]+>')
+_XML_DECLARATION = re.compile(r'<\?xml[^>]*\?>')
+_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+_PROCESSING_INSTRUCTION = re.compile(r'<\?[^>]*\?>')
+_ERROR_LINE = re.compile(r'line (\d+)')
+_TAG_MISMATCH = re.compile(r"Opening and ending tag mismatch: (\w+).*?and (\w+)")
+
+def xml_compare_options(data):
+    """
+    Read and validate the "normalize" option from a request payload: a list
+    of rules, or the "c14n"/"all" presets. Raises ValueError on bad input.
+    """
+    normalize = data.get('normalize') or []
+    if isinstance(normalize, str):
+        normalize = [normalize]
+    if not isinstance(normalize, list):
+        raise ValueError('normalize must be a list of rules or a preset name')
+    rules = set()
+    for rule in normalize:
+        if rule in NORMALIZE_PRESETS:
+            rules |= NORMALIZE_PRESETS[rule]
+        elif rule in NORMALIZE_RULES:
+            rules.add(rule)
+        else:
+            names = ', '.join(NORMALIZE_RULES + tuple(NORMALIZE_PRESETS))
+            raise ValueError(f"unknown normalize rule '{rule}' (expected one of: {names})")
+    return {'normalize': frozenset(rules)}
+
+def normalize_value(value, rules):
+    """Canonical form of a text or attribute value under the given rules"""
+    if 'whitespace' in rules:
+        value = ' '.join(value.split())
+    if 'numbers' in rules and _NUMBER.fullmatch(value):
+        try:
+            number = Decimal(value)
+            return '0' if number == 0 else str(number.normalize())
+        except InvalidOperation:
+            return value
+    if 'dates' in rules and _DATE.fullmatch(value):
+        try:
+            if len(value) == 10:
+                return date.fromisoformat(value).isoformat()
+            moment = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+            if moment.tzinfo is not None:
+                moment = moment.astimezone(timezone.utc)
+            return moment.isoformat()
+        except ValueError:
+            return value
+    return value
+
 def validate_xml_structure(xml_string):
     """
     Pre-validation to catch common XML structure issues
@@ -35,9 +117,9 @@ def validate_xml_structure(xml_string):
         return False, "XML must end with a closing tag"
     
     # Count opening and closing tags to detect obvious imbalances
-    opening_tags = len(re.findall(r'<[^/!?][^>]*[^/]>', xml_string))
-    self_closing_tags = len(re.findall(r'<[^/!?][^>]*/>', xml_string))
-    closing_tags = len(re.findall(r'</[^>]+>', xml_string))
+    opening_tags = len(_OPENING_TAG.findall(xml_string))
+    self_closing_tags = len(_SELF_CLOSING_TAG.findall(xml_string))
+    closing_tags = len(_CLOSING_TAG.findall(xml_string))
     
     # Basic tag balance check (not perfect but catches obvious issues)
     if opening_tags != closing_tags:
@@ -48,9 +130,9 @@ def validate_xml_structure(xml_string):
     
     # Check for multiple potential root elements (basic check)
     # Remove XML declaration, comments, and processing instructions
-    content = re.sub(r'<\?xml[^>]*\?>', '', xml_string)
-    content = re.sub(r'<!--.*?-->', '', content, flags=re.DOTALL)
-    content = re.sub(r'<\?[^>]*\?>', '', content)
+    content = _XML_DECLARATION.sub('', xml_string)
+    content = _COMMENT.sub('', content)
+    content = _PROCESSING_INSTRUCTION.sub('', content)
     content = content.strip()
     
     # Find top-level elements (not nested)
@@ -103,12 +185,14 @@ def parse_xml_from_string(xml_string):
             return None, "XML content is empty"
         
         # Pre-validation to catch common issues
-        is_valid_structure, structure_error = validate_xml_structure(xml_string)
+        with stage('validate'):
+            is_valid_structure, structure_error = validate_xml_structure(xml_string)
         if not is_valid_structure:
             return None, structure_error
         
         # Parse the XML
-        root = ET.fromstring(xml_string)
+        with stage('parse'):
+            root = ET.fromstring(xml_string)
         
         # Additional validation - check if we actually got an element
         if root is None:
@@ -123,7 +207,7 @@ def parse_xml_from_string(xml_string):
         
         # Extract line number if available
         line_number = None
-        line_match = re.search(r'line (\d+)', original_error)
+        line_match = _ERROR_LINE.search(original_error)
         if line_match:
             line_number = int(line_match.group(1))
         
@@ -142,7 +226,7 @@ def parse_xml_from_string(xml_string):
             # Try to extract tag names from the error
             if "Opening and ending tag mismatch:" in original_error:
                 # Extract tag names for clearer error
-                match = re.search(r"Opening and ending tag mismatch: (\w+).*?and (\w+)", original_error)
+                match = _TAG_MISMATCH.search(original_error)
                 if match:
                     return None, f"Tag mismatch: opening tag '{match.group(1)}' does not match closing tag '{match.group(2)}'{line_ref}"
             return None, f"Mismatched XML tags - check that opening and closing tags match{line_ref}"
@@ -165,12 +249,22 @@ def parse_xml_from_string(xml_string):
     except Exception as e:
         return None, f"Unexpected error parsing XML: {e}"
 
-def flatten_elements(root: ET.Element) -> dict:
+@timed('flatten')
+def flatten_elements(root: ET.Element, element_map: dict = None, normalize=frozenset()) -> dict:
+    """
+    Flatten an element tree into {path: {"attrib", "text"}}.
+    If element_map is given it is filled with {path: element}.
+    normalize is a set of NORMALIZE_RULES applied to values as they are read;
+    with "namespaces", entries also carry the element's namespace URI ("ns")
+    and namespaced attributes are keyed as {uri}name.
+    """
     elements = {}
+    namespaces = 'namespaces' in normalize
 
     def recurse(elem: ET.Element, path="", sib_counter=None):
         if sib_counter is None:
             sib_counter = {}
+        check_budget()
 
         local = strip_ns(elem.tag)
         canon = canonical_tag(local)
@@ -178,7 +272,9 @@ def flatten_elements(root: ET.Element) -> dict:
         if canon in IGNORE_TAGS:
             return
 
-        attribs = {canonical_attr(strip_ns(k)): v for k, v in elem.attrib.items()}
+        attribs = {}
+        for k, v in elem.attrib.items():
+            attribs[attribute_key(k, namespaces)] = normalize_value(v, normalize) if normalize else v
         name_attr = attribs.get("name")
 
         if canon in {"ProtocolData", "UserDataField"} and name_attr:
@@ -188,10 +284,15 @@ def flatten_elements(root: ET.Element) -> dict:
             sib_counter[canon] = idx
             new_path = f"{path}/{canon}[{idx}]" if path else f"/{canon}[{idx}]"
 
+        text = (elem.text or "").strip()
         elements[new_path] = {
             "attrib": attribs,
-            "text": (elem.text or "").strip()
+            "text": normalize_value(text, normalize) if normalize else text
         }
+        if namespaces:
+            elements[new_path]["ns"] = tag_namespace(elem.tag)
+        if element_map is not None:
+            element_map[new_path] = elem
 
         child_counts = {}
         for child in elem:
@@ -200,10 +301,15 @@ def flatten_elements(root: ET.Element) -> dict:
     recurse(root)
     return elements
 
-def compare_xml(wcs_dict: dict, micro_dict: dict):
+@timed('compare')
+def compare_xml(wcs_dict: dict, micro_dict: dict, max_differences=None):
+    """Differences between two flattened documents, stopping once max_differences are found"""
     diffs = []
 
     for path, wcs_elem in wcs_dict.items():
+        if max_differences is not None and len(diffs) >= max_differences:
+            return diffs[:max_differences]
+        check_budget()
         if path not in micro_dict:
             diffs.append({
                 "Difference Type": "Tag missing",
@@ -214,6 +320,13 @@ def compare_xml(wcs_dict: dict, micro_dict: dict):
 
         micro_elem = micro_dict[path]
 
+        if wcs_elem.get("ns") != micro_elem.get("ns"):
+            diffs.append({
+                "Difference Type": "Namespace mismatch",
+                "Tag Path": path,
+                "Attribute": "(namespace)"
+            })
+
         for attr, wcs_val in wcs_elem["attrib"].items():
             mic_val = micro_elem["attrib"].get(attr)
             if mic_val is None:
@@ -237,6 +350,8 @@ def compare_xml(wcs_dict: dict, micro_dict: dict):
             })
 
     for path in micro_dict:
+        if max_differences is not None and len(diffs) >= max_differences:
+            return diffs[:max_differences]
         if path not in wcs_dict:
             diffs.append({
                 "Difference Type": "Extra tag",
@@ -245,3 +360,68 @@ def compare_xml(wcs_dict: dict, micro_dict: dict):
             })
 
     return diffs
+
+
+def xml_statistics(diffs):
+    """Summary counts for a list of compare_xml differences"""
+    return {
+        'total_differences': len(diffs),
+        'missing_tags': len([d for d in diffs if d['Difference Type'] == 'Tag missing']),
+        'extra_tags': len([d for d in diffs if d['Difference Type'] == 'Extra tag']),
+        'attribute_mismatches': len([d for d in diffs if 'Attribute' in d['Difference Type']]),
+        'text_mismatches': len([d for d in diffs if d['Difference Type'] == 'Text mismatch']),
+        'namespace_mismatches': len([d for d in diffs if d['Difference Type'] == 'Namespace mismatch'])
+    }
+
+
+class XmlComparator(Comparator):
+    """The /compare comparator: flattened element paths, normalized per the request"""
+
+    format = 'xml'
+    label = 'XML'
+    sample = ('<root><item id="1">a</item><item id="2">b</item></root>',
+              '<root><item id="1">a</item><item id="3">c</item><extra/></root>')
+
+    def options(self, data):
+        return xml_compare_options(data)
+
+    def parse(self, text):
+        root, error = parse_xml_from_string(text)
+        if error:
+            raise ComparisonInputError(error)
+        return root
+
+    def parse_documents(self, comparison):
+        # parse_xml_from_string() times its own validate and parse stages,
+        # and a stored baseline is already flattened
+        comparison.doc1 = None if comparison.baseline else self.parse(comparison.text1)
+        comparison.doc2 = self.parse(comparison.text2)
+
+    def flat1(self, comparison):
+        """Flattened first document: from the stored baseline when there is one"""
+        normalize = comparison.options['normalize']
+        if comparison.baseline is None:
+            return flatten_elements(comparison.doc1, normalize=normalize)
+        from baseline_store import baseline_store
+        return baseline_store.xml_flat(comparison.baseline, normalize)
+
+    def compare(self, comparison, max_differences=None):
+        # Normalization happens while flattening, so equivalent values never diff
+        flat1 = self.flat1(comparison)
+        flat2 = flatten_elements(comparison.doc2, normalize=comparison.options['normalize'])
+        return compare_xml(flat1, flat2, max_differences)
+
+    def highlight(self, text1, text2, diffs, comparison=None):
+        return highlight_xml_strings(text1, text2, diffs)
+
+    def statistics(self, diffs):
+        return xml_statistics(diffs)
+
+    def patch(self, comparison):
+        from patch_output import xml_patch, render_xml_patch
+        normalize = comparison.options['normalize']
+        elements2 = {}
+        flat1 = self.flat1(comparison)
+        flat2 = flatten_elements(comparison.doc2, elements2, normalize=normalize)
+        ops, truncated = xml_patch(flat1, flat2, elements2, 'namespaces' in normalize, comparison.limit)
+        return render_xml_patch(ops), 'application/xml', len(ops), truncated
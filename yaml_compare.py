@@ -0,0 +1,325 @@
+import yaml
+
+from comparators import Comparator, ComparisonInputError
+from json_compare import (compare_json_objects, json_compare_options, json_statistics, render_value,
+                          VALUE_PREVIEW_LIMIT)
+from metrics import stage
+from worker_pool import parallel_map
+
+# libyaml-backed loader/dumper when PyYAML was built with it (10-20x faster)
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Below this combined input size, document pairs are diffed in-process
+PARALLEL_MIN_BYTES = 256 * 1024
+
+
+def parse_yaml_stream(yaml_str):
+    """
+    Compose and construct every document of a YAML stream in one pass.
+    Returns (documents, nodes); the composed nodes carry the line marks
+    used for highlighting. Empty documents are skipped.
+    """
+    documents = []
+    nodes = []
+    loader = SafeLoader(yaml_str)
+    try:
+        while loader.check_node():
+            node = loader.get_node()
+            doc = loader.construct_document(node)
+            if doc is not None:
+                documents.append(doc)
+                nodes.append(node)
+    finally:
+        loader.dispose()
+
+    if not documents:
+        return [None], [None]
+    return documents, nodes
+
+
+def dump_yaml_documents(documents):
+    """Serialize documents back to a YAML stream, keeping key order"""
+    return yaml.dump_all(documents, Dumper=SafeDumper, sort_keys=False, allow_unicode=True)
+
+
+def document_identity(doc):
+    """Kubernetes-style identity of a document: (kind, namespace, name)"""
+    if not isinstance(doc, dict):
+        return None
+    kind = doc.get('kind')
+    metadata = doc.get('metadata')
+    if not kind or not isinstance(metadata, dict) or not metadata.get('name'):
+        return None
+    return (str(kind), str(metadata.get('namespace') or ''), str(metadata['name']))
+
+
+def document_label(identity, index):
+    if identity is None:
+        return f'document {index + 1}'
+    kind, namespace, name = identity
+    return f'{kind}/{namespace}/{name}' if namespace else f'{kind}/{name}'
+
+
+def pair_documents(docs1, docs2):
+    """
+    Pair documents from two streams by (kind, metadata.namespace, metadata.name);
+    documents without that identity are paired with each other by position.
+    Returns a list of (label, index1, index2) with None for an unpaired side.
+    Labels are unique: a repeated identity gets a " (2)", " (3)"... suffix,
+    and a document only in the second stream is labelled by its own
+    position there, with " (right)".
+    """
+    # Documents sharing an identity pair up in stream order
+    keyed2 = {}
+    unkeyed2 = []
+    for index, doc in enumerate(docs2):
+        identity = document_identity(doc)
+        if identity is None:
+            unkeyed2.append(index)
+        else:
+            keyed2.setdefault(identity, []).append(index)
+
+    occurrences = {}
+
+    def label(identity, index, right=False):
+        if identity is None:
+            return document_label(None, index) + (' (right)' if right else '')
+        occurrences[identity] = occurrences.get(identity, 0) + 1
+        text = document_label(identity, index)
+        return text if occurrences[identity] == 1 else f'{text} ({occurrences[identity]})'
+
+    pairs = []
+    unkeyed_position = 0
+    for index, doc in enumerate(docs1):
+        identity = document_identity(doc)
+        other_index = None
+        if identity is not None:
+            if keyed2.get(identity):
+                other_index = keyed2[identity].pop(0)
+        elif unkeyed_position < len(unkeyed2):
+            other_index = unkeyed2[unkeyed_position]
+            unkeyed_position += 1
+        pairs.append((label(identity, index), index, other_index))
+
+    leftovers = unkeyed2[unkeyed_position:] + [index for indexes in keyed2.values() for index in indexes]
+    for index in sorted(leftovers):
+        pairs.append((label(document_identity(docs2[index]), index, right=True), None, index))
+
+    return pairs
+
+
+def document_index_map(docs1, docs2):
+    """Document label -> (index1, index2); single documents use the label None"""
+    if len(docs1) == 1 and len(docs2) == 1:
+        return {None: (0, 0)}
+    return {label: (index1, index2) for label, index1, index2 in pair_documents(docs1, docs2)}
+
+
+def compare_document_pair(pair):
+    """Diff one (label, doc1, doc2, options) pair; runs in a pool worker"""
+    label, doc1, doc2, options = pair
+    if doc1 is None or doc2 is None:
+        # Whole document only on one side
+        text, truncated = render_value(doc1 if doc2 is None else doc2,
+                                       options.get('value_limit', VALUE_PREVIEW_LIMIT))
+        diff = {'Difference Type': 'Missing' if doc2 is None else 'Extra', 'Key Path': '', 'Property': text}
+        if truncated:
+            diff['Truncated'] = True
+        diffs = [diff]
+    else:
+        diffs = compare_json_objects(doc1, doc2, **options)
+
+    for diff in diffs:
+        diff['Document'] = label
+    return diffs
+
+
+def compare_yaml_documents(docs1, docs2, input_size=0, **options):
+    """
+    Compare two multi-document YAML streams. A single document on both
+    sides is compared directly, exactly as before; otherwise documents are
+    paired and each pair is diffed, in parallel for large inputs.
+    Extra keyword options are passed on to compare_json_objects.
+    """
+    if len(docs1) == 1 and len(docs2) == 1:
+        return compare_json_objects(docs1[0], docs2[0], **options)
+
+    pairs = [
+        (label,
+         docs1[index1] if index1 is not None else None,
+         docs2[index2] if index2 is not None else None,
+         options)
+        for label, index1, index2 in pair_documents(docs1, docs2)
+    ]
+    results = parallel_map(compare_document_pair, pairs,
+                           parallel=input_size >= PARALLEL_MIN_BYTES)
+    diffs = [diff for diffs in results for diff in diffs]
+    # Each pair stops at max_differences; the stream as a whole does too
+    if options.get('max_differences') is not None:
+        del diffs[options['max_differences']:]
+    return diffs
+
+
+_key_constructor = yaml.constructor.SafeConstructor()
+
+
+def _key_text(key_node):
+    """Render a mapping key the way compare_json_objects does in Key Path"""
+    if isinstance(key_node, yaml.ScalarNode) and key_node.tag == 'tag:yaml.org,2002:str':
+        return key_node.value
+    return str(_key_constructor.construct_object(key_node, deep=True))
+
+
+def _node_end_line(node, lines):
+    """Last line a node occupies, ignoring trailing blank and comment lines"""
+    end = min(node.end_mark.line, len(lines) - 1)
+    # Block collections end where the next token starts, e.g. the next '- '
+    if end > node.start_mark.line and not lines[end][:node.end_mark.column].strip():
+        end -= 1
+    while end > node.start_mark.line and (not lines[end].strip() or lines[end].lstrip().startswith('#')):
+        end -= 1
+    return end
+
+
+def build_line_index(root, lines):
+    """
+    Map every Key Path in a composed document to its (first, last) line.
+    Mapping entries span from their key to the end of their value.
+    """
+    index = {}
+    if root is None:
+        return index
+
+    stack = [(root, '', root.start_mark.line)]
+    while stack:
+        node, path, start = stack.pop()
+        index[path] = (start, _node_end_line(node, lines))
+
+        if isinstance(node, yaml.MappingNode):
+            for key_node, value_node in node.value:
+                key = _key_text(key_node)
+                key_path = f"{path}.{key}" if path else key
+                stack.append((value_node, key_path, key_node.start_mark.line))
+        elif isinstance(node, yaml.SequenceNode):
+            for i, item in enumerate(node.value):
+                stack.append((item, f"{path}[{i}]", item.start_mark.line))
+
+    return index
+
+
+def highlight_yaml_strings(yaml1_str, yaml2_str, diffs, stream1=None, stream2=None, line_indexes1=None):
+    """
+    Add highlighting to YAML strings based on differences.
+    Each Key Path is resolved through a path -> line-range index built from
+    the parser's node marks, so only the lines of that exact path are marked.
+    stream1/stream2 are parse_yaml_stream() results, reused when given, and
+    line_indexes1 is {document index: build_line_index()} for stream1.
+    """
+    docs1, nodes1 = stream1 or parse_yaml_stream(yaml1_str)
+    docs2, nodes2 = stream2 or parse_yaml_stream(yaml2_str)
+
+    lines1 = yaml1_str.splitlines()
+    lines2 = yaml2_str.splitlines()
+
+    document_indices = document_index_map(docs1, docs2)
+
+    line_indexes1 = dict(line_indexes1 or {})
+    line_indexes2 = {}
+    classes1 = {}
+    classes2 = {}
+
+    def mark(nodes, lines, line_indexes, classes, doc_index, path, css_class):
+        if doc_index is None:
+            return
+        if doc_index not in line_indexes:
+            line_indexes[doc_index] = build_line_index(nodes[doc_index], lines)
+        line_range = line_indexes[doc_index].get(path)
+        if line_range is None:
+            return
+        for line_no in range(line_range[0], line_range[1] + 1):
+            # Added/removed wins over modified on the same line
+            if classes.get(line_no) in (None, 'diff-modified'):
+                classes[line_no] = css_class
+
+    for diff in diffs:
+        if 'Key Path' not in diff:
+            continue
+        index1, index2 = document_indices.get(diff.get('Document'), (None, None))
+        # Top-level keys are not stringified by compare_json_objects
+        path = str(diff['Key Path'])
+        right_path = str(diff.get('Right Key Path', path))
+        diff_type = diff['Difference Type']
+
+        if diff_type == 'Missing':
+            mark(nodes1, lines1, line_indexes1, classes1, index1, path, 'diff-removed')
+        elif diff_type == 'Extra':
+            mark(nodes2, lines2, line_indexes2, classes2, index2, path, 'diff-added')
+        elif diff_type in ('Value mismatch', 'Type mismatch'):
+            mark(nodes1, lines1, line_indexes1, classes1, index1, path, 'diff-modified')
+            mark(nodes2, lines2, line_indexes2, classes2, index2, right_path, 'diff-modified')
+
+    return _render_lines(yaml1_str, lines1, classes1), _render_lines(yaml2_str, lines2, classes2)
+
+
+def _render_lines(yaml_str, lines, classes):
+    # Output drops the leading/trailing blank lines, as the panes always have
+    first = len(yaml_str) - len(yaml_str.lstrip())
+    skip = yaml_str[:first].count('\n')
+    stripped = yaml_str.strip().splitlines()
+
+    highlighted = []
+    for i, line in enumerate(stripped):
+        css_class = classes.get(i + skip)
+        highlighted.append(f'<span class="{css_class}">{line}</span>' if css_class else line)
+    return '\n'.join(highlighted)
+
+
+class YamlComparator(Comparator):
+    """
+    The /compare_yaml comparator. Its documents are parse_yaml_stream()
+    results, so every document of a multi-document stream is compared.
+    """
+
+    format = 'yaml'
+    label = 'YAML'
+    sample = ('name: a\nitems:\n  - 1\n  - 2\n', 'name: b\nitems:\n  - 1\n  - 3\nextra: true\n')
+
+    def options(self, data):
+        return json_compare_options(data)
+
+    def parse(self, text):
+        try:
+            return parse_yaml_stream(text)
+        except yaml.YAMLError as e:
+            raise ComparisonInputError(f'Invalid YAML: {str(e)}')
+
+    def baseline_document(self, baseline):
+        return baseline.yaml_stream()
+
+    def compare(self, comparison, max_differences=None):
+        # The JSON comparison, per document pair
+        with stage('compare'):
+            return compare_yaml_documents(comparison.doc1[0], comparison.doc2[0],
+                                          input_size=len(comparison.text1) + len(comparison.text2),
+                                          max_differences=max_differences, **comparison.options)
+
+    def highlight(self, text1, text2, diffs, comparison=None):
+        # Path-indexed via the parser's node marks
+        with stage('highlight'):
+            if comparison is None:
+                return highlight_yaml_strings(text1, text2, diffs)
+            return highlight_yaml_strings(text1, text2, diffs, comparison.doc1, comparison.doc2,
+                                          comparison.baseline.index['line_indexes'] if comparison.baseline else None)
+
+    def statistics(self, diffs):
+        return json_statistics(diffs)
+
+    def patch(self, comparison):
+        from patch_output import yaml_patch, render_json_patch
+        ops, truncated = yaml_patch(comparison.doc1[0], comparison.doc2[0], comparison.options['array_mode'],
+                                    comparison.options['array_key'], comparison.limit)
+        return render_json_patch(ops), 'application/json-patch+json', len(ops), truncated
+
+    def value_documents(self, comparison):
+        return comparison.doc1[0], comparison.doc2[0]